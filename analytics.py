@@ -0,0 +1,278 @@
+"""Daily activity rollups: posts, likes received, follower growth and DAU.
+
+Write paths add their deltas to `activity_daily` as they happen, so the
+stats endpoints read a handful of pre-aggregated rows instead of running
+GROUP BYs over `messages`, `likes` and `follows` on the live database.
+There is one row per (user, metric, day); site-wide totals are kept in
+the same table under user id 0. Every write would otherwise update that
+one site row, so site deltas are instead added up in memory once the
+write's transaction commits, and written in batches by a background
+thread along with the active users collected the same way. A crash loses
+at most `flush_interval` seconds of site totals; per-user rows are exact.
+`backfill()` fills in the days the rollups have no rows for from the
+existing rows, aggregating a batch at a time in the database.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, select
+
+from models import db, _insert, DailyActivity, DailyActiveUser, Message
+
+SITE = 0
+USER_METRICS = ('posts', 'likes_received', 'followers')
+SITE_METRICS = USER_METRICS + ('active_users',)
+
+
+def today():
+    return datetime.utcnow().date()
+
+
+def _day(value):
+    """func.date() gives a string on SQLite and a date on PostgreSQL."""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def site_totals(counts):
+    """{(SITE, metric, day): delta} summed from users' `counts`."""
+    totals = Counter()
+    for (user_id, metric, day), delta in counts.items():
+        if user_id != SITE:
+            totals[SITE, metric, day] += delta
+    return totals
+
+
+def add_counts(counts):
+    """Add {(user_id, metric, day): delta} to the rollups.
+
+    One upsert for all the rows, in the current transaction; the caller
+    commits. Returns the number of rows written.
+    """
+    rows = [{'user_id': user_id, 'metric': metric, 'day': day, 'count': n}
+            for (user_id, metric, day), n in counts.items() if n]
+    if rows:
+        stmt = _insert(DailyActivity.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'metric', 'day'],
+            set_={'count': DailyActivity.count + stmt.excluded.count})
+        db.session.execute(stmt, rows)
+    return len(rows)
+
+
+class ActivityStats:
+    """Records activity from the write paths and reads back daily series."""
+
+    def __init__(self, flush_interval=10.0):
+        self.app = None
+        self.flush_interval = flush_interval
+        self._seen = set()          # user ids already counted active today
+        self._seen_day = None
+        self._pending = set()       # (day, user_id) not yet written
+        self._site = Counter()      # committed site deltas not yet written
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """Use `app`'s database for background writes; flush on exit."""
+        self.app = app
+        atexit.register(self.flush)
+        event.listen(db.session, 'after_commit', self._committed)
+        event.listen(db.session, 'after_transaction_end', self._ended)
+
+    def clear(self):
+        with self._lock:
+            self._seen, self._seen_day, self._pending = set(), None, set()
+            self._site = Counter()
+
+    def posted(self, messages, delta=1):
+        """Count `messages` as posted (or, with delta=-1, deleted)."""
+        counts = Counter()
+        for msg in messages:
+            counts[msg.user_id, 'posts', msg.timestamp.date()] += delta
+        self._add(counts)
+
+    def followed(self, user_ids, delta=1):
+        """Count a follower gained (or, with delta=-1, lost) by each of `user_ids`."""
+        day = today()
+        self._add({(user_id, 'followers', day): delta for user_id in user_ids})
+
+    def _add(self, counts):
+        """Write users' `counts` now; hold their site totals until commit."""
+        add_counts(counts)
+        staged = db.session.info.setdefault('site_activity', Counter())
+        staged.update(site_totals(counts))
+
+    def _committed(self, session):
+        staged = session.info.pop('site_activity', None)
+        if staged:
+            with self._lock:
+                self._site.update(staged)
+            self._ensure_process()
+
+    @staticmethod
+    def _ended(session, transaction):
+        if transaction.parent is None:
+            session.info.pop('site_activity', None)  # rolled back
+
+    def liked(self, changed):
+        """Like-buffer listener: count likes received by the messages' authors.
+
+        `changed` is `likes.apply_batch()`'s
+        [(user_id, message_id, timestamp, +1/-1)].
+        Likes count on the day they are flushed, as follows do.
+        """
+        if not changed:
+            return
+        with self.app.app_context():
+            authors = dict(db.session.query(Message.id, Message.user_id)
+                           .filter(Message.id.in_({m for _, m, _, _ in changed})))
+            day = today()
+            counts = Counter()
+            for _, message_id, _, delta in changed:
+                if message_id in authors:
+                    counts[authors[message_id], 'likes_received', day] += delta
+            self._add(counts)
+            db.session.commit()
+
+    def active(self, user_id):
+        """Count `user_id` among today's active users, once per day.
+
+        Only notes the user in memory; `flush()` writes them. Users already
+        counted by this process are skipped, and across processes the
+        daily_active_users key keeps the count exact.
+        """
+        day = today()
+        with self._lock:
+            if day != self._seen_day:
+                self._seen, self._seen_day = set(), day
+            if user_id in self._seen:
+                return
+            self._seen.add(user_id)
+            self._pending.add((day, user_id))
+        self._ensure_process()
+
+    def flush(self):
+        """Write the pending active users and site totals in one transaction.
+
+        Returns the number of users newly counted.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, set()
+                site, self._site = self._site, Counter()
+            if not pending and not site:
+                return 0
+            added = []
+            try:
+                with self.app.app_context():
+                    if pending:
+                        added = db.session.execute(
+                            _insert(DailyActiveUser.__table__)
+                            .values([{'day': d, 'user_id': u} for d, u in pending])
+                            .on_conflict_do_nothing()
+                            .returning(DailyActiveUser.day)).scalars().all()
+                    site.update((SITE, 'active_users', _day(d)) for d in added)
+                    add_counts(site)
+                    db.session.commit()
+            except Exception:
+                with self._lock:
+                    self._pending |= pending
+                    self._site.update(site)
+                raise
+            return len(added)
+
+    def _ensure_process(self):
+        """Start the flusher for this process; again after a fork."""
+        if self._pid == os.getpid() or self.flush_interval <= 0:
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name='activity-flush').start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Flushing active users failed")
+
+    def series(self, user_id, metrics, days, end=None):
+        """Return (first day, {metric: [count per day]}), oldest day first.
+
+        Covers the `days` days ending on `end` (today); days without
+        activity count zero.
+        """
+        end = end or today()
+        start = end - timedelta(days=days - 1)
+        counts = {metric: [0] * days for metric in metrics}
+        rows = db.session.execute(
+            select(DailyActivity.metric, DailyActivity.day, DailyActivity.count)
+            .where(DailyActivity.user_id == user_id,
+                   DailyActivity.metric.in_(metrics),
+                   DailyActivity.day.between(start, end)))
+        for metric, day, count in rows:
+            counts[metric][(_day(day) - start).days] = count
+        return start, counts
+
+
+def _batches(column, batch_size):
+    """(low, high] ranges of `column` covering its values, `batch_size` wide."""
+    highest = db.session.query(func.max(column)).scalar() or 0
+    for low in range(0, highest, batch_size):
+        yield column > low, column <= low + batch_size
+
+
+def _tracked_days(metric):
+    """Days that already have rollup rows for `metric`."""
+    rows = db.session.query(DailyActivity.day).filter(DailyActivity.user_id == SITE,
+                                                      DailyActivity.metric == metric)
+    return {_day(day) for day, in rows}
+
+
+def backfill(batch_size=10000):
+    """Fill in the rollups for days that have none from the existing rows.
+
+    Rows already recorded, live or by an earlier run, are kept, so this
+    only adds history and is safe to rerun. Each batch is one GROUP BY over
+    an id range, so only per-(user, day) counts leave the database. Posts
+    and active users (the users who posted) are filled in for each day
+    without rows. Likes and follows are not: they have no timestamps, so
+    their history can't be placed on a day, and crediting it all to one
+    day would show a spike that never happened. Their series start when
+    live tracking did. Returns the number of rollup rows written.
+    """
+    counts = Counter()
+    active = set()
+
+    posts_days = _tracked_days('posts')
+    active_days = (_tracked_days('active_users')
+                   | {_day(d) for d, in db.session.query(DailyActiveUser.day).distinct()})
+    posted = func.date(Message.timestamp)
+    for bounds in _batches(Message.id, batch_size):
+        rows = (db.session.query(posted, Message.user_id, func.count())
+                .filter(*bounds)
+                .group_by(posted, Message.user_id))
+        for posted_day, user_id, n in rows:
+            posted_day = _day(posted_day)
+            if posted_day not in posts_days:
+                counts[user_id, 'posts', posted_day] += n
+            if posted_day not in active_days:
+                active.add((posted_day, user_id))
+
+    counts.update(site_totals(counts))
+    for active_day, _ in active:
+        counts[SITE, 'active_users', active_day] += 1
+
+    written = add_counts(counts)
+    if active:
+        db.session.execute(_insert(DailyActiveUser.__table__).on_conflict_do_nothing(),
+                           [{'day': d, 'user_id': u} for d, u in active])
+    db.session.commit()
+    return written
@@ -1,10 +1,37 @@
 import os
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+import sys
+import json
+import time
+import click
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, flash, redirect, session, g, url_for, abort, send_file, jsonify, Response, stream_with_context
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_login import login_required, current_user, LoginManager, login_user, logout_user
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from forms import UserAddForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Follows
+from timeline import RecentMessages, messages_by_ids
+from images import ImageCache, ImageFetchError, ImageRejected, VARIANTS, is_remote
+from assets import AssetManifest, build as build_assets
+from compression import CompressionMiddleware
+from templating import configure_bytecode_cache, warm_templates
+from likes import LikeBuffer, LikeIndexMissing, create_unique_index
+from trending import Trending
+from broker import Broker, PollingRelay
+from archive import MessageArchive
+from singleflight import SingleFlight, FlightTimeout
+from pagecache import PageCache, MemoryStore, FileStore
+from ingest import CommitTimeout, GroupCommit, validate as validate_messages
+from autocomplete import UsernameIndex, MAX_LIMIT as MAX_AUTOCOMPLETE
+from throttle import LoginThrottle, MemoryCounters, FileCounters
+import readmodel
+import recommend
+from analytics import ActivityStats, SITE, SITE_METRICS, USER_METRICS, backfill as backfill_activity
+from export import export as export_user, FORMATS as EXPORT_FORMATS
+from tags import index_messages, unindex_messages, tag_timeline, mention_timeline, backfill as backfill_tags, linkify
 
 CURR_USER_KEY = "curr_user"
 
@@ -18,9 +45,77 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-app.config['DEBUG'] = True
-app.config['ENV'] = 'development'
-toolbar = DebugToolbarExtension(app)
+# Off unless asked for with `flask --debug ...` or FLASK_DEBUG=1; only then
+# is the debug toolbar installed.
+app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', '0').lower() not in ('', '0', 'false', 'no')
+app.config['RECENT_MESSAGES_PER_AUTHOR'] = 100
+# Seconds before a worker reloads an author's buffer, picking up messages
+# posted or deleted through other workers.
+app.config['RECENT_MESSAGES_TTL'] = float(os.environ.get('RECENT_MESSAGES_TTL', 30))
+app.config['RECENT_MESSAGES_AUTHORS'] = int(os.environ.get('RECENT_MESSAGES_AUTHORS', 100000))
+app.config['IMAGE_CACHE_DIR'] = (
+    os.environ.get('IMAGE_CACHE_DIR',
+                   os.path.join(app.instance_path, 'image-cache')))
+# Seconds before an image URL that failed to download is tried again.
+app.config['IMAGE_FAILURE_TTL'] = float(os.environ.get('IMAGE_FAILURE_TTL', 300))
+app.config['ASSET_DIR'] = os.path.join(app.static_folder, 'dist')
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+app.config['TEMPLATE_CACHE_DIR'] = (
+    os.environ.get('TEMPLATE_CACHE_DIR',
+                   os.path.join(app.instance_path, 'jinja-cache')))
+app.config['TEMPLATE_WARMUP'] = os.environ.get('TEMPLATE_WARMUP', '1') == '1'
+app.config['LIKE_LOG_DIR'] = (
+    os.environ.get('LIKE_LOG_DIR', os.path.join(app.instance_path, 'like-log')))
+app.config['LIKE_FLUSH_INTERVAL'] = float(os.environ.get('LIKE_FLUSH_INTERVAL', 1.0))
+# Seconds between batched writes of the day's active users.
+app.config['ACTIVITY_FLUSH_INTERVAL'] = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 10.0))
+# Seconds between each worker's reloads of trending counts from the likes table.
+app.config['TRENDING_REFRESH'] = float(os.environ.get('TRENDING_REFRESH', 60))
+app.config['LIVE_QUEUE_SIZE'] = 100
+app.config['LIVE_HEARTBEAT'] = 15
+# Seconds between each worker's polls for messages posted through other workers.
+app.config['LIVE_POLL_INTERVAL'] = float(os.environ.get('LIVE_POLL_INTERVAL', 1.0))
+# Open /stream connections per worker process. Each holds a server thread,
+# so keep this below `flask serve --threads`; clients over the cap poll.
+app.config['LIVE_MAX_STREAMS'] = int(os.environ.get('LIVE_MAX_STREAMS', 4))
+app.config['ARCHIVE_DIR'] = (
+    os.environ.get('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive')))
+# Defaults to SQLALCHEMY_DATABASE_URI with its async driver; see asgi.py.
+app.config['ASYNC_DATABASE_URL'] = os.environ.get('ASYNC_DATABASE_URL')
+app.config['SINGLE_FLIGHT_TIMEOUT'] = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 10))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+app.config['PAGE_CACHE_TTL'] = float(os.environ.get('PAGE_CACHE_TTL', 30))
+app.config['PAGE_CACHE_STALE_TTL'] = float(os.environ.get('PAGE_CACHE_STALE_TTL', 60))
+# Shared by the worker processes on a host, so an invalidation reaches all
+# of them. Set to empty for an in-process cache (single-process servers).
+app.config['PAGE_CACHE_DIR'] = os.environ.get(
+    'PAGE_CACHE_DIR', os.path.join(app.instance_path, 'pagecache'))
+# How long a posted message waits for others to share its commit.
+app.config['GROUP_COMMIT_WINDOW'] = float(os.environ.get('GROUP_COMMIT_WINDOW', 0.002))
+# Seconds between reloads of the @mention index (picks up follower counts).
+app.config['USERNAME_INDEX_RELOAD'] = float(os.environ.get('USERNAME_INDEX_RELOAD', 300))
+# Seconds a typer's followee ids are cached for @mention ranking.
+app.config['USERNAME_FOLLOWING_TTL'] = float(os.environ.get('USERNAME_FOLLOWING_TTL', 60))
+# Failed logins allowed per account and per client IP in a sliding window.
+app.config['LOGIN_THROTTLE_WINDOW'] = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+app.config['LOGIN_MAX_PER_ACCOUNT'] = int(os.environ.get('LOGIN_MAX_PER_ACCOUNT', 5))
+app.config['LOGIN_MAX_PER_IP'] = int(os.environ.get('LOGIN_MAX_PER_IP', 20))
+# Set to share login throttling between worker processes.
+app.config['LOGIN_THROTTLE_DIR'] = os.environ.get('LOGIN_THROTTLE_DIR')
+# Reverse proxies in front of the app whose X-Forwarded-For/-Proto to trust;
+# without it, behind a proxy every client shares the proxy's address.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Client addresses allowed to read /metrics/*; comma-separated.
+app.config['METRICS_ALLOWED_IPS'] = frozenset(
+    ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(','))
+toolbar = DebugToolbarExtension(app) if app.debug else None
+app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                     level=app.config['COMPRESS_LEVEL'],
+                                     min_size=app.config['COMPRESS_MIN_SIZE'])
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -29,6 +124,62 @@ with app.app_context():
     connect_db(app)
     db.create_all()
 
+recent_messages = RecentMessages(app.config['RECENT_MESSAGES_PER_AUTHOR'],
+                                 ttl=app.config['RECENT_MESSAGES_TTL'],
+                                 max_authors=app.config['RECENT_MESSAGES_AUTHORS'])
+image_cache = ImageCache(app.config['IMAGE_CACHE_DIR'],
+                         failure_ttl=app.config['IMAGE_FAILURE_TTL'])
+image_signer = URLSafeSerializer(app.config['SECRET_KEY'], salt='image-proxy')
+asset_manifest = AssetManifest(app.config['ASSET_DIR'])
+app.add_template_global(asset_manifest.url, 'asset_url')
+app.add_template_filter(linkify, 'linkify')
+configure_bytecode_cache(app, app.config['TEMPLATE_CACHE_DIR'])
+
+like_buffer = LikeBuffer(app.config['LIKE_LOG_DIR'],
+                         flush_interval=app.config['LIKE_FLUSH_INTERVAL'])
+like_buffer.init_app(app)
+
+trending = Trending(refresh_interval=app.config['TRENDING_REFRESH'])
+trending.init_app(app)
+# scores move when buffered likes actually change rows in the likes table
+like_buffer.listeners.append(trending.update)
+activity = ActivityStats(flush_interval=app.config['ACTIVITY_FLUSH_INTERVAL'])
+activity.init_app(app)
+like_buffer.listeners.append(activity.liked)
+
+broker = Broker(maxsize=app.config['LIVE_QUEUE_SIZE'])
+
+message_archive = MessageArchive(app.config['ARCHIVE_DIR'])
+
+single_flight = SingleFlight(timeout=app.config['SINGLE_FLIGHT_TIMEOUT'])
+
+page_cache = PageCache(
+    FileStore(app.config['PAGE_CACHE_DIR']) if app.config['PAGE_CACHE_DIR'] else MemoryStore(),
+    ttl=app.config['PAGE_CACHE_TTL'], stale_ttl=app.config['PAGE_CACHE_STALE_TTL'])
+
+def invalidate_likers(changed):
+    """Like-buffer listener: drop cached profiles whose like count changed."""
+    if changed:
+        page_cache.invalidate(*{f'user:{user_id}' for user_id, _, _, _ in changed})
+
+# profiles show like counts, which only move once a flush commits
+like_buffer.listeners.append(invalidate_likers)
+
+# loaded on first lookup
+usernames = UsernameIndex(reload_interval=app.config['USERNAME_INDEX_RELOAD'],
+                          following_ttl=app.config['USERNAME_FOLLOWING_TTL'])
+usernames.init_app(app)
+
+login_throttle = LoginThrottle(
+    FileCounters(app.config['LOGIN_THROTTLE_DIR']) if app.config['LOGIN_THROTTLE_DIR'] else MemoryCounters(),
+    window=app.config['LOGIN_THROTTLE_WINDOW'],
+    max_per_account=app.config['LOGIN_MAX_PER_ACCOUNT'],
+    max_per_ip=app.config['LOGIN_MAX_PER_IP'])
+
+ONE_YEAR = 365 * 24 * 60 * 60
+# Endpoints whose responses set their own long-lived caching headers.
+LONG_CACHE_ENDPOINTS = {'image_proxy', 'asset'}
+
 
 ##############################################################################
 # User signup/login/logout
@@ -37,13 +188,27 @@ with app.app_context():
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# Views that only need the viewer's id, read straight from the session.
+SESSION_ONLY_ENDPOINTS = {'users_autocomplete'}
+
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
-    if CURR_USER_KEY in session:
+    if request.endpoint in SESSION_ONLY_ENDPOINTS:
+        g.user = None
+    elif CURR_USER_KEY in session:
         g.user = User.query.get(session[CURR_USER_KEY])
     else:
         g.user = None
+    if g.user:
+        activity.active(g.user.id)
+
+@app.before_request
+def restrict_metrics():
+    """Only let METRICS_ALLOWED_IPS read the /metrics/ counters."""
+    if (request.path.startswith('/metrics/')
+            and request.remote_addr not in app.config['METRICS_ALLOWED_IPS']):
+        abort(403)
 
 def do_login(user):
     """Log in user."""
@@ -81,6 +246,8 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            page_cache.invalidate('users')
+            usernames.add(user.id, user.username, user.image_url)
 
         except IntegrityError as e:
             db.session.rollback()
@@ -100,49 +267,146 @@ def login():
     """Handle user login."""
     form = LoginForm()
 
+    # refuse throttled attempts before looking up the user or hashing
+    if request.method == 'POST':
+        wait = login_throttle.check(request.form.get('username'), request.remote_addr)
+        if wait:
+            flash("Too many failed logins. Please try again later.", 'danger')
+            return (render_template('users/login.html', form=form), 429,
+                    {'Retry-After': str(wait)})
+
     if form.validate_on_submit():
         user = User.authenticate(form.username.data,
                                  form.password.data)
 
         if user:
+            login_throttle.succeeded(form.username.data)
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
 
+        login_throttle.failed(form.username.data, request.remote_addr)
         flash("Invalid credentials.", 'danger')
 
     return render_template('users/login.html', form=form)
 
 
+@app.route('/metrics/login-throttle')
+def login_throttle_metrics():
+    """Counters for login throttling in this process."""
+    return jsonify(login_throttle.stats())
+
+
+##############################################################################
+# Request coalescing
+#
+# Pages that many viewers hit at once load their viewer-independent data
+# through `single_flight`; the result is shared between threads, so it is
+# built from read-model rows rather than ORM objects.
+
+@app.errorhandler(FlightTimeout)
+def flight_timeout(e):
+    """Waited too long for a coalesced load; ask the client to retry."""
+    return "Service busy, please retry.", 503, {'Retry-After': '1'}
+
+
+@app.route('/metrics/single-flight')
+def single_flight_metrics():
+    """Counters for request coalescing in this process."""
+    return jsonify(single_flight.stats())
+
+
+##############################################################################
+# Anonymous page cache
+#
+# Views decorated with `page_cache.cached` are served whole from the cache
+# to logged-out visitors. They tag what they render ("user:<id>",
+# "message:<id>", "users"), and write routes invalidate those tags.
+
+@app.route('/metrics/page-cache')
+def page_cache_metrics():
+    """Counters for the anonymous page cache in this process."""
+    return jsonify(page_cache.stats())
+
+
 ##############################################################################
 # General user routes:
 
 @app.route('/users')
+@page_cache.cached(query_args=('q',))
 def list_users():
     """Page with listing of users.
     Can take a 'q' param in querystring to search by that username.
     """
-    search = request.args.get('q')
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    page_cache.tag('users')
+    users = readmodel.user_cards(request.args.get('q'))
     return render_template('users/index.html', users=users)
 
 
 @app.route('/users/<int:user_id>')
+@page_cache.cached(query_args=('before',))
 def users_show(user_id):
-    """Show user profile."""
-    user = User.query.get_or_404(user_id)
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    """Show user profile.
+
+    The first page comes from the author's recent-message buffer; older
+    pages (`?before=<message id>`) read the hot table and the archive.
+    Concurrent requests for the same page share one load.
+    """
+    page_cache.tag(f'user:{user_id}')
+    before = request.args.get('before', type=int)
+    user, messages, older = single_flight.do(
+        ('users_show', user_id, before), load_profile_page, user_id, before)
+    return render_template('users/show.html', user=user, messages=messages,
+                           older=older)
+
+
+def load_profile_page(user_id, before):
+    """Load the viewer-independent contents of a profile page."""
+    profile = readmodel.profile(user_id)
+    if profile is None:
+        abort(404)
+    if before:
+        messages = user_messages_before(user_id, before, TIMELINE_PAGE_SIZE)
+        page_size = TIMELINE_PAGE_SIZE
+    else:
+        # newest-first message ids come from the author's recent-message buffer
+        ids = [msg_id for _, msg_id in recent_messages.recent(user_id, 100)]
+        messages = readmodel.message_rows(ids)
+        page_size = 100
+    return profile, messages, older_page(user_id, messages, page_size)
+
+
+def older_page(user_id, messages, page_size):
+    """The `before` id for a profile page's "Older" link, or None.
+
+    A short page can still have archived messages behind it (an author
+    whose messages are all archived has an empty first page).
+    """
+    if len(messages) == page_size:
+        return messages[-1].id
+    newest = message_archive.newest_id(user_id, messages[-1].id if messages else None)
+    return newest + 1 if newest is not None else None
+
+
+def user_messages_before(user_id, before, limit):
+    """An author's messages with ids below `before`, hot or archived."""
+    hot = (Message.query
+           .filter(Message.user_id == user_id, Message.id < before)
+           .order_by(Message.id.desc())
+           .limit(limit)
+           .all())
+    archived = message_archive.timeline(user_id, before, limit)
+    newest = sorted(hot + archived, key=lambda msg: msg.id, reverse=True)[:limit]
+    return [readmodel.MessageRow.of(msg, readmodel.UserCard.of(msg.user))
+            for msg in newest]
+
+
+def hot_or_archived(ids):
+    """Hot or archived messages for `ids`, in the order of `ids`."""
+    found = {msg.id: msg for msg in messages_by_ids(ids)}
+    missing = [i for i in ids if i not in found]
+    found.update((msg.id, msg) for msg in message_archive.get_many(missing))
+    return [found[i] for i in ids if i in found]
 
 
 @app.route('/users/<int:user_id>/following')
@@ -151,7 +415,10 @@ def show_following(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(user_id)
+    user = readmodel.profile(user_id)
+    if user is None:
+        abort(404)
+    user.following = readmodel.following_cards(user_id)
     return render_template('users/following.html', user=user)
 
 
@@ -161,7 +428,10 @@ def users_followers(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(user_id)
+    user = readmodel.profile(user_id)
+    if user is None:
+        abort(404)
+    user.followers = readmodel.follower_cards(user_id)
     return render_template('users/followers.html', user=user)
 
 
@@ -171,9 +441,15 @@ def add_follow(follow_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if Follows.follow(g.user.id, [follow_id]):
+        activity.followed([follow_id])
+        recommend.mark_changed([g.user.id])
+    else:
+        # nothing inserted: already following, or no such user
+        User.query.get_or_404(follow_id)
     db.session.commit()
+    usernames.followed(g.user.id)
+    page_cache.invalidate(f'user:{g.user.id}', f'user:{follow_id}')
     return redirect(f"/users/{g.user.id}/following")
 
 
@@ -183,12 +459,104 @@ def stop_following(follow_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    if Follows.unfollow(g.user.id, [follow_id]):
+        activity.followed([follow_id], -1)
+        recommend.mark_changed([g.user.id])
     db.session.commit()
+    usernames.followed(g.user.id)
+    page_cache.invalidate(f'user:{g.user.id}', f'user:{follow_id}')
     return redirect(f"/users/{g.user.id}/following")
 
 
+MAX_BULK_FOLLOWS = 1000
+
+@app.route('/users/following/bulk', methods=['POST'])
+@login_required
+def bulk_follow():
+    """Follow or unfollow a list of users in one statement.
+
+    Takes JSON {"action": "follow" | "unfollow", "user_ids": [...]} and
+    returns how many follows were added or removed.
+    """
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    user_ids = data.get('user_ids')
+    if (action not in ('follow', 'unfollow') or not isinstance(user_ids, list)
+            or len(user_ids) > MAX_BULK_FOLLOWS
+            or not all(isinstance(i, int) for i in user_ids)):
+        abort(400)
+    change = Follows.follow if action == 'follow' else Follows.unfollow
+    before = set(readmodel.following_ids(g.user.id)).intersection(user_ids)
+    changed = change(g.user.id, user_ids)
+    if changed:
+        after = set(readmodel.following_ids(g.user.id)).intersection(user_ids)
+        activity.followed(after - before)
+        activity.followed(before - after, -1)
+        recommend.mark_changed([g.user.id])
+    db.session.commit()
+    if changed:
+        usernames.followed(g.user.id)
+        page_cache.invalidate(f'user:{g.user.id}', *(f'user:{i}' for i in user_ids))
+    return jsonify(action=action, changed=changed)
+
+
+@app.route('/users/autocomplete')
+def users_autocomplete():
+    """Complete an @mention: users whose username starts with `?q=`.
+
+    Returns JSON {"users": [{id, username, image_url}, ...]}, followees
+    first, then by follower count, at most `?limit=` long. Answered from
+    memory: the viewer is the session's user id, not a loaded User.
+    """
+    viewer_id = session.get(CURR_USER_KEY)
+    if viewer_id is None:
+        abort(401)
+    prefix = request.args.get('q', '').lstrip('@')
+    limit = request.args.get('limit', 8, type=int)
+    if not 1 <= limit <= MAX_AUTOCOMPLETE:
+        abort(400)
+    if not prefix:
+        return jsonify(users=[])
+    matches = usernames.complete(prefix, usernames.following(viewer_id),
+                                 exclude=viewer_id, limit=limit)
+    return jsonify(users=[{'id': user_id, 'username': username,
+                           'image_url': image_filter(image_url, 'thumb')}
+                          for user_id, username, image_url in matches])
+
+
+MAX_SUGGESTIONS = recommend.TOP_N
+
+@app.route('/users/suggestions')
+@login_required
+def user_suggestions():
+    """Who the current user might follow, from the last recommendation run.
+
+    Returns JSON {"suggestions": [{id, username, image_url, score}, ...]},
+    best first, at most `?limit=` long.
+    """
+    limit = request.args.get('limit', MAX_SUGGESTIONS, type=int)
+    if not 1 <= limit <= MAX_SUGGESTIONS:
+        abort(400)
+    return jsonify(suggestions=[
+        {'id': card.id, 'username': card.username, 'image_url': card.image_url,
+         'score': score}
+        for card, score in recommend.suggestions(g.user.id, limit)])
+
+
+@app.cli.command('recommend')
+@click.option('--changed-only', is_flag=True,
+              help="Only rebuild users whose follows changed since the last run.")
+@click.option('--top', default=recommend.TOP_N, show_default=True,
+              help="Suggestions kept per user.")
+def recommend_command(changed_only, top):
+    """Precompute "who to follow" suggestions from follows and likes."""
+    if changed_only:
+        count = recommend.refresh_changed(top)
+    else:
+        count = recommend.refresh(top)
+    click.echo(f"Refreshed suggestions for {count} users")
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 @login_required
 def profile():
@@ -207,6 +575,8 @@ def profile():
         current_user.location = form.location.data
 
         db.session.commit()
+        page_cache.invalidate('users', f'user:{current_user.id}')
+        usernames.add(current_user.id, current_user.username, current_user.image_url)
         flash("Profile updated successfully.", 'success')
         return redirect(url_for('users_show', user_id=g.user.id))
     return render_template('users/edit.html', form=form)
@@ -219,11 +589,62 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
     do_logout()
+    recent_messages.forget(g.user.id)
+    # follower counts change on the profiles of everyone they followed
+    # or were followed by
+    user_id = g.user.id
+    related = {*readmodel.following_ids(user_id), *readmodel.follower_ids(user_id)}
     db.session.delete(g.user)
     db.session.commit()
+    page_cache.invalidate('users', f'user:{user_id}', *(f'user:{i}' for i in related))
+    usernames.remove(user_id)
     return redirect("/signup")
 
 
+@app.route('/users/export')
+@login_required
+def export_account():
+    """Download all of the current user's data as NDJSON or CSV."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    filename = f"warbler-{g.user.username}.{fmt}"
+    return Response(stream_with_context(export_user(g.user.id, fmt,
+                                                    archive=message_archive)),
+                    mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.cli.command('archive-messages')
+@click.option('--older-than-days', type=int, default=None,
+              help="Archive whole months older than this (default ARCHIVE_AFTER_DAYS).")
+def archive_messages_command(older_than_days):
+    """Move old messages into compressed archive partitions."""
+    days = older_than_days or app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archived = message_archive.archive(cutoff)
+    for partition, count in archived.items():
+        click.echo(f"{partition}: archived {count} messages")
+    click.echo(f"Archived {sum(archived.values())} messages older than {cutoff:%Y-%m}")
+
+
+@app.cli.command('export-user')
+@click.argument('user_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='ndjson')
+@click.option('--output', type=click.File('wb'), default='-')
+def export_user_command(user_id, fmt, output):
+    """Stream one user's data to a file (or stdout)."""
+    if User.query.get(user_id) is None:
+        raise click.ClickException('no such user')
+    stats = {}
+    start = time.perf_counter()
+    for chunk in export_user(user_id, fmt, stats, archive=message_archive):
+        output.write(chunk)
+    elapsed = time.perf_counter() - start
+    click.echo(f"Exported {stats['rows']} rows in {elapsed:.2f}s "
+               f"({stats['rows'] / max(elapsed, 1e-9):.0f} rows/sec)", err=True)
+
+
 @app.route('/edit-profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
@@ -238,6 +659,8 @@ def edit_profile():
         current_user.header_image_url = form.header_image_url.data
         current_user.bio = form.bio.data
         db.session.commit()
+        page_cache.invalidate('users', f'user:{current_user.id}')
+        usernames.add(current_user.id, current_user.username, current_user.image_url)
         flash('Profile updated successfully.', 'success')
         return redirect(url_for('users_show', user_id=current_user.id))
     return render_template('edit.html', form=form, user=current_user)
@@ -246,6 +669,35 @@ def edit_profile():
 ##############################################################################
 # Messages routes:
 
+MAX_BATCH_MESSAGES = 500
+
+def save_messages(rows):
+    """Insert [(user_id, text), ...] in one transaction; return the new ids.
+
+    One multi-row INSERT, then the tag index and activity rollups in the
+    same transaction; caches and live subscribers are updated after the
+    commit.
+    """
+    msgs = db.session.scalars(
+        insert(Message).returning(Message, sort_by_parameter_order=True),
+        [{'user_id': user_id, 'text': text} for user_id, text in rows]).all()
+    index_messages(msgs)
+    activity.posted(msgs)
+    db.session.commit()
+    page_cache.invalidate(*{f'user:{msg.user_id}' for msg in msgs})
+    for msg in msgs:
+        recent_messages.add(msg)
+    live_relay.wake()
+    return [msg.id for msg in msgs]
+
+# Posts from concurrent requests share a commit; see ingest.py.
+group_commit = GroupCommit(save_messages, window=app.config['GROUP_COMMIT_WINDOW'])
+
+@app.errorhandler(CommitTimeout)
+def commit_timeout(e):
+    """The post waited too long for its batch and wasn't saved; retry."""
+    return "Service busy, please retry.", 503, {'Retry-After': '1'}
+
 @app.route('/messages/new', methods=["GET", "POST"])
 @login_required
 def messages_add():
@@ -254,33 +706,241 @@ def messages_add():
     """
     form = MessageForm()
     if form.validate_on_submit():
-        msg = Message(text=form.text.data, user_id=current_user.id)
-        db.session.add(msg)
-        db.session.commit()
+        group_commit.submit((current_user.id, form.text.data))
         return redirect(url_for('users_show', user_id=current_user.id))
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/api/messages', methods=["POST"])
+@login_required
+def messages_ingest():
+    """Post a batch of messages as the current user.
+
+    Takes JSON {"messages": [{"text": ...}, ...]}. The batch is written
+    only if every message is valid; otherwise returns 400 with the
+    index and reason of each invalid one. Returns the new ids in order.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('messages')
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_MESSAGES:
+        return jsonify(errors=[{'error': f"send 1 to {MAX_BATCH_MESSAGES} messages"}]), 400
+    texts, errors = validate_messages(items)
+    if errors:
+        return jsonify(errors=errors), 400
+    ids = save_messages([(current_user.id, text) for text in texts])
+    return jsonify(ids=ids), 201
+
+
+@app.route('/metrics/group-commit')
+def group_commit_metrics():
+    """Batches and messages written by group commit in this process."""
+    return jsonify(group_commit.stats())
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@page_cache.cached
 def messages_show(message_id):
-    """Show a message."""
-    msg = Message.query.get(message_id)
+    """Show a message, from the hot table or the archive."""
+    msg = single_flight.do(('messages_show', message_id), load_message, message_id)
+    page_cache.tag(f'message:{message_id}', f'user:{msg.user_id}')
     return render_template('messages/show.html', message=msg)
 
+
+def load_message(message_id):
+    """Snapshot a hot or archived message and its author."""
+    msg = Message.query.get(message_id) or message_archive.get(message_id)
+    if msg is None:
+        abort(404)
+    return readmodel.MessageRow.of(msg, readmodel.UserCard.of(msg.user))
+
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
 @login_required
 def messages_destroy(message_id):
     """Delete a message."""
-    msg = Message.query.get(message_id)
+    msg = Message.query.get(message_id) or message_archive.get(message_id)
+    if msg is None:
+        abort(404)
     if msg.user_id != current_user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
+    tags = (f'user:{msg.user_id}', f'message:{msg.id}')
+    if msg.archived:
+        # forget() commits, and may roll back and retry if it races another delete
+        message_archive.forget(msg.id)
+        activity.posted([msg], -1)
+        db.session.commit()
+        page_cache.invalidate(*tags)
+        return redirect(url_for('users_show', user_id=current_user.id))
+    activity.posted([msg], -1)
+    recent_messages.remove(msg)
+    trending.discard(msg.id)
+    unindex_messages([msg.id])
     db.session.delete(msg)
     db.session.commit()
+    page_cache.invalidate(*tags)
     return redirect(url_for('users_show', user_id=current_user.id))
+##############################################################################
+# Hashtag and mention timelines
+
+TIMELINE_PAGE_SIZE = 20
+
+@app.route('/tags/<tag>')
+def tag_messages(tag):
+    """Show messages with a hashtag, paged by `before` message id."""
+    before = request.args.get('before', type=int)
+    messages = tag_timeline(tag, before, TIMELINE_PAGE_SIZE, message_archive)
+    return render_template('messages/timeline.html', title=f"#{tag.lower()}",
+                           messages=messages, page_size=TIMELINE_PAGE_SIZE)
+
+@app.route('/mentions')
+@login_required
+def mentions():
+    """Show messages that @mention the current user."""
+    before = request.args.get('before', type=int)
+    messages = mention_timeline(g.user.id, before, TIMELINE_PAGE_SIZE, message_archive)
+    return render_template('messages/timeline.html', title=f"Mentions of @{g.user.username}",
+                           messages=messages, page_size=TIMELINE_PAGE_SIZE)
+
+@app.cli.command('backfill-tags')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_tags_command(batch_size):
+    """Index hashtags and mentions of all existing messages."""
+    count = backfill_tags(batch_size)
+    click.echo(f"Indexed {count} messages")
+
+
+##############################################################################
+# Live timeline updates
+
+def message_event(msg):
+    """Describe a message for live timeline clients."""
+    return {
+        'id': msg.id,
+        'text': msg.text,
+        'date': msg.timestamp.strftime('%d %B %Y'),
+        'user': {
+            'id': msg.user.id,
+            'username': msg.user.username,
+            'image_url': image_filter(msg.user.image_url, 'thumb'),
+        },
+    }
+
+def timeline_author_ids(user):
+    """Ids of the authors whose messages appear in `user`'s home feed."""
+    return {*readmodel.following_ids(user.id), user.id}
+
+def messages_since(author_ids, since_id, limit=100):
+    """Messages by `author_ids` newer than `since_id`, oldest first."""
+    return (Message.query
+            .filter(Message.user_id.in_(author_ids), Message.id > since_id)
+            .order_by(Message.id)
+            .limit(limit)
+            .all())
+
+def live_events(after_id, limit=100):
+    """[(id, author id, event)] for messages newer than `after_id`, for the relay."""
+    # a request context, as the events' image URLs are built with url_for
+    with app.test_request_context():
+        rows = db.session.execute(readmodel.message_rows_select()
+                                  .where(Message.id > after_id)
+                                  .order_by(Message.id)
+                                  .limit(limit))
+        return [(msg.id, msg.user_id, message_event(msg))
+                for msg in readmodel.build_message_rows(rows)]
+
+def latest_message_id():
+    with app.app_context():
+        return db.session.query(db.func.max(Message.id)).scalar()
+
+# Every worker polls the messages table, so posts made through any worker
+# reach the streams open on all of them.
+live_relay = PollingRelay(broker, live_events, latest_message_id,
+                          interval=app.config['LIVE_POLL_INTERVAL'])
+
+def sse(event):
+    return f"id: {event['id']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+
+@app.route('/messages/since')
+@login_required
+def messages_since_view():
+    """Messages posted to the home feed after `since_id`, for reconnects."""
+    since_id = request.args.get('since_id', 0, type=int)
+    messages = messages_since(timeline_author_ids(g.user), since_id)
+    return jsonify(messages=[message_event(msg) for msg in messages])
+
+@app.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events feed of new messages from followed authors.
+
+    Reconnecting clients send Last-Event-ID and first get what they missed.
+    A client too slow to keep up is sent a `reset` event and disconnected.
+    Each open stream holds a server thread, so past LIVE_MAX_STREAMS per
+    worker clients get a 503 and fall back to polling /messages/since.
+    """
+    author_ids = timeline_author_ids(g.user)
+    last_id = (request.headers.get('Last-Event-ID', type=int)
+               or request.args.get('since_id', type=int))
+    sub = broker.subscribe(author_ids, limit=app.config['LIVE_MAX_STREAMS'])
+    if sub is None:
+        return Response("Too many live connections; poll /messages/since.",
+                        503, {'Retry-After': '30'})
+    try:
+        live_relay.start()
+        backlog = ([message_event(msg) for msg in messages_since(author_ids, last_id)]
+                   if last_id else [])
+    except BaseException:
+        sub.close()
+        raise
+    heartbeat = app.config['LIVE_HEARTBEAT']
+
+    def events():
+        with sub:
+            seen = last_id or 0
+            for event in backlog:
+                seen = event['id']
+                yield sse(event)
+            while not sub.dropped:
+                event = sub.get(timeout=heartbeat)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event['id'] > seen:
+                    seen = event['id']
+                    yield sse(event)
+            yield "event: reset\ndata: {}\n\n"
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'X-Accel-Buffering': 'no'})
+    # a client gone before the first event never runs the generator's `with`
+    response.call_on_close(sub.close)
+    return response
+
+
 ##############################################################################
 # Like routes
 
+@app.before_request
+def start_like_buffer():
+    """Start this worker's like flusher, which also replays dead workers' logs."""
+    try:
+        like_buffer.start()
+    except LikeIndexMissing:
+        pass  # likes are refused below until the migration has run
+
+@app.errorhandler(LikeIndexMissing)
+def like_index_missing(e):
+    """Likes can't be flushed until `flask migrate-likes` has run."""
+    return "Likes are unavailable, please retry later.", 503, {'Retry-After': '30'}
+
+@app.cli.command('migrate-likes')
+def migrate_likes_command():
+    """Delete duplicate likes and add their (user_id, message_id) unique index.
+
+    Run with the web workers stopped.
+    """
+    removed = create_unique_index()
+    click.echo(f"Deleted {removed} duplicate likes; unique index in place")
+
 @app.route('/messages/<int:message_id>/like', methods=["POST"])
 @login_required
 def like_message(message_id):
@@ -289,54 +949,181 @@ def like_message(message_id):
     if message.user_id == current_user.id:
         flash("You cannot like your own warble.", "danger")
         return redirect(url_for('homepage'))
-    
-    like = Likes.query.filter_by(user_id=current_user.id, message_id=message_id).first()
-    if not like:
-        new_like = Likes(user_id=g.user.id, message_id=message_id)
-        db.session.add(new_like)
-        db.session.commit()
-        flash("Warble liked!", "success")
+
+    # buffered and written to the likes table by the next batch flush
+    like_buffer.record(current_user.id, message_id, True)
+    flash("Warble liked!", "success")
     return redirect(url_for('homepage'))
 
 @app.route('/messages/<int:message_id>/unlike', methods=["POST"])
 @login_required
 def unlike_message(message_id):
     """Unlike a message."""
-    like = Likes.query.filter_by(user_id=current_user.id, message_id=message_id).first()
-    if like:
-        db.session.delete(like)
-        db.session.commit()
-        flash("Warble unliked!", "success")
+    like_buffer.record(current_user.id, message_id, False)
+    flash("Warble unliked!", "success")
     return redirect(url_for('homepage'))
 
+def liked_message_ids(user_id):
+    """Ids of messages `user_id` likes, including not-yet-flushed likes."""
+    stored = db.session.execute(readmodel.liked_ids_select(user_id)).scalars()
+    return like_buffer.liked_ids(user_id, stored)
+
 @app.route('/users/<int:user_id>/likes')
 def user_likes(user_id):
     """Show liked warbles for a user."""
     user = User.query.get_or_404(user_id)
-    likes = Likes.query.filter_by(user_id=user_id).all()
-    liked_messages = [like.message for like in likes]
+    liked_messages = hot_or_archived(sorted(liked_message_ids(user_id)))
     return render_template('users/like.html', user=user, messages=liked_messages)
 
+@app.route('/trending')
+def trending_messages():
+    """Show the currently trending warbles."""
+    messages = readmodel.message_rows(trending.top(20))
+    return render_template('trending.html', messages=messages)
+
+
+@app.cli.command('recompute-trending')
+def recompute_trending_command():
+    """Score recently liked messages from the likes table.
+
+    Workers run the same recompute every TRENDING_REFRESH seconds; this
+    reports what they will load.
+    """
+    count = trending.recompute()
+    click.echo(f"Scored {count} recently liked messages")
+
+
+##############################################################################
+# Activity stats
+
+STATS_DAYS = 30
+MAX_STATS_DAYS = 366
+
+def stats_response(user_id, metrics):
+    """Daily counts of `metrics` for the last `?days=` days, oldest first."""
+    days = request.args.get('days', STATS_DAYS, type=int)
+    if not 1 <= days <= MAX_STATS_DAYS:
+        abort(400)
+    start, series = activity.series(user_id, metrics, days)
+    return jsonify(start=start.isoformat(), days=days, series=series)
+
+@app.route('/stats')
+def site_stats():
+    """Site-wide posts, likes, follows and daily active users."""
+    return stats_response(SITE, SITE_METRICS)
+
+@app.route('/users/<int:user_id>/stats')
+def user_stats(user_id):
+    """A user's posts, likes received and follower growth."""
+    User.query.get_or_404(user_id)
+    return stats_response(user_id, USER_METRICS)
+
+
+@app.cli.command('backfill-activity')
+@click.option('--batch-size', default=10000, show_default=True)
+def backfill_activity_command(batch_size):
+    """Fill in daily activity rollups missing for past days from existing rows."""
+    count = backfill_activity(batch_size)
+    click.echo(f"Wrote {count} daily activity rows")
+
+
+##############################################################################
+# Image proxy
+
+@app.template_filter('image')
+def image_filter(url, variant):
+    """Point a remote image URL at the local, resized image proxy."""
+    if url and url.startswith('/static/'):
+        return asset_manifest.url(url[len('/static/'):])
+    if not is_remote(url):
+        return url
+    return url_for('image_proxy', variant=variant, token=image_signer.dumps(url))
+
+
+@app.route('/images/<variant>/<token>')
+def image_proxy(variant, token):
+    """Serve a cached, resized copy of a user's remote image.
+
+    The token is the signed source URL, so only URLs we rendered ourselves
+    can be fetched. Unreachable sources fall back to the default images;
+    non-public hosts and decompression bombs are refused with a 400.
+    """
+    if variant not in VARIANTS:
+        abort(404)
+    try:
+        url = image_signer.loads(token)
+    except BadSignature:
+        abort(404)
+
+    try:
+        path, mimetype = image_cache.get(url, variant)
+    except ImageRejected:
+        abort(400)
+    except ImageFetchError:
+        if variant == 'header':
+            return redirect(User.header_image_url.default.arg)
+        return redirect(User.image_url.default.arg)
+
+    resp = send_file(path, mimetype=mimetype, max_age=ONE_YEAR, conditional=True)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+##############################################################################
+# Fingerprinted static assets
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted asset, precompressed if the client accepts it."""
+    found = asset_manifest.find(filename, request.accept_encodings)
+    if found is None:
+        abort(404)
+    path, encoding, mimetype = found
+
+    resp = send_file(path, mimetype=mimetype, max_age=ONE_YEAR, conditional=True)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist."""
+    manifest = build_assets(app.static_folder, app.config['ASSET_DIR'])
+    asset_manifest.reload()
+    click.echo(f"Built {len(manifest)} assets into {app.config['ASSET_DIR']}")
+
+
+##############################################################################
+# Template bytecode cache
+
+@app.cli.command('precompile-templates')
+def precompile_templates_command():
+    """Compile every template into the shared bytecode cache."""
+    names = warm_templates(app)
+    click.echo(f"Compiled {len(names)} templates into {app.config['TEMPLATE_CACHE_DIR']}")
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/')
+@page_cache.cached
 def homepage():
     """Show homepage:
     - anon users: no messages
     - logged in: 100 most recent messages of followed_users
     """
     if g.user:
-        following_ids = [f.id for f in g.user.following]
-        following_ids.append(g.user.id)
-        messages = (Message.query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        liked_message_ids = {like.message_id for like in g.user.likes}
-        return render_template('home.html', messages=messages, likes=liked_message_ids)
+        author_ids = [*readmodel.following_ids(g.user.id), g.user.id]
+        messages = readmodel.message_rows(recent_messages.feed(author_ids, 100))
+        likes = liked_message_ids(g.user.id)
+        return render_template('home.html', messages=messages, likes=likes)
     return render_template('home-anon.html')
 
 
@@ -350,11 +1137,61 @@ def homepage():
 @app.after_request
 def add_header(req):
     """Add non-caching headers on every request."""
+    if request.endpoint in LONG_CACHE_ENDPOINTS and req.status_code in (200, 304):
+        return req
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
     return req
 
+##############################################################################
+# Production server
+
+def refuse_debug():
+    if app.debug:
+        raise click.ClickException(
+            "Debug mode is on, which installs the debug toolbar; "
+            "unset FLASK_DEBUG (or drop --debug) to serve.")
+
+
+@app.cli.command('serve')
+@click.option('--bind', default='127.0.0.1:8000', show_default=True)
+@click.option('--workers', type=int, help="Default: 2 * CPUs + 1.")
+@click.option('--threads', type=int, default=8, show_default=True)
+@click.option('--max-requests', type=int, default=10000, show_default=True,
+              help="Recycle a worker after this many requests (0: never).")
+@click.option('--max-rss-mb', type=int,
+              help="Recycle a worker whose resident memory exceeds this.")
+@click.option('--memory-report-interval', type=int, default=60, show_default=True,
+              help="Seconds between per-worker memory reports (0: off).")
+def serve_command(bind, workers, threads, max_requests, max_rss_mb,
+                  memory_report_interval):
+    """Serve the app with preforked, copy-on-write workers."""
+    from server import serve
+
+    refuse_debug()
+    serve(app, bind=bind, workers=workers, threads=threads, max_requests=max_requests,
+          max_rss_mb=max_rss_mb, memory_report_interval=memory_report_interval)
+
+
+@app.cli.command('serve-async')
+@click.option('--bind', default='127.0.0.1:8000', show_default=True)
+@click.option('--workers', type=int, default=1, show_default=True)
+def serve_async_command(bind, workers):
+    """Serve the app over ASGI, with async feed, profile and message pages."""
+    import uvicorn
+
+    refuse_debug()
+    host, _, port = bind.rpartition(':')
+    uvicorn.run('asgi:application', host=host, port=int(port), workers=workers,
+                log_level='warning')
+
+
+# Compile every template at boot (all filters and globals are registered
+# by now), so no visitor pays for it on a worker's first request.
+if app.config['TEMPLATE_WARMUP']:
+    warm_templates(app)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
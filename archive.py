@@ -0,0 +1,354 @@
+"""Cold archive of old messages in compressed, read-only monthly partitions.
+
+Messages older than a cutoff are moved out of the hot `messages` table, one
+calendar month at a time, into a partition file under the archive
+directory. A partition file is a run of zlib-compressed JSON blocks of
+`block_size` messages in id order, followed by a JSON block index and its
+length:
+
+    [block][block]...[index JSON][8-byte big-endian index length]
+
+The `message_archive` table maps each archived message id to its author
+and partition, so a message (or an author's older messages) can be found
+with an index lookup followed by reading and inflating a single block.
+Partition files are never modified in place: deleting an archived message
+writes its partition again without it, under a new name, and removes the
+old file.
+
+Likes of an archived message are frozen into its record (`liked_by`); its
+likes, hashtag and mention rows move from the hot tables to the
+`archived_*` tables, so likes pages and tag and mention timelines still
+find it.
+"""
+
+import bisect
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import (db, ArchiveEntry, ArchivedLike, ArchivedMention, ArchivedTag,
+                    Likes, Mention, Message, MessageTag, User)
+
+FOOTER = struct.Struct('>Q')
+
+# hot table -> the table its rows move to when their message is archived
+MOVED = ((Likes, ArchivedLike), (MessageTag, ArchivedTag), (Mention, ArchivedMention))
+
+
+class ArchivedMessage:
+    """A read-only message loaded from an archive partition."""
+
+    __slots__ = ('id', 'user_id', 'timestamp', 'text', 'liked_by', 'user')
+    archived = True
+
+    def __init__(self, id, user_id, timestamp, text, liked_by, user=None):
+        self.id = id
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.text = text
+        self.liked_by = liked_by
+        self.user = user
+
+    def __repr__(self):
+        return f"<ArchivedMessage #{self.id} by {self.user_id}>"
+
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def next_month(when):
+    if when.month == 12:
+        return datetime(when.year + 1, 1, 1)
+    return datetime(when.year, when.month + 1, 1)
+
+
+class MessageArchive:
+    """Writes and reads message archive partitions in `directory`.
+
+    Block indexes and recently read blocks are cached in memory (at most
+    `cache_blocks` blocks), so repeated reads of archived messages don't
+    touch the disk.
+    """
+
+    def __init__(self, directory, block_size=256, cache_blocks=64):
+        self.directory = directory
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._indexes = {}
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, partition):
+        return os.path.join(self.directory, f'messages-{partition}.arc')
+
+    # Reading
+
+    def get(self, message_id):
+        """Return the archived message `message_id`, or None."""
+        found = self.get_many([message_id])
+        return found[0] if found else None
+
+    def get_many(self, ids):
+        """Return the archived messages among `ids`, in the order of `ids`."""
+        if not ids:
+            return []
+        entries = (db.session.query(ArchiveEntry.id, ArchiveEntry.partition)
+                   .filter(ArchiveEntry.id.in_(ids)))
+        by_partition = {}
+        for message_id, partition in entries:
+            by_partition.setdefault(partition, []).append(message_id)
+
+        by_id = {}
+        for partition, message_ids in by_partition.items():
+            for msg in self._read(partition, message_ids):
+                by_id[msg.id] = msg
+        messages = [by_id[i] for i in ids if i in by_id]
+        self._attach_users(messages)
+        return messages
+
+    def timeline(self, user_id, before=None, limit=20):
+        """Archived messages by `user_id`, newest first, with ids below `before`."""
+        query = (db.session.query(ArchiveEntry.id)
+                 .filter(ArchiveEntry.user_id == user_id))
+        if before:
+            query = query.filter(ArchiveEntry.id < before)
+        ids = [message_id for (message_id,) in
+               query.order_by(ArchiveEntry.id.desc()).limit(limit)]
+        return self.get_many(ids)
+
+    def newest_id(self, user_id, before=None):
+        """The id of `user_id`'s newest archived message below `before`, or None."""
+        query = (db.session.query(func.max(ArchiveEntry.id))
+                 .filter(ArchiveEntry.user_id == user_id))
+        if before:
+            query = query.filter(ArchiveEntry.id < before)
+        return query.scalar()
+
+    def forget(self, message_id):
+        """Delete an archived message, including its text on disk.
+
+        The message's partition is written again without it under a new
+        name, its other messages are repointed there, and the old file is
+        removed. That costs a rewrite of one month per delete, which is
+        fine for the occasional delete of an old message. Commits.
+        Returns whether the message was archived.
+        """
+        while True:
+            entry = db.session.get(ArchiveEntry, message_id)
+            if entry is None:
+                return False
+            old = entry.partition
+            records = [record for pos in range(len(self._index(old)['blocks']))
+                       for record in self._load_block(old, pos)
+                       if record[0] != message_id]
+            new = None
+            if records:
+                new = self._reserve(old.split('.')[0])
+                size = self.block_size
+                self._write_file(new, (records[i:i + size]
+                                       for i in range(0, len(records), size)))
+            db.session.delete(entry)
+            db.session.flush()
+            remaining = ArchiveEntry.query.filter_by(partition=old)
+            moved = (remaining.update({'partition': new}, synchronize_session=False)
+                     if new else remaining.count())
+            if moved == len(records):
+                db.session.commit()
+                break
+            # another process rewrote the partition first; start again from its copy
+            db.session.rollback()
+            if new:
+                os.remove(self.path(new))
+        self._evict(old)
+        os.remove(self.path(old))
+        return True
+
+    def _attach_users(self, messages):
+        user_ids = {msg.user_id for msg in messages}
+        if not user_ids:
+            return
+        users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))}
+        for msg in messages:
+            msg.user = users.get(msg.user_id)
+
+    def _read(self, partition, message_ids):
+        index = self._index(partition)
+        last_ids = [block[1] for block in index['blocks']]
+        wanted = {}
+        for message_id in message_ids:
+            pos = bisect.bisect_left(last_ids, message_id)
+            if pos < len(last_ids):
+                wanted.setdefault(pos, set()).add(message_id)
+
+        for pos, ids in wanted.items():
+            for record in self._block(partition, pos):
+                if record[0] in ids:
+                    message_id, user_id, timestamp, text, liked_by = record
+                    yield ArchivedMessage(message_id, user_id,
+                                          datetime.fromisoformat(timestamp),
+                                          text, tuple(liked_by))
+
+    def _index(self, partition):
+        path = self.path(partition)
+        index = self._indexes.get(path)
+        if index is None:
+            with open(path, 'rb') as f:
+                f.seek(-FOOTER.size, os.SEEK_END)
+                (length,) = FOOTER.unpack(f.read(FOOTER.size))
+                f.seek(-FOOTER.size - length, os.SEEK_END)
+                index = json.loads(f.read(length))
+            self._indexes[path] = index
+        return index
+
+    def _block(self, partition, pos):
+        key = (self.path(partition), pos)
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return self._blocks[key]
+
+        records = self._load_block(partition, pos)
+        with self._lock:
+            self._blocks[key] = records
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+        return records
+
+    def _load_block(self, partition, pos):
+        _, _, offset, length = self._index(partition)['blocks'][pos]
+        with open(self.path(partition), 'rb') as f:
+            f.seek(offset)
+            return json.loads(zlib.decompress(f.read(length)))
+
+    def _evict(self, partition):
+        path = self.path(partition)
+        with self._lock:
+            self._indexes.pop(path, None)
+            for key in [key for key in self._blocks if key[0] == path]:
+                del self._blocks[key]
+
+    # Writing
+
+    def archive(self, before):
+        """Archive every whole month of messages older than `before`.
+
+        Each month is written to a new partition file and then, in one
+        transaction, catalogued and deleted from the hot tables. Returns
+        {partition: message count}.
+        """
+        cutoff = month_start(before)
+        archived = {}
+        while True:
+            oldest = (db.session.query(func.min(Message.timestamp))
+                      .filter(Message.timestamp < cutoff).scalar())
+            if oldest is None:
+                return archived
+            start = month_start(oldest)
+            partition, count = self._archive_month(start, next_month(start))
+            archived[partition] = count
+
+    def _reserve(self, month):
+        """Claim the first free partition name for `month` ('2020-01', '2020-01.2', ...).
+
+        The name is claimed by creating its (empty) file, so processes
+        writing partitions at the same time never pick the same one.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        partition, n = month, 1
+        while True:
+            try:
+                os.close(os.open(self.path(partition), os.O_CREAT | os.O_EXCL))
+                return partition
+            except FileExistsError:
+                n += 1
+                partition = f"{month}.{n}"
+
+    def _archive_month(self, start, end):
+        partition = self._reserve(start.strftime('%Y-%m'))
+        in_month = (Message.timestamp >= start) & (Message.timestamp < end)
+        # Lock the month's messages until the move commits. A like, tag or
+        # mention inserted for one of them waits for the commit and then
+        # fails its foreign key, instead of landing after its message's
+        # rows were copied and being cascade-deleted with the message.
+        # SQLite has no FOR UPDATE, but other writers wait on its database
+        # lock from this transaction's first insert.
+        db.session.execute(select(func.count()).select_from(
+            select(Message.id).where(in_month).with_for_update().subquery()))
+        rows = (db.session.query(Message.id, Message.user_id,
+                                 Message.timestamp, Message.text)
+                .filter(in_month)
+                .order_by(Message.id)
+                .execution_options(yield_per=self.block_size))
+        count = self._write_file(partition, self._catalog(partition, rows))
+
+        ids = (db.session.query(ArchiveEntry.id)
+               .filter(ArchiveEntry.partition == partition)
+               .scalar_subquery())
+        for model, archived in MOVED:
+            columns = [column.name for column in archived.__table__.columns]
+            db.session.execute(archived.__table__.insert().from_select(
+                columns, select(*(getattr(model, name) for name in columns))
+                .where(model.message_id.in_(ids))))
+            (model.query.filter(model.message_id.in_(ids))
+             .delete(synchronize_session=False))
+        Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return partition, count
+
+    def _write_file(self, partition, blocks):
+        """Write `blocks` (lists of records in id order) as `partition`'s file.
+
+        Returns the number of records written.
+        """
+        path = self.path(partition)
+        tmp_path = f'{path}.tmp'
+        index = []
+        count = 0
+        with open(tmp_path, 'wb') as f:
+            for records in blocks:
+                data = zlib.compress(json.dumps(records).encode(), 9)
+                index.append([records[0][0], records[-1][0], f.tell(), len(data)])
+                f.write(data)
+                count += len(records)
+
+            footer = json.dumps({'blocks': index, 'count': count}).encode()
+            f.write(footer)
+            f.write(FOOTER.pack(len(footer)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return count
+
+    def _catalog(self, partition, rows):
+        """Yield `rows` as blocks of records, cataloguing each block's messages."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.block_size:
+                yield self._records(partition, batch)
+                batch = []
+        if batch:
+            yield self._records(partition, batch)
+
+    def _records(self, partition, rows):
+        """Records for one block of message rows, with their likes frozen in."""
+        ids = [row.id for row in rows]
+        liked_by = {}
+        likes = (db.session.query(Likes.message_id, Likes.user_id)
+                 .filter(Likes.message_id.in_(ids))
+                 .order_by(Likes.message_id, Likes.user_id))
+        for message_id, user_id in likes:
+            liked_by.setdefault(message_id, []).append(user_id)
+
+        db.session.execute(ArchiveEntry.__table__.insert(), [
+            {'id': row.id, 'user_id': row.user_id, 'partition': partition}
+            for row in rows])
+        return [[row.id, row.user_id, row.timestamp.isoformat(), row.text,
+                 liked_by.get(row.id, [])] for row in rows]
@@ -0,0 +1,235 @@
+"""ASGI entry point with async feed, profile and message pages.
+
+Serve with `flask serve-async` (or `uvicorn asgi:application`).
+
+`GET /`, `GET /users/<id>` and `GET /messages/<id>` are answered here, and
+their queries run on an AsyncSession (asyncpg for PostgreSQL, aiosqlite
+for SQLite). While one request waits on the database, the worker's event
+loop keeps serving others instead of parking a thread per request.
+
+Everything else is passed to the Flask WSGI app, which asgiref runs in a
+thread pool. So are the cases these handlers leave to it: logged-out
+visitors (whose pages come from the anonymous page cache), older profile
+pages (`?before=`), archived or missing messages, and unknown users. The
+same models, templates, session cookie and in-process like buffer are used
+by both paths.
+"""
+
+import gzip
+import io
+import re
+import sys
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import g, render_template, session
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import readmodel
+from app import app, activity, like_buffer, CURR_USER_KEY
+from compression import gzip_allowed, gzip_headers, negotiate
+from models import ArchiveEntry, Message, configure_sqlite
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+FEED_SIZE = 100
+
+
+def async_database_url(url):
+    """The async-driver equivalent of a SQLAlchemy database URL."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def wsgi_environ(scope):
+    """A body-less WSGI environ for an ASGI HTTP scope."""
+    host, port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _ids(db_session, stmt):
+    return tuple(row_id for (row_id,) in await db_session.execute(stmt))
+
+
+async def load_profile(db_session, user_id):
+    """Async `readmodel.profile()`."""
+    row = (await db_session.execute(readmodel.profile_select(user_id))).first()
+    return readmodel.build_profile(row) if row is not None else None
+
+
+async def load_viewer(db_session, user_id):
+    """The viewer's Profile, with the followee ids `is_following` tests."""
+    viewer = await load_profile(db_session, user_id)
+    if viewer is not None:
+        viewer.following = await _ids(db_session,
+                                      readmodel.following_ids_select(user_id))
+    return viewer
+
+
+async def newest_messages(db_session, author_ids, limit):
+    rows = await db_session.execute(
+        readmodel.message_rows_select()
+        .where(Message.user_id.in_(author_ids))
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit))
+    return readmodel.build_message_rows(rows)
+
+
+async def older_page(db_session, user_id, messages, page_size):
+    """Async `app.older_page()`."""
+    if len(messages) == page_size:
+        return messages[-1].id
+    query = select(func.max(ArchiveEntry.id)).where(ArchiveEntry.user_id == user_id)
+    if messages:
+        query = query.where(ArchiveEntry.id < messages[-1].id)
+    newest = (await db_session.execute(query)).scalar()
+    return newest + 1 if newest is not None else None
+
+
+class AsyncPages:
+    """ASGI app serving the hot read pages asynchronously.
+
+    Each handler returns rendered HTML, or None to hand the request to the
+    wrapped Flask app.
+    """
+
+    def __init__(self, flask_app, database_url=None):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        url = database_url or async_database_url(
+            flask_app.config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = create_async_engine(url)
+        configure_sqlite(self.engine.sync_engine,
+                         flask_app.config.get('SQLITE_PRAGMAS'))
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.routes = [
+            (re.compile(r'/'), self.homepage),
+            (re.compile(r'/users/(\d+)'), self.users_show),
+            (re.compile(r'/messages/(\d+)'), self.messages_show),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    args = [int(arg) for arg in match.groups()]
+                    if await self.render(scope, send, handler, args):
+                        return
+                    break
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def render(self, scope, send, handler, args):
+        """Run `handler` in a Flask request context; False if it passed."""
+        environ = wsgi_environ(scope)
+        ctx = self.flask_app.request_context(environ)
+        ctx.push()
+        try:
+            viewer_id = session.get(CURR_USER_KEY)
+            if viewer_id is None:
+                return False
+            async with self.sessions() as db_session:
+                g.user = await load_viewer(db_session, viewer_id)
+                if g.user is None:
+                    # the account is gone; Flask treats the visitor as anonymous
+                    return False
+                activity.active(viewer_id)
+                html = await handler(db_session, environ, *args)
+            if html is None:
+                return False
+            response = self.flask_app.response_class(html)
+            self.flask_app.session_interface.save_session(
+                self.flask_app, ctx.session, response)
+        finally:
+            ctx.pop()
+
+        response.headers['Cache-Control'] = 'public, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+        body = response.get_data()
+        config = self.flask_app.config
+        response.headers['Content-Length'] = str(len(body))
+        compress, headers = negotiate(response.status, response.headers.to_wsgi_list(),
+                                      gzip_allowed(environ), config['COMPRESS_MIN_SIZE'])
+        if compress:
+            body = gzip.compress(body, config['COMPRESS_LEVEL'])
+            headers = gzip_headers(headers) + [('Content-Length', str(len(body)))]
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return True
+
+    async def homepage(self, db_session, environ):
+        viewer = g.user
+        messages = await newest_messages(db_session, [*viewer.following, viewer.id],
+                                         FEED_SIZE)
+        stored = await _ids(db_session, readmodel.liked_ids_select(viewer.id))
+        likes = like_buffer.liked_ids(viewer.id, stored)
+        return render_template('home.html', messages=messages, likes=likes)
+
+    async def users_show(self, db_session, environ, user_id):
+        if environ['QUERY_STRING']:
+            return None
+        user = await load_profile(db_session, user_id)
+        if user is None:
+            return None
+        messages = await newest_messages(db_session, [user_id], FEED_SIZE)
+        older = await older_page(db_session, user_id, messages, FEED_SIZE)
+        return render_template('users/show.html', user=user, messages=messages,
+                               older=older)
+
+    async def messages_show(self, db_session, environ, message_id):
+        rows = await db_session.execute(
+            readmodel.message_rows_select().where(Message.id == message_id))
+        found = readmodel.build_message_rows(rows)
+        if not found:
+            return None
+        return render_template('messages/show.html', message=found[0])
+
+
+application = AsyncPages(app, app.config['ASYNC_DATABASE_URL'])
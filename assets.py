@@ -0,0 +1,141 @@
+"""Fingerprinted, precompressed static assets.
+
+`build()` copies every file under static/ into static/dist/ with a content
+hash in its name (style.css -> style.3f2a9c1e04b7.css), writes gzip and,
+when the `brotli` package is installed, brotli copies of text assets, and
+records the mapping in static/dist/manifest.json. Hashed names never change
+content, so they can be served with immutable, year-long caching.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip alone is still served
+    brotli = None
+
+ASSET_URL_PREFIX = '/assets/'
+MANIFEST_NAME = 'manifest.json'
+
+# Only text formats benefit from compression; images are already compressed.
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)/static/([^'")]+)\1\s*\)''')
+
+
+def fingerprint(filename, data):
+    """Return `filename` with the first 12 hex digits of its hash inserted."""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def build(static_dir, out_dir):
+    """Fingerprint and precompress every file in `static_dir` into `out_dir`.
+
+    Returns the manifest mapping logical names to fingerprinted names.
+    """
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        if os.path.abspath(dirpath) == os.path.abspath(out_dir):
+            dirnames[:] = []
+            continue
+        dirnames[:] = [d for d in dirnames
+                       if os.path.abspath(os.path.join(dirpath, d))
+                       != os.path.abspath(out_dir)]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            sources.append(os.path.relpath(path, static_dir).replace(os.sep, '/'))
+
+    manifest = {}
+    # Stylesheets go last so their url() references can use hashed names.
+    for filename in sorted(sources, key=lambda f: (f.endswith('.css'), f)):
+        with open(os.path.join(static_dir, filename), 'rb') as f:
+            data = f.read()
+        if filename.endswith('.css'):
+            data = _rewrite_css_urls(data, manifest)
+
+        hashed = fingerprint(filename, data)
+        dest = os.path.join(out_dir, hashed)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'wb') as f:
+            f.write(data)
+        if os.path.splitext(filename)[1] in COMPRESSIBLE:
+            _precompress(dest, data)
+        manifest[filename] = hashed
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _rewrite_css_urls(data, manifest):
+    """Point /static/... url() references at their fingerprinted copies."""
+    def replace(match):
+        quote, filename = match.groups()
+        if filename not in manifest:
+            return match.group(0)
+        return f"url({quote}{ASSET_URL_PREFIX}{manifest[filename]}{quote})"
+    return CSS_URL_RE.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _precompress(dest, data):
+    """Write .gz (and .br) siblings of `dest`, if they are actually smaller."""
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(dest + '.gz', 'wb') as f:
+            f.write(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            with open(dest + '.br', 'wb') as f:
+                f.write(br)
+
+
+class AssetManifest:
+    """Maps logical static filenames to their fingerprinted URLs.
+
+    Without a built manifest (e.g. in development) URLs fall back to the
+    plain /static/ path.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.reload()
+
+    def reload(self):
+        """Re-read manifest.json from disk."""
+        try:
+            with open(os.path.join(self.out_dir, MANIFEST_NAME)) as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+
+    def url(self, filename):
+        """Return the URL to reference static file `filename` by."""
+        filename = filename.lstrip('/')
+        if filename in self.files:
+            return ASSET_URL_PREFIX + self.files[filename]
+        return '/static/' + filename
+
+    def find(self, filename, accept_encodings=()):
+        """Return (path, content_encoding, mimetype) for a hashed asset.
+
+        The brotli or gzip copy is picked when the client accepts it and one
+        was built. Returns None for unknown files.
+        """
+        path = safe_join(self.out_dir, filename)
+        if path is None or filename == MANIFEST_NAME or not os.path.isfile(path):
+            return None
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accept_encodings and os.path.isfile(path + suffix):
+                return path + suffix, encoding, mimetype
+        return path, None, mimetype
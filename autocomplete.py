@@ -0,0 +1,186 @@
+"""In-memory @mention autocomplete over usernames.
+
+Usernames are kept lower-cased in one sorted list, so the names starting
+with a prefix are a contiguous slice found with two binary searches.
+Matches are ranked with users the typer follows first, then by follower
+count, then alphabetically. Short prefixes match thousands of names,
+so the most popular matches of a wide slice are computed once and cached
+until a name is added or removed.
+
+Each process keeps its own index. Signups, renames and deletes update
+it in place. Follower counts, and names changed by other processes, are
+refreshed by reloading from the database every `reload_interval` seconds,
+in a background thread while lookups keep using the current index.
+
+Typers' followee ids are cached next to the index for `following_ttl`
+seconds, so a keystroke needs no query at all. Follows made in this
+process drop the cached ids; those made in other processes show up
+within the TTL.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+
+from models import db, Follows, User
+
+MAX_LIMIT = 20
+
+
+class UsernameIndex:
+    """Sorted prefix index of usernames, ranked per typer."""
+
+    def __init__(self, reload_interval=300, scan_limit=500,
+                 following_ttl=60, max_typers=10000):
+        self.reload_interval = reload_interval
+        self.scan_limit = scan_limit
+        self.following_ttl = following_ttl
+        self.max_typers = max_typers
+        self.app = None
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._refresher = None
+        self.clear()
+
+    def init_app(self, app):
+        """Use `app`'s database for background reloads."""
+        self.app = app
+
+    def clear(self):
+        """Forget everything; the next lookup reloads from the database."""
+        with self._lock:
+            self._keys = []             # sorted [(lower-cased username, user_id)]
+            self._users = {}            # {user_id: (username, image_url)}
+            self._followers = {}        # {user_id: follower count}
+            self._popular = {}          # {prefix: best-ranked ids} for wide prefixes
+            self._following = OrderedDict()  # {typer id: (expires, followee ids)}
+            self._loaded_at = None
+
+    def load(self):
+        """Rebuild from the users and follows tables."""
+        users = {user_id: (username, image_url) for user_id, username, image_url
+                 in db.session.query(User.id, User.username, User.image_url)}
+        followers = dict(db.session.query(Follows.user_being_followed_id, func.count())
+                         .group_by(Follows.user_being_followed_id))
+        keys = sorted((username.lower(), user_id)
+                      for user_id, (username, _) in users.items())
+        with self._lock:
+            self._keys, self._users, self._followers = keys, users, followers
+            self._popular = {}
+            self._loaded_at = time.monotonic()
+
+    def add(self, user_id, username, image_url):
+        """Index a new user, or a user whose username or image changed."""
+        with self._lock:
+            self._discard(user_id)
+            self._users[user_id] = (username, image_url)
+            bisect.insort(self._keys, (username.lower(), user_id))
+            self._popular = {}
+
+    def following(self, user_id):
+        """`user_id`'s followee ids, cached for `following_ttl` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._following.get(user_id)
+            if cached is not None and cached[0] > now:
+                self._following.move_to_end(user_id)
+                return cached[1]
+        ids = frozenset(db.session.scalars(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id)))
+        with self._lock:
+            self._following[user_id] = (now + self.following_ttl, ids)
+            self._following.move_to_end(user_id)
+            while len(self._following) > self.max_typers:
+                self._following.popitem(last=False)
+        return ids
+
+    def followed(self, user_id):
+        """Drop `user_id`'s cached followees after they follow or unfollow."""
+        with self._lock:
+            self._following.pop(user_id, None)
+
+    def remove(self, user_id):
+        """Drop a deleted user."""
+        with self._lock:
+            self._discard(user_id)
+            self._followers.pop(user_id, None)
+            self._following.pop(user_id, None)
+            self._popular = {}
+
+    def _discard(self, user_id):
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            key = (old[0].lower(), user_id)
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def _key(self, user_id):
+        return self._users[user_id][0].lower()
+
+    def _rank(self, user_id):
+        return (-self._followers.get(user_id, 0), self._key(user_id))
+
+    def _most_popular(self, prefix):
+        """The 2 * MAX_LIMIT best-ranked ids whose username starts with `prefix`.
+
+        That is enough to fill MAX_LIMIT results after dropping the typer
+        and their followees, who are ranked separately.
+        """
+        if prefix in self._popular:
+            return self._popular[prefix]
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        hi = bisect.bisect_left(self._keys, (prefix + '\uffff',))
+        popular = heapq.nsmallest(2 * MAX_LIMIT,
+                                  (user_id for _, user_id in self._keys[lo:hi]),
+                                  key=self._rank)
+        if hi - lo > self.scan_limit:
+            self._popular[prefix] = popular
+        return popular
+
+    def complete(self, prefix, following=(), exclude=None, limit=8):
+        """[(user_id, username, image_url)] of the best matches for `prefix`.
+
+        `following` are the typer's followees, ranked first; `exclude`
+        (the typer) is left out.
+        """
+        prefix = prefix.lower()
+        self._ensure_loaded()
+        with self._lock:
+            followed = sorted((user_id for user_id in following
+                               if user_id in self._users and user_id != exclude
+                               and self._key(user_id).startswith(prefix)),
+                              key=self._rank)[:limit]
+            skip = {*followed, exclude}
+            rest = [user_id for user_id in self._most_popular(prefix)
+                    if user_id not in skip]
+            return [(user_id, *self._users[user_id])
+                    for user_id in (followed + rest)[:limit]]
+
+    def _ensure_loaded(self):
+        """Load on first use; after that, reload in the background when stale."""
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.load()
+            return
+        if time.monotonic() - self._loaded_at <= self.reload_interval:
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._reload, daemon=True,
+                                               name='username-index-reload')
+            self._refresher.start()
+
+    def _reload(self):
+        try:
+            with self.app.app_context():
+                self.load()
+        except Exception:
+            self.app.logger.exception("Reloading the username index failed")
@@ -0,0 +1,112 @@
+"""The same workload on tuned SQLite, default SQLite and PostgreSQL.
+
+Each backend runs in its own process, since the app binds its database
+at import. The process seeds a fresh database from the generator CSVs
+and times the app's hot operations: feed, profile and search reads, and
+single-post and batch writes. PostgreSQL is taken from
+BENCH_POSTGRES_URL (default postgresql:///warbler-bench) and skipped if
+it can't be reached. Its tables are dropped and re-created.
+
+Run with: python -m benchmarks.backends [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKENDS = {
+    'sqlite': lambda: f"sqlite:///{tempfile.mkdtemp()}/warbler-bench.db",
+    'sqlite-default': lambda: f"sqlite:///{tempfile.mkdtemp()}/warbler-bench.db",
+    'postgresql': lambda: os.environ.get('BENCH_POSTGRES_URL',
+                                         'postgresql:///warbler-bench'),
+}
+
+
+def operations(user_id):
+    """{name: callable} of the timed operations."""
+    from app import save_messages
+    from models import Message
+    import readmodel
+
+    following = [*readmodel.following_ids(user_id), user_id]
+
+    def feed():
+        from models import db
+        rows = db.session.execute(
+            readmodel.message_rows_select()
+            .where(Message.user_id.in_(following))
+            .order_by(Message.timestamp.desc())
+            .limit(100))
+        return readmodel.build_message_rows(rows)
+
+    return {
+        'feed (100 msgs)': feed,
+        'profile': lambda: readmodel.profile(user_id),
+        'user search': lambda: readmodel.user_cards('an'),
+        'post 1 message': lambda: save_messages([(user_id, "Benchmark post")]),
+        'post 100 messages': lambda: save_messages([(user_id, "Benchmark post")] * 100),
+    }
+
+
+def worker(name, url, runs):
+    """Seed `url`, time each operation; print {operation: best ms} as JSON."""
+    os.environ['DATABASE_URL'] = url
+    os.environ.setdefault('TEMPLATE_WARMUP', '0')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    if name == 'sqlite-default':
+        import models
+        models.SQLITE_PRAGMAS = {}
+
+    from app import app
+    from benchmarks.readmodel import seed, busiest_user_id
+
+    results = {}
+    # save_messages() builds image URLs for live events, which needs a request
+    with app.test_request_context('/'):
+        seed()
+        for op_name, op in operations(busiest_user_id()).items():
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                op()
+                times.append((time.perf_counter() - start) * 1000)
+            results[op_name] = min(times)
+    print(json.dumps(results))
+
+
+def reachable(url):
+    from sqlalchemy import create_engine
+    try:
+        with create_engine(url).connect():
+            return True
+    except Exception:
+        return False
+
+
+def run(runs=20):
+    results = {}
+    for name, make_url in BACKENDS.items():
+        url = make_url()
+        if name == 'postgresql' and not reachable(url):
+            print(f"{name}: {url} unreachable, skipped", file=sys.stderr)
+            continue
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.backends', '--worker', name, url, str(runs)],
+            capture_output=True, text=True, check=True).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+
+    names = list(results)
+    print(f"best of {runs}, ms")
+    print(f"{'operation':20}" + ''.join(f"{name:>16}" for name in names))
+    for op_name in next(iter(results.values())):
+        print(f"{op_name:20}" + ''.join(f"{results[name][op_name]:16.2f}" for name in names))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        worker(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        run(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,40 @@
+"""Compare gzip levels on a 100-message home feed and the user list.
+
+Run with: python -m benchmarks.compression
+"""
+
+import sys
+import timeit
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from compression import CompressionMiddleware
+from benchmarks.fixtures import render_page, load_users
+
+
+def page_app(body):
+    def app(environ, start_response):
+        return Response(body, content_type='text/html')(environ, start_response)
+    return app
+
+
+def run(levels=(1, 3, 6, 9), number=200):
+    pages = {
+        'home.html (100 msgs)': render_page('home.html').encode(),
+        'users/index.html': render_page('users/index.html', users=load_users()).encode(),
+    }
+    print(f"{'page':24} {'level':>5} {'bytes':>8} {'ratio':>6} {'ms/resp':>8}")
+    for name, body in pages.items():
+        print(f"{name:24} {'-':>5} {len(body):8d} {1:6.2f} {'-':>8}")
+        for level in levels:
+            client = Client(CompressionMiddleware(page_app(body), level=level))
+
+            def request():
+                return client.get('/', headers={'Accept-Encoding': 'gzip'}).data
+
+            size = len(request())
+            secs = timeit.timeit(request, number=number) / number
+            print(f"{name:24} {level:5d} {size:8d} {len(body) / size:6.2f} {secs * 1000:8.3f}")
+
+
+if __name__ == '__main__':
+    run(number=int(sys.argv[1]) if len(sys.argv) > 1 else 200)
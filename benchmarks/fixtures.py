@@ -0,0 +1,84 @@
+"""Shared sample data for the benchmark scripts.
+
+Builds plain objects shaped like `User`/`Message` from the generator CSVs,
+so templates can be rendered without a database.
+"""
+
+import os
+import tempfile
+from csv import DictReader
+from datetime import datetime
+from types import SimpleNamespace
+
+GENERATOR_DIR = os.path.join(os.path.dirname(__file__), '..', 'generator')
+
+
+def bench_database_url():
+    """BENCH_DATABASE_URL, or else a new SQLite file in a temporary directory.
+
+    Never DATABASE_URL: the scripts seed the database they are pointed at.
+    The temporary file is recorded as BENCH_DATABASE_URL, so later calls
+    and child processes use the same one.
+    """
+    if not os.environ.get('BENCH_DATABASE_URL'):
+        os.environ['BENCH_DATABASE_URL'] = (
+            f"sqlite:///{tempfile.mkdtemp()}/warbler-bench.db")
+    return os.environ['BENCH_DATABASE_URL']
+
+
+class SampleUser(SimpleNamespace):
+    """Plain stand-in for `User` with the methods templates call."""
+
+    def is_following(self, other_user):
+        return any(user.id == other_user.id for user in self.following)
+
+    def is_followed_by(self, other_user):
+        return any(user.id == other_user.id for user in self.followers)
+
+    message_count = property(lambda self: len(self.messages))
+    following_count = property(lambda self: len(self.following))
+    followers_count = property(lambda self: len(self.followers))
+    likes_count = property(lambda self: len(self.likes))
+
+
+def load_users():
+    """Return the sample users, numbered from 1 like the seeded table."""
+    with open(os.path.join(GENERATOR_DIR, 'users.csv')) as f:
+        users = [SampleUser(id=i, messages=[], following=[], followers=[],
+                           likes=[], **row)
+                 for i, row in enumerate(DictReader(f), start=1)]
+    return users
+
+
+def load_messages(users, n=100):
+    """Return the `n` newest sample messages, attached to `users`."""
+    by_id = {u.id: u for u in users}
+    with open(os.path.join(GENERATOR_DIR, 'messages.csv')) as f:
+        rows = list(DictReader(f))
+    messages = []
+    for i, row in enumerate(rows, start=1):
+        user = by_id[int(row['user_id'])]
+        msg = SimpleNamespace(
+            id=i,
+            text=row['text'],
+            timestamp=datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S.%f'),
+            user_id=user.id,
+            user=user,
+        )
+        user.messages.append(msg)
+        messages.append(msg)
+    messages.sort(key=lambda m: m.timestamp, reverse=True)
+    return messages[:n]
+
+
+def render_page(template, n=100, **context):
+    """Render `template` with a logged-in user and `n` feed messages."""
+    from flask import g, render_template
+    from app import app
+
+    users = load_users()
+    messages = load_messages(users, n)
+    with app.test_request_context('/'):
+        g.user = users[0]
+        return render_template(template, user=users[0], messages=messages,
+                               likes=set(), **context)
@@ -0,0 +1,77 @@
+"""Message write throughput: one commit per post, group commit, batches.
+
+Seeds a throwaway SQLite database (unless BENCH_DATABASE_URL is set), then for
+`duration` seconds has `concurrency` threads post messages:
+
+* per-post: each post is its own transaction, as the form used to do;
+* group:    posts go through `group_commit`, sharing commits;
+* batch:    each thread posts 100 messages per call, as the JSON API does.
+
+Run with: python -m benchmarks.ingest [concurrency] [duration]
+"""
+
+import os
+import sys
+import threading
+import time
+
+from benchmarks.fixtures import bench_database_url
+
+os.environ['DATABASE_URL'] = bench_database_url()
+os.environ.setdefault('TEMPLATE_WARMUP', '0')
+
+from app import app, save_messages, group_commit
+from models import db
+from benchmarks.readmodel import seed, busiest_user_id
+
+BATCH = 100
+
+MODES = {
+    'per-post': (lambda user_id: save_messages([(user_id, "Benchmark post")]), 1),
+    'group': (lambda user_id: group_commit.submit((user_id, "Benchmark post")), 1),
+    'batch': (lambda user_id: save_messages([(user_id, "Benchmark post")] * BATCH), BATCH),
+}
+
+
+def load(post, per_call, user_id, concurrency, duration):
+    """Return (messages/sec, errors)."""
+    posted = []
+    errors = []
+    stop = time.monotonic() + duration
+
+    def client():
+        count = 0
+        # message_event() builds image URLs, which needs a request context
+        with app.test_request_context():
+            while time.monotonic() < stop:
+                try:
+                    post(user_id)
+                    count += per_call
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+        posted.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(posted) / duration, len(errors)
+
+
+def run(concurrency=16, duration=3):
+    with app.app_context():
+        seed()
+        user_id = busiest_user_id()
+
+    print(f"{concurrency} concurrent writers, {duration}s per mode")
+    print(f"{'mode':9} {'msgs/s':>8} {'errors':>6}")
+    for mode, (post, per_call) in MODES.items():
+        rate, errors = load(post, per_call, user_id, concurrency, duration)
+        print(f"{mode:9} {rate:8.0f} {errors:6d}")
+    print(f"group commit: {group_commit.stats()}")
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,226 @@
+"""Microbenchmarks of model and template hot paths, checked against baselines.
+
+For each dataset size, seeds a throwaway SQLite database (or the empty
+BENCH_DATABASE_URL) with generated users, messages, follows and likes,
+then measures:
+
+* `User.authenticate` (dominated by bcrypt, by design);
+* `User.is_following`, including loading the follow list;
+* the home feed query as `homepage()` builds it, with cold and warm
+  recent-message buffers;
+* rendering `home.html` and `users/show.html` with 100 messages.
+
+Each operation reports its median time and the peak memory allocated
+while it runs (traced in a separate run, so tracing doesn't skew the
+times). Results are compared with benchmarks/baselines/micro.json, and
+the script exits non-zero when an operation is slower or allocates more
+than its baseline by over `--tolerance`. Baselines are only comparable
+on the machine that recorded them; refresh them with `--update`.
+
+Run with: python -m benchmarks.micro [--sizes small,medium] [--update]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import bench_database_url
+
+os.environ['DATABASE_URL'] = bench_database_url()
+os.environ.setdefault('TEMPLATE_WARMUP', '0')
+
+from flask import g, render_template
+from sqlalchemy import select
+from app import app, recent_messages
+from models import bcrypt, db, User, Message, Follows, Likes
+import readmodel
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'micro.json')
+
+# name: (users, messages, follows per user, likes per user)
+SIZES = {
+    'small': (50, 1000, 10, 20),
+    'medium': (500, 10000, 50, 50),
+    'large': (2000, 50000, 200, 100),
+}
+
+PASSWORD = 'password'
+WORDS = ("warble flask query cache index render feed page user follow like "
+         "python template session commit batch").split()
+
+
+def seed(size, rng_seed=0, reseed=False):
+    """Fill a fresh schema with the `size` dataset; return the users' ids.
+
+    Only drops tables when `reseed`ing a database this run filled itself;
+    otherwise refuses a database that already has rows.
+    """
+    n_users, n_messages, n_follows, n_likes = SIZES[size]
+    rng = random.Random(rng_seed)
+    if reseed:
+        db.drop_all()
+    db.create_all()
+    if not reseed and any(db.session.execute(select(table).limit(1)).first()
+                          for table in db.metadata.sorted_tables):
+        raise SystemExit(f"{db.engine.url!r} is not empty; "
+                         f"set BENCH_DATABASE_URL to an empty database")
+
+    # one hash for everybody: hashing each password would dominate seeding
+    password = bcrypt.generate_password_hash(PASSWORD).decode()
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password': password, 'image_url': '/static/images/default-pic.png',
+         'header_image_url': '/static/images/warbler-hero.jpg'}
+        for i in range(1, n_users + 1)])
+
+    start = datetime(2024, 1, 1)
+    db.session.execute(Message.__table__.insert(), [
+        {'id': i, 'user_id': rng.randint(1, n_users),
+         'text': ' '.join(rng.choices(WORDS, k=rng.randint(3, 15)))[:140],
+         'timestamp': start + timedelta(seconds=rng.randrange(365 * 86400))}
+        for i in range(1, n_messages + 1)])
+
+    user_ids = range(1, n_users + 1)
+    follows = []
+    likes = []
+    for user_id in user_ids:
+        for other in rng.sample(user_ids, min(n_follows + 1, n_users)):
+            if other != user_id and len(follows) < user_id * n_follows:
+                follows.append({'user_following_id': user_id,
+                                'user_being_followed_id': other})
+        likes.extend({'user_id': user_id, 'message_id': message_id}
+                     for message_id in rng.sample(range(1, n_messages + 1), n_likes))
+    db.session.execute(Follows.__table__.insert(), follows)
+    db.session.execute(Likes.__table__.insert(), likes)
+    db.session.commit()
+
+
+def viewer_id():
+    """The user following the most others, so their feed is the largest."""
+    return (db.session.query(Follows.user_following_id)
+            .group_by(Follows.user_following_id)
+            .order_by(db.func.count().desc()).limit(1).scalar())
+
+
+def operations(user_id):
+    """{name: (setup, op, runs)}; `setup()`'s result is passed to `op`."""
+    def fresh_user():
+        db.session.remove()
+        return db.session.get(User, user_id)
+
+    def feed(_):
+        author_ids = [*readmodel.following_ids(user_id), user_id]
+        return readmodel.message_rows(recent_messages.feed(author_ids, 100))
+
+    def cold_feed():
+        recent_messages.clear()
+
+    def render_home(_):
+        g.user = db.session.get(User, user_id)
+        render_template('home.html', messages=home_messages, likes=set())
+
+    def render_profile(_):
+        g.user = None
+        render_template('users/show.html', user=profile, messages=profile_messages,
+                        older=profile_messages[-1].id if profile_messages else None)
+
+    home_messages = feed(None)
+    profile = readmodel.profile(user_id)
+    profile_messages = readmodel.message_rows(
+        [msg_id for _, msg_id in recent_messages.recent(user_id, 100)])
+    last_followed = db.session.get(User, readmodel.following_ids(user_id)[-1])
+
+    return {
+        'authenticate': (lambda: None,
+                         lambda _: User.authenticate(f'user{user_id}', PASSWORD), 5),
+        'is_following': (fresh_user, lambda user: user.is_following(last_followed), 50),
+        'feed query (cold)': (cold_feed, feed, 20),
+        'feed query (warm)': (lambda: None, feed, 50),
+        'render home.html': (lambda: None, render_home, 50),
+        'render users/show.html': (lambda: None, render_profile, 50),
+    }
+
+
+def measure(setup, op, runs):
+    """Return (median ms, peak KiB)."""
+    times = []
+    for _ in range(runs):
+        arg = setup()
+        start = time.perf_counter()
+        op(arg)
+        times.append((time.perf_counter() - start) * 1000)
+
+    arg = setup()
+    tracemalloc.start()
+    op(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak / 1024
+
+
+def compare(size, results, baseline, tolerance):
+    """Print results against `baseline`; return the names that regressed."""
+    regressed = []
+    print(f"\n{size}: {' / '.join(map(str, SIZES[size]))} "
+          f"(users / messages / follows per user / likes per user)")
+    print(f"{'operation':24} {'ms':>9} {'base ms':>9} {'peak KiB':>9} {'base KiB':>9}")
+    for name, (ms, kib) in results.items():
+        base = baseline.get(name)
+        flag = ''
+        if base:
+            if ms > base['ms'] * (1 + tolerance) or kib > base['peak_kib'] * (1 + tolerance):
+                flag = '  REGRESSED'
+                regressed.append(name)
+            print(f"{name:24} {ms:9.3f} {base['ms']:9.3f} {kib:9.0f} {base['peak_kib']:9.0f}{flag}")
+        else:
+            print(f"{name:24} {ms:9.3f} {'-':>9} {kib:9.0f} {'-':>9}")
+    return regressed
+
+
+def run(sizes, update=False, tolerance=0.25):
+    try:
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    regressed = []
+    with app.test_request_context('/'):
+        for i, size in enumerate(sizes):
+            seed(size, reseed=i > 0)
+            recent_messages.clear()
+            results = {name: measure(*spec)
+                       for name, spec in operations(viewer_id()).items()}
+            regressed += [f"{size}: {name}" for name in
+                          compare(size, results, baselines.get(size, {}), tolerance)]
+            baselines[size] = {name: {'ms': round(ms, 4), 'peak_kib': round(kib, 1)}
+                               for name, (ms, kib) in results.items()}
+
+    if update:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaselines written to {BASELINE_PATH}")
+    elif regressed:
+        print(f"\nRegressed beyond {tolerance:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument('--update', action='store_true',
+                        help="record these results as the new baselines")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown or allocation growth (0.25 = 25%%)")
+    args = parser.parse_args()
+    sys.exit(run(args.sizes.split(','), args.update, args.tolerance))
@@ -0,0 +1,125 @@
+"""ORM instances versus read-model rows on list pages.
+
+Seeds a throwaway SQLite database (or the empty BENCH_DATABASE_URL) from
+the generator CSVs, then for each
+page loads its data through the ORM (as the views used to) and through
+`readmodel`, renders it, and reports the best time and the peak memory
+allocated while loading and rendering.
+
+Run with: python -m benchmarks.readmodel
+"""
+
+import os
+import time
+import tracemalloc
+from csv import DictReader
+from datetime import datetime
+
+from benchmarks.fixtures import GENERATOR_DIR, bench_database_url
+
+os.environ['DATABASE_URL'] = bench_database_url()
+os.environ.setdefault('TEMPLATE_WARMUP', '0')
+
+from flask import g, render_template
+from sqlalchemy import select
+from app import app
+from models import db, User, Message, Follows
+from timeline import messages_by_ids
+import readmodel
+
+
+def read_csv(name):
+    with open(os.path.join(GENERATOR_DIR, name)) as f:
+        return list(DictReader(f))
+
+
+def seed():
+    """Load the generator CSVs; refuses a database that already has rows."""
+    db.create_all()
+    if any(db.session.execute(select(table).limit(1)).first()
+           for table in db.metadata.sorted_tables):
+        raise SystemExit(f"{db.engine.url!r} is not empty; "
+                         f"set BENCH_DATABASE_URL to an empty database")
+    db.session.execute(User.__table__.insert(), read_csv('users.csv'))
+    messages = read_csv('messages.csv')
+    for row in messages:
+        row['timestamp'] = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S.%f')
+    db.session.execute(Message.__table__.insert(), messages)
+    db.session.execute(Follows.__table__.insert(), read_csv('follows.csv'))
+    db.session.commit()
+
+
+def busiest_user_id():
+    return (db.session.query(Follows.user_following_id)
+            .group_by(Follows.user_following_id)
+            .order_by(db.func.count().desc()).limit(1).scalar())
+
+
+def newest_ids(n=100):
+    return [i for (i,) in db.session.query(Message.id)
+            .order_by(Message.timestamp.desc()).limit(n)]
+
+
+def pages(user_id, feed_ids):
+    """{page: (orm loader, read-model loader)}; each returns (template, context)."""
+    def following_orm():
+        return 'users/following.html', {'user': db.session.get(User, user_id)}
+
+    def following_rows():
+        user = readmodel.profile(user_id)
+        user.following = readmodel.following_cards(user_id)
+        return 'users/following.html', {'user': user}
+
+    return {
+        'users/index.html': (
+            lambda: ('users/index.html', {'users': User.query.all()}),
+            lambda: ('users/index.html', {'users': readmodel.user_cards()})),
+        'following.html': (following_orm, following_rows),
+        'home.html (100 msgs)': (
+            lambda: ('home.html', {'messages': messages_by_ids(feed_ids), 'likes': set()}),
+            lambda: ('home.html', {'messages': readmodel.message_rows(feed_ids),
+                                   'likes': set()})),
+    }
+
+
+def load_and_render(load, viewer_id):
+    db.session.remove()
+    g.user = db.session.get(User, viewer_id)
+    template, context = load()
+    render_template(template, **context)
+
+
+def measure(load, viewer_id, runs):
+    """Return (best ms, peak kB) for a load + render in a fresh session.
+
+    Memory is traced on a separate run so tracing doesn't skew the times.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        load_and_render(load, viewer_id)
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    load_and_render(load, viewer_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1024
+
+
+def run(runs=20):
+    with app.app_context():
+        seed()
+        user_id = busiest_user_id()
+        feed_ids = newest_ids()
+
+    print(f"{'page':22} {'path':10} {'ms':>8} {'peak kB':>9}")
+    with app.test_request_context('/'):
+        for name, loaders in pages(user_id, feed_ids).items():
+            for path, load in zip(('orm', 'readmodel'), loaders):
+                ms, peak = measure(load, user_id, runs)
+                print(f"{name:22} {path:10} {ms:8.2f} {peak:9.0f}")
+
+
+if __name__ == '__main__':
+    run()
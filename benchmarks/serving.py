@@ -0,0 +1,118 @@
+"""Concurrent-request throughput of the WSGI and ASGI serving modes.
+
+Seeds a throwaway SQLite database (unless BENCH_DATABASE_URL is set), starts
+`flask serve` (gunicorn, threaded) and then `flask serve-async` (uvicorn)
+with one worker each, and for each of the feed, profile and message pages
+keeps `concurrency` keep-alive clients busy for `duration` seconds.
+Reports requests per second and latency percentiles.
+
+For numbers that reflect network round trips to the database, point
+BENCH_DATABASE_URL at an empty PostgreSQL database.
+
+Run with: python -m benchmarks.serving [concurrency] [duration]
+"""
+
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.fixtures import bench_database_url
+
+os.environ['DATABASE_URL'] = bench_database_url()
+os.environ.setdefault('TEMPLATE_WARMUP', '0')
+
+from flask.sessions import SecureCookieSessionInterface
+from app import app, CURR_USER_KEY
+from benchmarks.readmodel import seed, busiest_user_id, newest_ids
+
+PORT = 8765
+MODES = {
+    'wsgi': ['serve', '--workers', '1', '--threads', '8',
+             '--memory-report-interval', '0'],
+    'asgi': ['serve-async', '--workers', '1'],
+}
+
+
+def session_cookie(user_id):
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    value = serializer.dumps({CURR_USER_KEY: user_id, '_user_id': str(user_id)})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def start_server(mode):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', '--no-debug', *MODES[mode],
+         '--bind', f'127.0.0.1:{PORT}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', PORT), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def load(path, cookie, concurrency, duration):
+    """Return (requests/sec, p50 ms, p99 ms, errors)."""
+    latencies = []
+    errors = []
+    stop = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', PORT)
+        mine = []
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            conn.request('GET', path, headers={'Cookie': cookie})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+            mine.append(time.perf_counter() - start)
+        conn.close()
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return len(latencies) / duration, pct(0.5), pct(0.99), len(errors)
+
+
+def run(concurrency=32, duration=5):
+    with app.app_context():
+        seed()
+        user_id = busiest_user_id()
+        message_id = newest_ids(1)[0]
+    cookie = session_cookie(user_id)
+    paths = ['/', f'/users/{user_id}', f'/messages/{message_id}']
+
+    print(f"{concurrency} concurrent clients, {duration}s per page")
+    print(f"{'page':16} {'mode':5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for mode in MODES:
+        proc = start_server(mode)
+        try:
+            for path in paths:
+                rps, p50, p99, errors = load(path, cookie, concurrency, duration)
+                print(f"{path:16} {mode:5} {rps:8.0f} {p50:8.1f} {p99:8.1f} {errors:6d}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,52 @@
+"""First-request versus steady-state template render latency.
+
+For each page, times a render in a fresh Jinja environment (what a new
+worker sees) with no bytecode cache, then with a populated bytecode cache,
+then a steady-state render of an already-loaded template.
+
+Run with: python -m benchmarks.templates
+"""
+
+import tempfile
+import time
+from flask import g
+from jinja2 import FileSystemBytecodeCache
+from app import app
+from benchmarks.fixtures import load_users, load_messages
+
+PAGES = ['home.html', 'users/show.html', 'users/index.html', 'messages/show.html']
+
+
+def render_ms(env, name, context):
+    start = time.perf_counter()
+    env.get_template(name).render(context)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(steady_runs=50):
+    users = load_users()
+    messages = load_messages(users, 100)
+
+    print(f"{'template':20} {'cold ms':>8} {'bytecode ms':>12} {'steady ms':>10}")
+    with app.test_request_context('/'):
+        g.user = users[0]
+        context = dict(user=users[0], users=users, messages=messages,
+                       message=messages[0], likes=set())
+        app.update_template_context(context)
+
+        for name in PAGES:
+            cache = FileSystemBytecodeCache(tempfile.mkdtemp())
+            # overlay() with a cache_size starts from an empty template cache
+            cold_env = app.jinja_env.overlay(bytecode_cache=cache, cache_size=400)
+            cold = render_ms(cold_env, name, context)
+
+            warm_env = app.jinja_env.overlay(bytecode_cache=cache, cache_size=400)
+            warm = render_ms(warm_env, name, context)
+
+            steady = min(render_ms(warm_env, name, context)
+                         for _ in range(steady_runs))
+            print(f"{name:20} {cold:8.2f} {warm:12.2f} {steady:10.2f}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,173 @@
+"""In-process publish/subscribe broker for live timeline updates.
+
+Subscribers register interest in a set of topics (author ids) and read
+events from a bounded queue. A subscriber whose queue is full is a slow
+consumer: it is dropped rather than allowed to hold memory or block the
+publisher, and is expected to reconnect and catch up with `since_id`.
+
+A Broker only delivers events published in its own process. PollingRelay
+feeds one from a source every process shares (the messages table): it
+polls for rows newer than the last one it published, so a message posted
+through any worker reaches the subscribers of every worker.
+"""
+
+import logging
+import os
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One consumer's bounded queue of events."""
+
+    def __init__(self, broker, topics, maxsize):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        self.dropped = False
+        self._queue = queue.Queue(maxsize)
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrives within `timeout`."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Broker:
+    """Fan events out to the subscribers of each topic."""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._subscribers = {}      # {topic: set(Subscription)}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics, limit=None):
+        """Return a Subscription to every topic in `topics`.
+
+        Returns None instead if there are already `limit` subscribers.
+        """
+        sub = Subscription(self, topics, self.maxsize)
+        with self._lock:
+            if limit is not None and self._count() >= limit:
+                return None
+            for topic in sub.topics:
+                self._subscribers.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._remove(sub)
+
+    def publish(self, topic, event):
+        """Queue `event` for each subscriber of `topic`; return how many got it."""
+        with self._lock:
+            subs = list(self._subscribers.get(topic, ()))
+        delivered = 0
+        for sub in subs:
+            try:
+                sub._queue.put_nowait(event)
+                delivered += 1
+            except queue.Full:
+                sub.dropped = True
+                with self._lock:
+                    if self._remove(sub):
+                        self.dropped += 1
+        return delivered
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def _remove(self, sub):
+        """Remove `sub` from every topic; True if it was still subscribed."""
+        removed = False
+        for topic in sub.topics:
+            subs = self._subscribers.get(topic)
+            if subs and sub in subs:
+                subs.discard(sub)
+                removed = True
+                if not subs:
+                    del self._subscribers[topic]
+        return removed
+
+
+class PollingRelay:
+    """Publishes new rows of a shared source to a Broker, in id order.
+
+    `fetch(after_id)` returns [(id, topic, event)] newer than `after_id`,
+    oldest first; `latest()` returns the newest id. Polling runs on a
+    background thread, every `interval` seconds or as soon as `wake()` is
+    called, and only while the broker has subscribers.
+    """
+
+    def __init__(self, broker, fetch, latest, interval=1.0):
+        self.broker = broker
+        self.fetch = fetch
+        self.latest = latest
+        self.interval = interval
+        self._last_id = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def start(self):
+        """Make sure this process's polling thread is running.
+
+        Also starts the relay at the newest row if it isn't running yet,
+        so subscribers only get rows from now on (older ones are theirs
+        to fetch as a backlog).
+        """
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = self.latest() or 0
+            if self._pid != os.getpid():
+                # first use in this process (or in a forked worker)
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True,
+                                 name='relay').start()
+
+    def wake(self):
+        """Poll now, e.g. right after this process stored new rows."""
+        self._wake.set()
+
+    def poll(self):
+        """Publish the rows added since the last poll; return how many."""
+        with self._lock:
+            if not self.broker.subscriber_count():
+                # nobody listening; start again from the newest row later
+                self._last_id = None
+                return 0
+            after_id = self._last_id
+        if after_id is None:
+            return 0
+        rows = self.fetch(after_id)
+        with self._lock:
+            for row_id, topic, event in rows:
+                self.broker.publish(topic, event)
+                self._last_id = row_id
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Relay poll failed")
@@ -0,0 +1,206 @@
+"""WSGI middleware that gzips responses for clients that accept it.
+
+Bodies are compressed chunk by chunk as the wrapped app yields them, so
+streamed responses are never buffered whole. Only text-like content types
+over `min_size` bytes are compressed; 304s, HEAD requests, ranges and
+bodies that already carry a Content-Encoding pass through untouched.
+A strong ETag on a compressed response is made weak, since the gzipped
+bytes differ from the identity body the ETag was computed for.
+"""
+
+import zlib
+from itertools import chain
+
+COMPRESSIBLE_TYPES = (
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/csv',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+)
+
+# Statuses whose bodies are empty or must not be transformed.
+SKIP_STATUSES = {'204', '206', '304'}
+
+
+def accepts_gzip(accept_encoding):
+    """Does an Accept-Encoding header value allow gzip?"""
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def gzip_allowed(environ):
+    """May the response to this WSGI request be gzipped at all?"""
+    return (accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING'))
+            and environ.get('REQUEST_METHOD') != 'HEAD'
+            and 'HTTP_RANGE' not in environ)
+
+
+def negotiate(status, headers, gzip_ok, min_size):
+    """Return (compress?, headers) for a response's status line and headers."""
+    names = {name.lower(): value for name, value in headers}
+    content_type = names.get('content-type', '').split(';')[0].strip().lower()
+    if (status[:3] in SKIP_STATUSES
+            or content_type not in COMPRESSIBLE_TYPES
+            or 'content-encoding' in names):
+        return False, headers
+
+    headers = _add_vary(headers, names)
+    if not gzip_ok:
+        return False, headers
+    length = names.get('content-length')
+    if length is not None and length.isdigit() and int(length) < min_size:
+        return False, headers
+    return True, headers
+
+
+def gzip_headers(headers):
+    """`headers` for the gzipped body: Content-Encoding set, Content-Length
+    dropped (the caller adds the compressed length if it knows it) and any
+    strong ETag made weak."""
+    headers = [(name, _weak_etag(value) if name.lower() == 'etag' else value)
+               for name, value in headers if name.lower() != 'content-length']
+    return headers + [('Content-Encoding', 'gzip')]
+
+
+class CompressionMiddleware:
+    """Gzip-compress eligible responses of the wrapped WSGI app.
+
+    `level` (1-9) trades CPU for bandwidth; `min_size` is the smallest body
+    worth compressing. Both can be changed on the instance at runtime.
+    """
+
+    def __init__(self, app, level=6, min_size=500):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        gzip_ok = gzip_allowed(environ)
+        state = {}
+
+        def _start_response(status, headers, exc_info=None):
+            state['response'] = (status, headers, exc_info)
+            state.setdefault('written', [])
+            return state['written'].append
+
+        app_iter = self.app(environ, _start_response)
+        if 'response' not in state:
+            # The app defers start_response until iteration; decide then.
+            return self._deferred(app_iter, gzip_ok, state, start_response)
+
+        status, headers, exc_info = state['response']
+        compress, headers = self._negotiate(status, headers, gzip_ok)
+        if not compress:
+            start_response(status, headers, exc_info)
+            if state['written']:
+                return _Closing(chain(state['written'], app_iter), app_iter)
+            return app_iter
+        body = self._gzip_body(chain(state['written'], app_iter), status,
+                               headers, exc_info, start_response)
+        return _Closing(body, app_iter)
+
+    def _deferred(self, app_iter, gzip_ok, state, start_response):
+        iterator = iter(app_iter)
+        try:
+            first = [next(iterator)]
+        except StopIteration:
+            first = []
+        except BaseException:
+            _close(app_iter)
+            raise
+        status, headers, exc_info = state['response']
+        compress, headers = self._negotiate(status, headers, gzip_ok)
+        body = chain(state['written'], first, iterator)
+        if not compress:
+            start_response(status, headers, exc_info)
+            return _Closing(body, app_iter)
+        body = self._gzip_body(body, status, headers, exc_info, start_response)
+        return _Closing(body, app_iter)
+
+    def _negotiate(self, status, headers, gzip_ok):
+        """Return (compress?, headers) for a response."""
+        return negotiate(status, headers, gzip_ok, self.min_size)
+
+    def _gzip_body(self, iterator, status, headers, exc_info, start_response):
+        has_length = any(name.lower() == 'content-length' for name, _ in headers)
+
+        # Without a Content-Length we only know the body is big enough
+        # once min_size bytes have arrived.
+        head, size = [], 0
+        if not has_length:
+            for chunk in iterator:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                start_response(status, headers, exc_info)
+                yield b''.join(head)
+                return
+
+        start_response(status, gzip_headers(headers), exc_info)
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        if head:
+            yield compressor.compress(b''.join(head)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        for chunk in iterator:
+            if chunk:
+                # Sync-flush each chunk so streamed output reaches the client.
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class _Closing:
+    """Iterable that forwards close() to the wrapped app's iterable."""
+
+    def __init__(self, iterable, closer):
+        self._iterable = iterable
+        self._closer = closer
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            _close(self._iterable)
+        finally:
+            _close(self._closer)
+
+
+def _close(iterable):
+    close = getattr(iterable, 'close', None)
+    if close is not None:
+        close()
+
+
+def _weak_etag(value):
+    value = value.strip()
+    return value if value.startswith('W/') else f'W/{value}'
+
+
+def _add_vary(headers, names):
+    vary = names.get('vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return headers
+    return ([(name, value) for name, value in headers if name.lower() != 'vary']
+            + [('Vary', f"{vary}, Accept-Encoding")])
@@ -0,0 +1,284 @@
+"""Local proxy cache for user avatar and header images.
+
+Remote images are fetched once, resized into the variants the templates
+display, and stored on disk under the SHA-256 of the source bytes, so two
+URLs that serve the same picture share one set of files.
+
+Concurrent requests for an uncached URL share one download, and a URL
+that failed is not fetched again for `failure_ttl` seconds, so a slow or
+dead image host ties up at most one request thread per URL.
+"""
+
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - resizing is skipped without Pillow
+    Image = None
+
+from singleflight import SingleFlight
+
+# Pixel sizes (2x the CSS box) of each variant the templates ask for.
+VARIANTS = {
+    'thumb': (96, 96),        # .timeline-image, 48px
+    'card': (140, 140),       # .card-image, 70px
+    'profile': (400, 400),    # #profile-avatar / .profile-image, 200px
+    'header': (1200, 400),    # .profile-header / .card-hero
+}
+
+
+MAX_REDIRECTS = 3
+
+
+class ImageFetchError(Exception):
+    """The source image could not be fetched or decoded."""
+
+
+class ImageRejected(ImageFetchError):
+    """The source is not allowed: a non-public address, or too many pixels."""
+
+
+def is_remote(url):
+    """Is `url` an absolute http(s) URL (as opposed to one of our files)?"""
+    return urlparse(url or '').scheme in ('http', 'https')
+
+
+def is_public_address(address):
+    """May the proxy connect to `address`? Only globally routable IPs."""
+    ip = ipaddress.ip_address(address)
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _resolve(host, port, allow_address):
+    """The first address of `host` that `allow_address` accepts.
+
+    Every address the name resolves to must be allowed, so a name that
+    mixes public and internal addresses is refused outright.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError) as e:
+        raise ImageFetchError(f"Could not resolve {host}: {e}") from e
+    addresses = [info[4][0] for info in infos]
+    if not addresses or not all(allow_address(a) for a in addresses):
+        raise ImageRejected(f"{host} resolves to a non-public address")
+    return addresses[0]
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS to an already-checked IP, verifying the certificate for `host`."""
+
+    def __init__(self, host, address, port, timeout):
+        super().__init__(host, port, timeout=timeout,
+                         context=ssl.create_default_context())
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def _get(url, timeout, allow_address):
+    """GET `url` from an address checked by `allow_address`; no redirects."""
+    parts = urlparse(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageRejected(f"Not an http(s) URL: {url}")
+    https = parts.scheme == 'https'
+    try:
+        port = parts.port or (443 if https else 80)
+    except ValueError as e:
+        raise ImageFetchError(f"Bad URL {url}: {e}") from e
+    address = _resolve(parts.hostname, port, allow_address)
+    if https:
+        conn = _PinnedHTTPSConnection(parts.hostname, address, port, timeout)
+    else:
+        # connect to the checked address; the Host header keeps the name
+        conn = http.client.HTTPConnection(address, port, timeout=timeout)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    conn.request('GET', path, headers={'Host': parts.netloc,
+                                       'User-Agent': 'warbler-image-proxy'})
+    return conn, conn.getresponse()
+
+
+def fetch_url(url, timeout=5, max_bytes=5 * 1024 * 1024, allow_address=is_public_address):
+    """Download `url`, refusing bodies larger than `max_bytes`.
+
+    Each hop, redirects included, is resolved and checked with
+    `allow_address` and then connected to at that address, so DNS can't
+    point the proxy at loopback, private or cloud-metadata hosts.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        try:
+            conn, resp = _get(url, timeout, allow_address)
+            try:
+                location = resp.getheader('Location')
+                if resp.status in (301, 302, 303, 307, 308) and location:
+                    url = urljoin(url, location)
+                    continue
+                if resp.status != 200:
+                    raise ImageFetchError(f"Could not fetch {url}: HTTP {resp.status}")
+                data = resp.read(max_bytes + 1)
+            finally:
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            raise ImageFetchError(f"Could not fetch {url}: {e}") from e
+        if len(data) > max_bytes:
+            raise ImageFetchError(f"{url} is larger than {max_bytes} bytes")
+        return data
+    raise ImageFetchError(f"Too many redirects fetching {url}")
+
+
+class ImageCache:
+    """Content-addressed on-disk cache of resized images.
+
+    Layout under `root`:
+        urls/<sha256(url)>              -> digest of the source bytes
+        <variant>/<digest[:2]>/<digest> -> resized image
+    """
+
+    def __init__(self, root, fetch=fetch_url, failure_ttl=300, max_failures=10000,
+                 fetch_timeout=10.0):
+        self.root = root
+        self.fetch = fetch
+        self.failure_ttl = failure_ttl
+        self.max_failures = max_failures
+        self._failures = OrderedDict()  # url -> (expires, error class, message)
+        self._failures_lock = threading.Lock()
+        self._flights = SingleFlight(timeout=fetch_timeout)
+
+    def get(self, url, variant):
+        """Return (path, mimetype) of `variant` of the image at `url`.
+
+        The source is only downloaded when neither the URL nor the variant
+        is already cached. Concurrent callers share one download (raising
+        FlightTimeout if it takes too long), and a failed URL keeps raising
+        its error without being refetched until `failure_ttl` passes.
+        """
+        if variant not in VARIANTS:
+            raise KeyError(variant)
+
+        digest = self._read_url_digest(url)
+        if digest:
+            path = self._variant_path(variant, digest)
+            if os.path.exists(path):
+                return path, self._mimetype(path)
+
+        data = self._flights.do(url, self._fetch, url)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._variant_path(variant, digest)
+        if not os.path.exists(path):
+            _write_atomic(path, _resize(data, VARIANTS[variant]))
+        _write_atomic(self._url_path(url), digest.encode())
+        return path, self._mimetype(path)
+
+    def clear_failures(self):
+        """Forget failed URLs, so the next request fetches them again."""
+        with self._failures_lock:
+            self._failures.clear()
+
+    def _fetch(self, url):
+        with self._failures_lock:
+            failure = self._failures.get(url)
+            if failure and failure[0] <= time.monotonic():
+                del self._failures[url]
+                failure = None
+        if failure:
+            _, error, message = failure
+            raise error(message)
+        try:
+            return self.fetch(url)
+        except ImageFetchError as e:
+            with self._failures_lock:
+                self._failures[url] = (time.monotonic() + self.failure_ttl,
+                                       type(e), str(e))
+                self._failures.move_to_end(url)
+                while len(self._failures) > self.max_failures:
+                    self._failures.popitem(last=False)
+            raise
+
+    def _url_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, 'urls', key)
+
+    def _variant_path(self, variant, digest):
+        return os.path.join(self.root, variant, digest[:2], digest)
+
+    def _read_url_digest(self, url):
+        try:
+            with open(self._url_path(url), 'rb') as f:
+                return f.read().decode()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _mimetype(path):
+        with open(path, 'rb') as f:
+            return sniff_mimetype(f.read(12))
+
+
+def sniff_mimetype(head):
+    """The image type the leading bytes `head` announce, or None."""
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head.startswith(b'GIF8'):
+        return 'image/gif'
+    if head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    return None
+
+
+def _resize(data, size):
+    """Crop-and-scale `data` to `size`.
+
+    Without Pillow the source is passed through, but only if it is a
+    format we can name; anything else is refused rather than served
+    under a guessed content type.
+    """
+    if Image is None:
+        if sniff_mimetype(data[:12]) is None:
+            raise ImageFetchError("Not a recognised image format")
+        return data
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        keep_alpha = img.mode in ('RGBA', 'LA', 'P')
+        img = img.convert('RGBA' if keep_alpha else 'RGB')
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(f"Image has too many pixels: {e}") from e
+    except (OSError, SyntaxError) as e:
+        raise ImageFetchError(f"Not a readable image: {e}") from e
+
+    img = ImageOps.fit(img, size, Image.LANCZOS)
+
+    out = io.BytesIO()
+    if keep_alpha:
+        img.save(out, 'PNG', optimize=True)
+    else:
+        img.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _write_atomic(path, data):
+    """Write `data` to `path` so concurrent readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,138 @@
+"""Batched message writes: JSON batch validation and group commit.
+
+Integrations post many warbles at once through the JSON ingestion API;
+a batch is validated as a whole and written with one multi-row INSERT
+and one commit.
+
+Single posts from the web form go through `GroupCommit`: posts arriving
+within `window` seconds of each other are written by one of the posting
+requests in a single transaction, so a burst of posts costs one commit
+(and one fsync on the database) instead of one each. A post made while
+nobody else is posting is written at once, without the wait.
+"""
+
+import threading
+import time
+
+from models import Message
+
+MAX_TEXT_LENGTH = Message.text.type.length
+
+
+def validate(items):
+    """Return (texts, errors) for a JSON list of {"text": ...} objects.
+
+    `errors` is a list of {"index": i, "error": reason}; the batch should
+    only be written if it is empty.
+    """
+    texts = []
+    errors = []
+    for index, item in enumerate(items):
+        text = item.get('text') if isinstance(item, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            errors.append({'index': index, 'error': "text is required"})
+        elif len(text) > MAX_TEXT_LENGTH:
+            errors.append({'index': index,
+                           'error': f"text is longer than {MAX_TEXT_LENGTH} characters"})
+        else:
+            texts.append(text)
+    return texts, errors
+
+
+class CommitTimeout(Exception):
+    """A submitter gave up waiting for its batch; its item was not written."""
+
+
+class _Pending:
+    __slots__ = ('item', 'result', 'error', 'done', 'lead')
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.lead = False
+
+
+class GroupCommit:
+    """Writes items submitted from concurrent threads in shared batches.
+
+    `write(items)` is called with up to `max_batch` items and returns one
+    result per item. There is no writer thread: the first submitter
+    leads. If others are already queued it waits `window` seconds for
+    more to join, then writes the batch and hands leadership to the next
+    queued submitter, if any. Everyone in a batch gets its own result, or
+    the batch's exception.
+
+    A submitter still queued after `timeout` seconds withdraws its item
+    and raises CommitTimeout; once its batch is being written, it waits
+    for the outcome.
+    """
+
+    def __init__(self, write, window=0.002, max_batch=256, timeout=10.0):
+        self.write = write
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = []
+        self._leading = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def stats(self):
+        with self._lock:
+            return {'batches': self.batches, 'items': self.items,
+                    'mean_batch': self.items / self.batches if self.batches else 0}
+
+    def submit(self, item):
+        """Write `item` in the next batch and return its result."""
+        pending = _Pending(item)
+        with self._lock:
+            self._queue.append(pending)
+            if not self._leading:
+                self._leading = pending.lead = True
+        while not pending.lead and not pending.done.wait(self.timeout):
+            with self._lock:
+                if pending.lead:
+                    break
+                if pending in self._queue:
+                    self._queue.remove(pending)
+                    raise CommitTimeout("timed out waiting for a group commit")
+        if pending.lead:
+            self._lead()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _lead(self):
+        with self._lock:
+            alone = len(self._queue) == 1
+        if self.window and not alone:
+            time.sleep(self.window)
+        with self._lock:
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+        try:
+            results = self.write([pending.item for pending in batch])
+            for pending, result in zip(batch, results):
+                pending.result = result
+        except BaseException as e:
+            for pending in batch:
+                pending.error = e
+            raise
+        finally:
+            # hand over even if the write was interrupted, or every later
+            # submitter would queue behind a leader that is gone
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                if self._queue:
+                    successor = self._queue[0]
+                    successor.lead = True
+                    successor.done.set()
+                else:
+                    self._leading = False
+            for pending in batch:
+                pending.lead = False
+                pending.done.set()
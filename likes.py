@@ -0,0 +1,363 @@
+"""Write-behind buffering of like/unlike clicks.
+
+A click is appended to a local log and fsynced before it is acknowledged,
+then held in memory as the latest state of its (user_id, message_id) pair,
+so like -> unlike -> like collapses to a single row change. A background
+thread applies all pending pairs to the `likes` table in one transaction
+every `flush_interval` seconds.
+
+The log is split into per-process segments (likes-<pid>-<seq>.log). Each
+flush seals the current segment and deletes the sealed ones once the
+transaction commits, so after a crash `recover()` replays exactly the
+writes that were acknowledged but never committed.
+
+Pending writes are held by the worker process that took the click, and
+nothing routes a user's clicks to one worker. For up to `flush_interval`
+seconds a user's next request may land on another worker and not see
+the click yet. A like and an unlike of the same warble taken by two
+workers within one interval are settled by whichever worker flushes
+last. Both only last until the next flush. Rows themselves can't be
+doubled: inserts skip pairs that exist, under a unique index.
+
+That index (`ix_likes_user_id_message_id`) is not added to an existing
+`likes` table by `db.create_all()`; `flask migrate-likes` removes
+duplicate rows and creates it. Until it exists the buffer refuses to
+start, rather than queueing likes it can never flush.
+
+Each worker's flusher also replays segments left by dead processes, when
+it starts and every `recover_interval` seconds, so the log of a worker
+that was killed and replaced is applied without a restart.
+"""
+
+import atexit
+import fcntl
+import glob
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import delete, func, inspect, select
+
+from models import db, _insert, Likes, Message, User
+
+SEGMENT_RE = re.compile(r'likes-(\d+)-(\d+)\.log$')
+UNIQUE_INDEX = 'ix_likes_user_id_message_id'
+
+
+class LikeIndexMissing(RuntimeError):
+    """The likes table lacks the unique index that flushes rely on."""
+
+
+def has_unique_index():
+    """Does the `likes` table have its (user_id, message_id) unique index?"""
+    return any(index['name'] == UNIQUE_INDEX and index['unique']
+               for index in inspect(db.engine).get_indexes(Likes.__tablename__))
+
+
+def create_unique_index():
+    """Delete duplicate likes, keeping the oldest row, and add the unique index.
+
+    Returns the number of duplicates deleted. Run it with like writes
+    stopped; a duplicate inserted in between makes the index creation fail,
+    and it can simply be run again.
+    """
+    if has_unique_index():
+        return 0
+    keep = (select(func.min(Likes.id))
+            .group_by(Likes.user_id, Likes.message_id)
+            .scalar_subquery())
+    removed = db.session.execute(delete(Likes).where(Likes.id.notin_(keep))).rowcount
+    db.session.commit()
+    index = next(index for index in Likes.__table__.indexes if index.name == UNIQUE_INDEX)
+    index.create(db.engine)
+    return removed
+
+
+class LikeBuffer:
+    """Coalesces like/unlike writes in memory and flushes them in batches.
+
+    Pending state lives in this process; until a flush, reads made through
+    `liked_ids()` in the same process see the buffered writes, and reads in
+    other processes don't.
+    """
+
+    def __init__(self, log_dir, flush_interval=1.0, max_pending=5000, fsync=True,
+                 recover_interval=60):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.recover_interval = recover_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.app = None
+        self.listeners = []         # called with apply_batch()'s changed rows
+
+        self._pending = {}          # {user_id: {message_id: liked}}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._seq = 0
+        self._log = None
+        self._segments = []         # this process's segments, oldest first
+        self._index_missing_at = None
+
+    def init_app(self, app):
+        """Use `app`'s database for flushes and flush on interpreter exit."""
+        self.app = app
+        os.makedirs(self.log_dir, exist_ok=True)
+        atexit.register(self.flush)
+
+    def start(self):
+        """Open this process's log and start its flusher, once per process.
+
+        Raises LikeIndexMissing until `flask migrate-likes` has been run.
+        """
+        with self._lock:
+            self._ensure_process()
+
+    def record(self, user_id, message_id, liked):
+        """Durably record that `user_id` now does (or doesn't) like a message.
+
+        Returns once the write is in the fsynced log, so it survives a crash.
+        """
+        line = f"{user_id} {message_id} {int(liked)}\n".encode()
+        with self._lock:
+            self._ensure_process()
+            self._log.write(line)
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+
+            user_pending = self._pending.setdefault(user_id, {})
+            if message_id not in user_pending:
+                self._count += 1
+            user_pending[message_id] = liked
+            full = self._count >= self.max_pending
+
+        if self.flush_interval <= 0:
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def pending_for(self, user_id):
+        """Return {message_id: liked} of `user_id`'s unflushed writes."""
+        with self._lock:
+            return dict(self._pending.get(user_id, {}))
+
+    def liked_ids(self, user_id, stored_ids):
+        """Apply `user_id`'s unflushed writes to the ids stored in the DB."""
+        liked = set(stored_ids)
+        for message_id, is_liked in self.pending_for(user_id).items():
+            if is_liked:
+                liked.add(message_id)
+            else:
+                liked.discard(message_id)
+        return liked
+
+    def flush(self):
+        """Write every pending pair to the database in one transaction.
+
+        Returns the number of (user_id, message_id) pairs applied.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending or self._pid != os.getpid():
+                    return 0
+                batch, self._pending, self._count = self._pending, {}, 0
+                sealed = self._rotate()
+
+            if batch:
+                try:
+                    with self.app.app_context():
+                        changed = apply_batch(batch)
+                except Exception:
+                    self._restore(batch)
+                    raise
+                self._notify(changed)
+
+            with self._lock:
+                for path in sealed:
+                    os.remove(path)
+                    self._segments.remove(path)
+            return sum(len(changes) for changes in batch.values())
+
+    def recover(self):
+        """Replay segments left by dead processes and flush them.
+
+        Runs under an flock on the log directory, so two workers never
+        replay the same segment.
+        """
+        fd = os.open(self.log_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return self._recover()
+        finally:
+            os.close(fd)
+
+    def _recover(self):
+        batch = {}
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self.log_dir, 'likes-*.log')),
+                           key=_segment_key):
+            pid, _ = _segment_key(path)
+            if pid == self._pid or (pid != os.getpid() and _pid_alive(pid)):
+                continue
+            segments.append(path)
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        user_id, message_id, liked = map(int, line.split())
+                    except ValueError:
+                        continue  # torn final write, never acknowledged
+                    batch.setdefault(user_id, {})[message_id] = bool(liked)
+
+        if batch:
+            with self.app.app_context():
+                self._notify(apply_batch(batch))
+        for path in segments:
+            os.remove(path)
+        return sum(len(changes) for changes in batch.values())
+
+    def _notify(self, changed):
+        for listener in self.listeners:
+            try:
+                listener(changed)
+            except Exception:
+                self.app.logger.exception("Like flush listener failed")
+
+    def _ensure_process(self):
+        """Open a log segment and start the flusher for this process.
+
+        Runs again after a fork, since neither survives it.
+        """
+        if self._pid == os.getpid():
+            return
+        self._check_index()
+        self._pid = os.getpid()
+        # Start past any segments a dead process with our pid left behind;
+        # those are only replayed by recover().
+        stale = glob.glob(os.path.join(self.log_dir, f"likes-{self._pid}-*.log"))
+        self._seq = max((_segment_key(path)[1] for path in stale), default=-1) + 1
+        self._segments = [self._segment_path(self._seq)]
+        self._log = open(self._segments[0], 'ab')
+        if self.flush_interval > 0:
+            threading.Thread(target=self._run, daemon=True,
+                             name='like-buffer-flush').start()
+
+    def _check_index(self):
+        """Raise LikeIndexMissing if flushes would fail; re-checks every 30s."""
+        now = time.monotonic()
+        if self._index_missing_at is None or now - self._index_missing_at >= 30:
+            with self.app.app_context():
+                missing = not has_unique_index()
+            if not missing:
+                self._index_missing_at = None
+                return
+            self._index_missing_at = now
+            self.app.logger.error("likes.%s is missing; run `flask migrate-likes`",
+                                  UNIQUE_INDEX)
+        raise LikeIndexMissing(f"likes.{UNIQUE_INDEX} is missing; "
+                               f"run `flask migrate-likes`")
+
+    def _segment_path(self, seq):
+        return os.path.join(self.log_dir, f"likes-{self._pid}-{seq}.log")
+
+    def _rotate(self):
+        """Seal the current segment; return every sealed segment path."""
+        self._log.close()
+        self._seq += 1
+        sealed = list(self._segments)
+        self._segments.append(self._segment_path(self._seq))
+        self._log = open(self._segments[-1], 'ab')
+        return sealed
+
+    def _restore(self, batch):
+        """Put a failed batch back under any newer pending writes."""
+        with self._lock:
+            for user_id, changes in batch.items():
+                user_pending = self._pending.setdefault(user_id, {})
+                for message_id, liked in changes.items():
+                    if message_id not in user_pending:
+                        user_pending[message_id] = liked
+                        self._count += 1
+
+    def _run(self):
+        pid = os.getpid()
+        recovered_at = None
+        while self._pid == pid:
+            if (recovered_at is None
+                    or time.monotonic() - recovered_at >= self.recover_interval):
+                recovered_at = time.monotonic()
+                try:
+                    self.recover()
+                except Exception:
+                    self.app.logger.exception("Replaying dead workers' likes failed")
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                if self.app is not None:
+                    self.app.logger.exception("Flushing buffered likes failed")
+
+
+def apply_batch(batch):
+    """Apply {user_id: {message_id: liked}} to `likes` in one transaction.
+
+    Inserts skip pairs that already exist and messages or users that have
+    since been deleted, so replaying a batch, or two processes flushing the
+    same pair, is harmless. Returns the rows that actually changed as
+    [(user_id, message_id, message_timestamp, +1/-1), ...], taken from what the
+    INSERT and DELETE statements report rather than from an earlier read.
+    """
+    message_ids = {m for changes in batch.values() for m in changes}
+    timestamps = dict(db.session.query(Message.id, Message.timestamp)
+                      .filter(Message.id.in_(message_ids)))
+    live_users = {id for (id,) in db.session.query(User.id)
+                  .filter(User.id.in_(batch.keys()))}
+
+    new_rows = []
+    changed = []
+    try:
+        for user_id, changes in batch.items():
+            unliked = [m for m, is_liked in changes.items() if not is_liked]
+            if unliked:
+                removed = db.session.execute(
+                    delete(Likes)
+                    .where(Likes.user_id == user_id, Likes.message_id.in_(unliked))
+                    .returning(Likes.message_id)).scalars()
+                changed.extend((user_id, m, timestamps[m], -1)
+                               for m in removed if m in timestamps)
+            if user_id in live_users:
+                new_rows.extend({'user_id': user_id, 'message_id': m}
+                                for m, is_liked in changes.items()
+                                if is_liked and m in timestamps)
+
+        if new_rows:
+            added = db.session.execute(
+                _insert(Likes.__table__)
+                .on_conflict_do_nothing(index_elements=['user_id', 'message_id'])
+                .returning(Likes.user_id, Likes.message_id), new_rows)
+            changed.extend((u, m, timestamps[m], 1) for u, m in added)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return changed
+
+
+def _segment_key(path):
+    match = SEGMENT_RE.search(path)
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
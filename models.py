@@ -2,6 +2,8 @@
 from datetime import datetime
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exists, select
+from sqlalchemy.dialects import postgresql, sqlite
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -10,6 +12,11 @@ db = SQLAlchemy()
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
     __tablename__ = 'follows'
+    # The primary key leads with the followed user; this serves "who does
+    # this user follow" (feeds, following pages).
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
 
     user_being_followed_id = db.Column(
         db.Integer,
@@ -23,10 +30,47 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def follow(cls, follower_id, user_ids):
+        """Have `follower_id` follow every existing user in `user_ids`.
+
+        One INSERT ... SELECT over the primary key: ids that aren't users,
+        the follower themselves and edges that already exist are skipped,
+        so the statement is idempotent. Returns the number of new follows.
+        """
+        user_ids = set(user_ids) - {follower_id}
+        if not user_ids:
+            return 0
+        already = exists().where(cls.user_following_id == follower_id,
+                                 cls.user_being_followed_id == User.id)
+        targets = (select(User.id, db.literal(follower_id))
+                   .where(User.id.in_(user_ids), ~already))
+        stmt = _insert(cls.__table__).from_select(
+            ['user_being_followed_id', 'user_following_id'], targets)
+        if hasattr(stmt, 'on_conflict_do_nothing'):
+            # a concurrent follow of the same user may win the race
+            stmt = stmt.on_conflict_do_nothing()
+        return db.session.execute(stmt).rowcount
+
+    @classmethod
+    def unfollow(cls, follower_id, user_ids):
+        """Have `follower_id` stop following `user_ids`; returns the count."""
+        if not user_ids:
+            return 0
+        return (cls.query
+                .filter(cls.user_following_id == follower_id,
+                        cls.user_being_followed_id.in_(set(user_ids)))
+                .delete(synchronize_session=False))
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
     __tablename__ = 'likes' 
+    # Unique, so concurrent flushes and replays can't double a like.
+    __table_args__ = (
+        db.Index('ix_likes_user_id_message_id', 'user_id', 'message_id', unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -138,6 +182,27 @@ class User(db.Model):
         """Is this user followed by `other_user`?"""
         return any(user.id == other_user.id for user in self.followers)
 
+    # The profile stats count rows instead of loading the relationships,
+    # and include archived messages.
+
+    @property
+    def message_count(self):
+        return (Message.query.filter_by(user_id=self.id).count()
+                + ArchiveEntry.query.filter_by(user_id=self.id).count())
+
+    @property
+    def following_count(self):
+        return Follows.query.filter_by(user_following_id=self.id).count()
+
+    @property
+    def followers_count(self):
+        return Follows.query.filter_by(user_being_followed_id=self.id).count()
+
+    @property
+    def likes_count(self):
+        return (Likes.query.filter_by(user_id=self.id).count()
+                + ArchivedLike.query.filter_by(user_id=self.id).count())
+
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user. Hashes password and adds user to system."""
@@ -176,6 +241,12 @@ class User(db.Model):
 class Message(db.Model):
     """An individual message ("warble")."""
     __tablename__ = 'messages'
+    # Profile timelines and home feeds: an author's messages, newest first.
+    # Trending recomputes scan the last few days of messages by timestamp.
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_messages_timestamp', 'timestamp'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -199,6 +270,257 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Rows in this table are hot; see ArchiveEntry for archived messages.
+    archived = False
+
+
+class ArchiveEntry(db.Model):
+    """Catalog entry for a message moved to a cold archive partition."""
+    __tablename__ = 'message_archive'
+    __table_args__ = (
+        db.Index('ix_message_archive_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    partition = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+
+# Likes, hashtags and mentions of archived messages move out of the hot
+# tables with them, into these tables keyed by the catalog entry, so the
+# likes page and the tag and mention timelines can still find them.
+
+class ArchivedLike(db.Model):
+    """A user's like of an archived message."""
+    __tablename__ = 'archived_likes'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('message_archive.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class ArchivedTag(db.Model):
+    """Hashtag used in an archived message."""
+    __tablename__ = 'archived_message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('message_archive.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class ArchivedMention(db.Model):
+    """User @mentioned in an archived message."""
+    __tablename__ = 'archived_mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('message_archive.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class MessageTag(db.Model):
+    """Hashtag used in a message."""
+    __tablename__ = 'message_tags'
+
+    # (tag, message_id) is the primary key, so a tag's timeline is an
+    # index range scan ordered by message id.
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class Mention(db.Model):
+    """User @mentioned in a message."""
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class DailyActivity(db.Model):
+    """A day's count of one activity metric for a user (or the whole site)."""
+    __tablename__ = 'activity_daily'
+
+    # (user_id, metric, day) is the primary key, so a series is one index
+    # range scan. Site-wide totals use user_id 0, hence no foreign key.
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    metric = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    day = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class DailyActiveUser(db.Model):
+    """A user seen on a given day; feeds the site's daily active users."""
+    __tablename__ = 'daily_active_users'
+
+    day = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class Recommendation(db.Model):
+    """A precomputed "who to follow" suggestion; see recommend.py."""
+    __tablename__ = 'recommendations'
+
+    # (user_id, rank) is the primary key, so a user's suggestions are one
+    # index range scan, already in order.
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    candidate_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+
+class RecommendationQueue(db.Model):
+    """User whose follows or likes changed since recommendations were built."""
+    __tablename__ = 'recommendation_queue'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+def _insert(table):
+    """An INSERT for `table` that supports ON CONFLICT where available."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    return table.insert()
+
+
+# Applied to every SQLite connection. WAL lets readers run alongside the
+# single writer; with WAL, synchronous=NORMAL only fsyncs at checkpoints
+# and stays crash-safe. busy_timeout makes a connection that finds the
+# database locked wait and retry instead of failing at once. foreign_keys
+# and case_sensitive_like match PostgreSQL's cascades and LIKE.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,               # ms
+    'cache_size': -64 * 1024,           # KiB, per connection
+    'mmap_size': 256 * 1024 * 1024,     # bytes
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+    'case_sensitive_like': 'ON',
+}
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Set `pragmas` (default SQLITE_PRAGMAS) on each new connection of a
+    SQLite `engine`; other engines are left alone."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -206,3 +528,5 @@ def connect_db(app):
     """
     db.app = app
     db.init_app(app)
+    with app.app_context():
+        configure_sqlite(db.engine, app.config.get('SQLITE_PRAGMAS'))
@@ -0,0 +1,342 @@
+"""Full-page cache for anonymous visitors.
+
+A page rendered for a logged-out visitor is the same for every logged-out
+visitor, so it is stored whole, keyed by path and query string, and
+served without running the view. Entries expire in three ways:
+
+* after `ttl` seconds a page is stale. The next request regenerates it
+  while other requests keep getting the stale copy for up to
+  `stale_ttl` more seconds (stale-while-revalidate);
+* write routes invalidate tags such as "user:7" straight away. A tag's
+  stamp is the time of its last invalidation, and a page rendered before
+  a stamp on one of its tags is treated as a miss;
+* a miss is filled by one request holding the key's fill lock, while the
+  others wait for its result instead of all rendering the page at once.
+  If the lock is released without a page being cached (an error, a 404)
+  the waiters render the view themselves at once.
+
+Pages are keyed by path plus only the query arguments the view declares,
+so arbitrary query strings can't fill the cache with copies of a page.
+
+Entries, tag stamps and locks live in a pluggable store. MemoryStore is
+per process, so invalidations only reach the worker that made them;
+FileStore shares one cache, and its invalidations, between the worker
+processes on a host, in place of a shared cache server.
+"""
+
+import fcntl
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import g, make_response, request, session
+
+
+class MemoryStore:
+    """In-process store: a bounded LRU dict of (value, expires_at)."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.time())
+        return item and item[0]
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            items = [self._live(key, now) for key in keys]
+        return [item and item[0] for item in items]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only if it is absent; return whether it was set."""
+        with self._lock:
+            if self._live(key, time.time()) is not None:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _put(self, key, value, ttl):
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+class FileStore:
+    """Store shared by every process on a host: one pickle file per key.
+
+    Writes go through a temp file and an atomic rename; `add()` links the
+    temp file into place, which fails if the key already exists. Expired
+    files are swept at most every `sweep_interval` seconds.
+    """
+
+    LOCK_NAME = '.lock'
+
+    def __init__(self, directory, sweep_interval=60):
+        self.directory = directory
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _load(self, path):
+        """(value, expires) stored at `path`, or None if missing or expired."""
+        try:
+            with open(path, 'rb') as f:
+                value, expires = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires <= time.time():
+            return None
+        return value, expires
+
+    def get(self, key):
+        item = self._load(self._path(key))
+        return item and item[0]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def _temp(self, value, ttl):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((value, time.time() + ttl if ttl else None), f)
+        return tmp
+
+    def set(self, key, value, ttl=None):
+        self._maybe_sweep()
+        os.replace(self._temp(value, ttl), self._path(key))
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only if it is absent; return whether it was set."""
+        self._maybe_sweep()
+        path = self._path(key)
+        tmp = self._temp(value, ttl)
+        try:
+            try:
+                os.link(tmp, path)
+                return True
+            except FileExistsError:
+                pass
+            # Replace an expired value. Every takeover holds the directory
+            # lock and checks again under it, so two processes can't both
+            # remove an expired value and each link their own.
+            with self._locked():
+                if os.path.exists(path) and self._load(path) is None:
+                    os.remove(path)
+                try:
+                    os.link(tmp, path)
+                    return True
+                except FileExistsError:
+                    return False
+        finally:
+            os.remove(tmp)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+    def _locked(self):
+        f = open(os.path.join(self.directory, self.LOCK_NAME), 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._swept_at >= self.sweep_interval:
+            self._swept_at = time.monotonic()
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired files and abandoned temp files; return how many."""
+        removed = 0
+        stale_temp = time.time() - max(self.sweep_interval, 60)
+        with self._locked():
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    if name == self.LOCK_NAME:
+                        continue
+                    if name.startswith('.tmp-'):
+                        if os.path.getmtime(path) >= stale_temp:
+                            continue
+                    elif self._load(path) is not None:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+class PageCache:
+    """Caches whole responses of views decorated with `cached`."""
+
+    def __init__(self, store=None, ttl=30, stale_ttl=60, lock_timeout=5.0,
+                 poll_interval=0.02):
+        self.store = store if store is not None else MemoryStore()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # a tag stamp only matters while pages rendered before it could
+        # still be served; pages whose stamp has expired are misses
+        self.stamp_ttl = 2 * (ttl + stale_ttl)
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'stale_hits': self.stale_hits,
+                    'misses': self.misses, 'waits': self.waits}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        self.store.clear()
+
+    def tag(self, *tags):
+        """Tag the page being rendered, so invalidating a tag drops it."""
+        g.setdefault('page_cache_tags', set()).update(tags)
+
+    def invalidate(self, *tags):
+        """Drop every cached page carrying one of `tags`."""
+        now = time.time()
+        for tag in tags:
+            self.store.set(f'tag:{tag}', now, self.stamp_ttl)
+
+    def cached(self, view=None, *, query_args=()):
+        """Serve `view` from the cache to anonymous GET requests.
+
+        Only the `query_args` the view reads are part of the cache key;
+        any other query arguments are ignored. Requests with a logged-in
+        user or pending flash messages always run the view.
+        """
+        if view is None:
+            return functools.partial(self.cached, query_args=query_args)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.user or request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            return self._serve(self._key(query_args), view, args, kwargs)
+        return wrapper
+
+    def _key(self, query_args):
+        query = urlencode([(name, request.args[name]) for name in sorted(query_args)
+                           if request.args.get(name)])
+        return f'page:{request.path}?{query}'
+
+    def _serve(self, key, view, args, kwargs):
+        entry = self.store.get(key)
+        state = self._state(entry)
+        if state == 'fresh':
+            self._count('hits')
+            return self._response(entry, 'HIT')
+
+        lock = f'lock:{key}'
+        if self.store.add(lock, True, self.lock_timeout):
+            self._count('misses')
+            return self._fill(key, lock, view, args, kwargs)
+        if state == 'stale':
+            self._count('stale_hits')
+            return self._response(entry, 'STALE')
+
+        # another request is rendering this page; wait for its result, or
+        # render it here once the lock is released without one
+        self._count('waits')
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self.store.get(key)
+            if self._state(entry) == 'fresh':
+                return self._response(entry, 'HIT')
+            if self.store.get(lock) is None:
+                break
+        return view(*args, **kwargs)
+
+    def _state(self, entry):
+        """'fresh', 'stale', or None for a missing or invalidated entry."""
+        if entry is None:
+            return None
+        stamps = self.store.get_many([f'tag:{tag}' for tag in entry['tags']])
+        # a stamp evicted from the store can't vouch for the entry
+        if any(stamp is None or stamp >= entry['created'] for stamp in stamps):
+            return None
+        age = time.time() - entry['created']
+        if age < self.ttl:
+            return 'fresh'
+        return 'stale' if age < self.ttl + self.stale_ttl else None
+
+    def _fill(self, key, lock, view, args, kwargs):
+        # stamp the entry with the render's start, so an invalidation that
+        # lands while rendering drops the page
+        created = time.time()
+        g.page_cache_tags = set()
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not session.modified:
+                tags = tuple(g.page_cache_tags)
+                for tag in tags:
+                    self.store.add(f'tag:{tag}', 0.0, self.stamp_ttl)
+                entry = {
+                    'created': created,
+                    'tags': tags,
+                    'body': response.get_data(),
+                    'mimetype': response.mimetype,
+                }
+                self.store.set(key, entry, self.ttl + self.stale_ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        finally:
+            self.store.delete(lock)
+
+    def _response(self, entry, status):
+        response = make_response(entry['body'])
+        response.mimetype = entry['mimetype']
+        response.headers['X-Cache'] = status
+        return response
@@ -0,0 +1,197 @@
+"""Read-model rows for rendering list pages.
+
+List pages only show a handful of columns per user or message. Instead of
+hydrating tracked `User`/`Message` instances (every column, identity map,
+attribute instrumentation), these helpers select just the rendered
+columns into named tuples and slotted records. They hold plain data, so
+they can also be shared between threads (see `singleflight`).
+"""
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import func, select, union_all
+
+from models import db, ArchiveEntry, ArchivedLike, Follows, Likes, Message, User
+
+
+class UserCard(NamedTuple):
+    """The user columns shown on cards, lists and message headers."""
+    id: int
+    username: str
+    image_url: Optional[str]
+    header_image_url: Optional[str]
+    bio: Optional[str]
+    location: Optional[str]
+
+    @classmethod
+    def of(cls, user):
+        return cls(user.id, user.username, user.image_url,
+                   user.header_image_url, user.bio, user.location)
+
+
+CARD_COLUMNS = (User.id, User.username, User.image_url, User.header_image_url,
+                User.bio, User.location)
+
+
+class MessageRow(NamedTuple):
+    """A message with its author's card."""
+    id: int
+    text: str
+    timestamp: datetime
+    user_id: int
+    user: UserCard
+    archived: bool = False
+
+    @classmethod
+    def of(cls, msg, author):
+        """Copy a `Message` or `ArchivedMessage` with `author`'s card."""
+        return cls(msg.id, msg.text, msg.timestamp, msg.user_id, author,
+                   msg.archived)
+
+
+class Profile:
+    """A user's card plus the counts shown in the profile stats.
+
+    `following` and `followers` are empty unless a page needs them: ids
+    where membership is tested (the viewer), card rows where a page
+    lists them.
+    """
+
+    __slots__ = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+                 'location', 'message_count', 'following_count',
+                 'followers_count', 'likes_count', 'following', 'followers')
+
+    def __init__(self, card, message_count=0, following_count=0,
+                 followers_count=0, likes_count=0):
+        (self.id, self.username, self.image_url, self.header_image_url,
+         self.bio, self.location) = card
+        self.message_count = message_count
+        self.following_count = following_count
+        self.followers_count = followers_count
+        self.likes_count = likes_count
+        self.following = ()
+        self.followers = ()
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`? (`following` holds ids.)"""
+        return other_user.id in self.following
+
+
+def _ids(result):
+    return tuple(row_id for (row_id,) in result)
+
+
+def _count(model, *criteria):
+    return (select(func.count()).select_from(model).where(*criteria)
+            .scalar_subquery())
+
+
+# Statements are built separately from running them so the async pages
+# (see asgi.py) can execute the same queries on an AsyncSession.
+
+def profile_select(user_id):
+    """One row: `user_id`'s card columns followed by the four stat counts.
+
+    Messages and likes count archived messages too.
+    """
+    return (select(*CARD_COLUMNS,
+                   _count(Message, Message.user_id == user_id)
+                   + _count(ArchiveEntry, ArchiveEntry.user_id == user_id),
+                   _count(Follows, Follows.user_following_id == user_id),
+                   _count(Follows, Follows.user_being_followed_id == user_id),
+                   _count(Likes, Likes.user_id == user_id)
+                   + _count(ArchivedLike, ArchivedLike.user_id == user_id))
+            .where(User.id == user_id))
+
+
+def build_profile(row):
+    """A Profile from a `profile_select()` row."""
+    return Profile(UserCard(*row[:len(CARD_COLUMNS)]), *row[len(CARD_COLUMNS):])
+
+
+def following_ids_select(user_id):
+    return (select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id))
+
+
+def follower_ids_select(user_id):
+    return (select(Follows.user_following_id)
+            .where(Follows.user_being_followed_id == user_id))
+
+
+def liked_ids_select(user_id):
+    """Ids of the messages `user_id` likes, hot or archived."""
+    return union_all(select(Likes.message_id).where(Likes.user_id == user_id),
+                     select(ArchivedLike.message_id).where(ArchivedLike.user_id == user_id))
+
+
+def message_rows_select():
+    """Messages joined to their authors' card columns."""
+    return (select(Message.id, Message.text, Message.timestamp,
+                   Message.user_id, *CARD_COLUMNS)
+            .join(User, User.id == Message.user_id))
+
+
+def build_message_rows(rows):
+    """MessageRows from `message_rows_select()` rows, in row order.
+
+    An author's card is built once however many of the messages they wrote.
+    """
+    cards = {}
+    messages = []
+    for msg_id, text, timestamp, user_id, *card in rows:
+        author = cards.get(user_id)
+        if author is None:
+            author = cards[user_id] = UserCard(*card)
+        messages.append(MessageRow(msg_id, text, timestamp, user_id, author))
+    return messages
+
+
+def profile(user_id):
+    """Load `user_id`'s Profile, or None if there is no such user."""
+    row = db.session.execute(profile_select(user_id)).first()
+    return build_profile(row) if row is not None else None
+
+
+def user_cards(search=None):
+    """Cards for every user, or those whose username contains `search`."""
+    query = select(*CARD_COLUMNS)
+    if search:
+        query = query.where(User.username.like(f"%{search}%"))
+    return [UserCard(*row) for row in db.session.execute(query)]
+
+
+def following_cards(user_id):
+    """Cards for the users `user_id` follows."""
+    query = (select(*CARD_COLUMNS)
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .where(Follows.user_following_id == user_id))
+    return [UserCard(*row) for row in db.session.execute(query)]
+
+
+def follower_cards(user_id):
+    """Cards for the users following `user_id`."""
+    query = (select(*CARD_COLUMNS)
+             .join(Follows, Follows.user_following_id == User.id)
+             .where(Follows.user_being_followed_id == user_id))
+    return [UserCard(*row) for row in db.session.execute(query)]
+
+
+def following_ids(user_id):
+    """Ids of the users `user_id` follows."""
+    return _ids(db.session.execute(following_ids_select(user_id)))
+
+
+def follower_ids(user_id):
+    """Ids of the users following `user_id`."""
+    return _ids(db.session.execute(follower_ids_select(user_id)))
+
+
+def message_rows(ids):
+    """MessageRows for `ids`, with author cards, in the order of `ids`."""
+    if not ids:
+        return []
+    rows = db.session.execute(message_rows_select().where(Message.id.in_(ids)))
+    by_id = {row.id: row for row in build_message_rows(rows)}
+    return [by_id[i] for i in ids if i in by_id]
@@ -0,0 +1,196 @@
+"""Offline "who to follow" suggestions.
+
+A batch job loads `follows` and `likes` into sparse rows (each user's
+followees, each user's liked messages, each message's likers) and
+scores candidates for every user with two sparse products:
+
+* followed by people you follow: F @ F, one point per followee who
+  follows the candidate;
+* likes the same warbles as you: L @ L.T, COLIKE_WEIGHT per message
+  both liked. Messages with more than MAX_LIKERS likers are skipped;
+  liking a hugely popular warble says little about taste, and they
+  would make each product row huge.
+
+The top TOP_N candidates per user (excluding themselves and who they
+already follow) are written to `recommendations`, so serving is a primary
+key range scan.
+
+Follows and unfollows queue the follower in `recommendation_queue`.
+`refresh_changed()` rebuilds only those users and their followers, since
+a changed follow list also changes the followers' friends-of-friends.
+It works through them WRITE_BATCH at a time, loading only each batch's
+two-hop neighbourhood, never the whole graph. Likes are not queued: they
+go through the like buffer to avoid a write per like, and co-like scores
+catch up on the next full `refresh()`.
+"""
+
+import heapq
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, select
+
+from models import db, _insert, Follows, Likes, Recommendation, RecommendationQueue, User
+import readmodel
+
+TOP_N = 20
+COLIKE_WEIGHT = 0.5
+MAX_LIKERS = 200
+WRITE_BATCH = 1000
+
+
+class Graph:
+    """Sparse adjacency rows: followees, liked messages and likers by id."""
+
+    def __init__(self):
+        self.following = defaultdict(set)   # user -> users they follow
+        self.liked = defaultdict(set)       # user -> messages they like
+        self.likers = defaultdict(set)      # message -> users who like it
+
+    def add_follows(self, rows):
+        for follower, followed in rows:
+            self.following[follower].add(followed)
+
+    def add_likes(self, rows):
+        for user_id, message_id in rows:
+            self.liked[user_id].add(message_id)
+            self.likers[message_id].add(user_id)
+
+    def scores(self, user_id):
+        """Sparse row of candidate scores for `user_id`."""
+        # Counter.update() counts an iterable in C; the per-candidate
+        # Python loop only runs over the (smaller) co-liker row.
+        scores = Counter()
+        for followee in self.following.get(user_id, ()):
+            scores.update(self.following.get(followee, ()))
+        colikes = Counter()
+        for message_id in self.liked.get(user_id, ()):
+            likers = self.likers[message_id]
+            if len(likers) <= MAX_LIKERS:
+                colikes.update(likers)
+        for liker, count in colikes.items():
+            scores[liker] += count * COLIKE_WEIGHT
+        scores.pop(user_id, None)
+        for followed in self.following.get(user_id, ()):
+            scores.pop(followed, None)
+        return scores
+
+    def top(self, user_id, n=TOP_N):
+        """[(candidate_id, score)] best first; ties go to the lower id."""
+        scores = self.scores(user_id)
+        if len(scores) > n:
+            # the n-th best score, found with plain float comparisons; only
+            # candidates at or above it need ranking
+            cutoff = heapq.nlargest(n, scores.values())[-1]
+            scores = {c: score for c, score in scores.items() if score >= cutoff}
+        ranked = sorted((-score, candidate) for candidate, score in scores.items())
+        return [(candidate, -score) for score, candidate in ranked[:n]]
+
+
+def _rows(query):
+    return db.session.execute(
+        query.execution_options(yield_per=10000))
+
+
+def load_graph(user_ids=None):
+    """Load the whole graph, or just what scoring `user_ids` reads."""
+    graph = Graph()
+    edges = select(Follows.user_following_id, Follows.user_being_followed_id)
+    likes = select(Likes.user_id, Likes.message_id)
+    if user_ids is None:
+        graph.add_follows(_rows(edges))
+        graph.add_likes(_rows(likes))
+        return graph
+
+    user_ids = list(user_ids)
+    graph.add_follows(_rows(edges.where(Follows.user_following_id.in_(user_ids))))
+    followees = {f for u in user_ids for f in graph.following.get(u, ())}
+    followees.difference_update(user_ids)
+    graph.add_follows(_rows(edges.where(Follows.user_following_id.in_(followees))))
+    # every like of the messages these users liked, except messages too
+    # popular to score, whose likers would only be loaded to be skipped
+    liked = select(Likes.message_id).where(Likes.user_id.in_(user_ids))
+    scored = (select(Likes.message_id)
+              .where(Likes.message_id.in_(liked))
+              .group_by(Likes.message_id)
+              .having(func.count() <= MAX_LIKERS))
+    graph.add_likes(_rows(likes.where(Likes.message_id.in_(scored))))
+    return graph
+
+
+def _batches(user_ids):
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), WRITE_BATCH):
+        yield user_ids[i:i + WRITE_BATCH]
+
+
+def _write(graph, batch, n):
+    """Replace the recommendations of the users in `batch`."""
+    rows = [{'user_id': user_id, 'rank': rank, 'candidate_id': candidate,
+             'score': score}
+            for user_id in batch
+            for rank, (candidate, score) in enumerate(graph.top(user_id, n))]
+    (Recommendation.query
+     .filter(Recommendation.user_id.in_(batch))
+     .delete(synchronize_session=False))
+    if rows:
+        db.session.execute(Recommendation.__table__.insert(), rows)
+    db.session.commit()
+
+
+def _queued():
+    return [user_id for (user_id,) in db.session.query(RecommendationQueue.user_id)]
+
+
+def _dequeue(user_ids):
+    """Dequeue only the ids read, so users queued meanwhile wait for next time."""
+    (RecommendationQueue.query
+     .filter(RecommendationQueue.user_id.in_(user_ids))
+     .delete(synchronize_session=False))
+    db.session.commit()
+
+
+def refresh(n=TOP_N):
+    """Rebuild every user's recommendations; returns the number of users."""
+    queued = _queued()
+    graph = load_graph()
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    for batch in _batches(user_ids):
+        _write(graph, batch, n)
+    _dequeue(queued)
+    return len(user_ids)
+
+
+def refresh_changed(n=TOP_N):
+    """Rebuild users queued by `mark_changed()` and their followers.
+
+    Returns the number of users rebuilt.
+    """
+    queued = _queued()
+    if not queued:
+        return 0
+    followers = {user_id for (user_id,) in db.session.query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id.in_(queued))}
+    affected = set(queued) | followers
+    for batch in _batches(sorted(affected)):
+        _write(load_graph(batch), batch, n)
+    _dequeue(queued)
+    return len(affected)
+
+
+def mark_changed(user_ids):
+    """Queue `user_ids` for the next incremental refresh (caller commits)."""
+    rows = [{'user_id': user_id} for user_id in set(user_ids)]
+    if rows:
+        db.session.execute(
+            _insert(RecommendationQueue.__table__).on_conflict_do_nothing(), rows)
+
+
+def suggestions(user_id, limit=TOP_N):
+    """[(UserCard, score)] of `user_id`'s stored recommendations, best first."""
+    rows = db.session.execute(
+        select(*readmodel.CARD_COLUMNS, Recommendation.score)
+        .join(Recommendation, Recommendation.candidate_id == User.id)
+        .where(Recommendation.user_id == user_id)
+        .order_by(Recommendation.rank)
+        .limit(limit))
+    return [(readmodel.UserCard(*row[:-1]), row[-1]) for row in rows]
@@ -0,0 +1,139 @@
+"""Preforking production server for Warbler (`flask serve`).
+
+Runs gunicorn with the app preloaded in the master process: the app, its
+compiled templates and read-mostly caches (asset manifest, trending
+scores) are built once and shared with every forked worker copy-on-write.
+`gc.freeze()` moves those objects out of the garbage collector's reach so
+collections in the workers don't touch, and so copy, the shared pages.
+
+Operations:
+    kill -HUP <master>    gracefully replace all workers
+    kill -USR2 <master>   start a new master with new code, then
+    kill -QUIT <old>      retire the old one (needed for code changes,
+                          since the app is preloaded)
+
+Workers are recycled after `max_requests` requests (with jitter) or once
+their resident memory exceeds `max_rss_mb`; the master logs each worker's
+RSS, proportional (PSS) and private memory every `memory_report_interval`
+seconds.
+"""
+
+import gc
+import os
+import resource
+import threading
+import time
+
+from gunicorn.app.base import BaseApplication
+
+# Read worker RSS after every this many requests.
+RSS_CHECK_EVERY = 25
+
+
+def process_memory(pid='self'):
+    """Return {'rss': kB, 'pss': kB, 'private': kB} for a process.
+
+    PSS and private memory need /proc/<pid>/smaps_rollup (Linux); elsewhere
+    only peak RSS of the current process is available.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': peak, 'pss': None, 'private': None}
+
+    def kb(name):
+        return int(fields.get(name, '0 kB').split()[0])
+
+    return {
+        'rss': kb('Rss'),
+        'pss': kb('Pss'),
+        'private': kb('Private_Clean') + kb('Private_Dirty'),
+    }
+
+
+def _make_when_ready(memory_report_interval):
+    def when_ready(server):
+        """Master hook: detach preloaded state from the GC and the DB pool."""
+        from app import app, db
+
+        with app.app_context():
+            # Connections opened while loading must not be shared across forks.
+            db.engine.dispose()
+        gc.collect()
+        gc.freeze()
+
+        if memory_report_interval:
+            threading.Thread(target=_report_memory,
+                             args=(server, memory_report_interval),
+                             daemon=True, name='memory-report').start()
+    return when_ready
+
+
+def _report_memory(server, interval):
+    while True:
+        time.sleep(interval)
+        master = process_memory()
+        server.log.info("master pid=%s rss=%skB", os.getpid(), master['rss'])
+        for pid, worker in list(server.WORKERS.items()):
+            mem = process_memory(pid)
+            server.log.info("worker %s pid=%s rss=%skB pss=%skB private=%skB",
+                            worker.age, pid, mem['rss'], mem['pss'], mem['private'])
+
+
+def _make_post_request(max_rss_kb):
+    def post_request(worker, req, environ, resp):
+        """Worker hook: retire this worker once it grows past max_rss."""
+        worker.handled = getattr(worker, 'handled', 0) + 1
+        if worker.handled % RSS_CHECK_EVERY:
+            return
+        rss = process_memory()['rss']
+        if rss > max_rss_kb:
+            worker.log.info("Worker %s at %skB RSS (limit %skB); recycling",
+                            worker.pid, rss, max_rss_kb)
+            worker.alive = False
+    return post_request
+
+
+class WarblerServer(BaseApplication):
+    """gunicorn application that serves the preloaded Warbler app."""
+
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def serve(app, bind='127.0.0.1:8000', workers=None, threads=8, max_requests=10000,
+          max_rss_mb=None, memory_report_interval=60, timeout=30):
+    """Serve `app` with preforked workers until the master is stopped.
+
+    Each worker runs `threads` threads. A long-lived /stream connection
+    holds one of them, so the app caps streams per worker
+    (LIVE_MAX_STREAMS) below `threads` to leave the rest for requests.
+    """
+    options = {
+        'bind': bind,
+        'workers': workers or (os.cpu_count() or 1) * 2 + 1,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'preload_app': True,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10 if max_requests else 0,
+        'timeout': timeout,
+        'graceful_timeout': timeout,
+        'when_ready': _make_when_ready(memory_report_interval),
+    }
+    if max_rss_mb:
+        options['post_request'] = _make_post_request(max_rss_mb * 1024)
+
+    WarblerServer(app, options).run()
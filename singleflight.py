@@ -0,0 +1,93 @@
+"""Request coalescing: concurrent identical computations run only once.
+
+When many requests need the same result at the same moment (say, the
+profile of an account that just posted), the first caller for a key runs
+the computation and everyone else who asks for that key while it is in
+flight waits for, and shares, its result or its exception. Nothing is
+kept once the flight lands; this is not a cache.
+
+Shared results are handed to several threads, so they must be plain,
+viewer-independent data -- not ORM objects tied to the leader's session.
+"""
+
+import threading
+
+
+class FlightTimeout(Exception):
+    """A coalesced caller gave up waiting for the in-flight result."""
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls to `do()` that share a key.
+
+    Callers that join a flight wait at most `timeout` seconds before
+    FlightTimeout is raised; the leader itself is never interrupted.
+    """
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), sharing one execution per `key`."""
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if leader:
+            try:
+                flight.result = fn(*args, **kwargs)
+            except BaseException as e:
+                flight.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.result
+
+        if not flight.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise FlightTimeout(f"timed out waiting for {key!r}")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self):
+        """Return counters describing coalescing so far."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._flights),
+            }
@@ -0,0 +1,70 @@
+// Prepend newly posted warbles to the home feed as they arrive over SSE.
+(function () {
+  var list = document.getElementById('messages');
+  if (!list || !window.EventSource) {
+    return;
+  }
+  var lastId = parseInt(list.dataset.lastId, 10) || 0;
+
+  function el(tag, attrs, text) {
+    var node = document.createElement(tag);
+    Object.keys(attrs || {}).forEach(function (name) {
+      node.setAttribute(name, attrs[name]);
+    });
+    if (text) {
+      node.textContent = text;
+    }
+    return node;
+  }
+
+  function render(msg) {
+    var item = el('li', {'class': 'list-group-item'});
+    item.appendChild(el('a', {href: '/messages/' + msg.id, 'class': 'message-link'}));
+    var avatar = el('a', {href: '/users/' + msg.user.id});
+    avatar.appendChild(el('img', {src: msg.user.image_url, alt: '', 'class': 'timeline-image'}));
+    item.appendChild(avatar);
+    var area = el('div', {'class': 'message-area'});
+    area.appendChild(el('a', {href: '/users/' + msg.user.id}, '@' + msg.user.username));
+    area.appendChild(el('span', {'class': 'text-muted'}, ' ' + msg.date));
+    area.appendChild(el('p', {}, msg.text));
+    item.appendChild(area);
+    return item;
+  }
+
+  function show(msg) {
+    if (msg.id <= lastId) {
+      return;
+    }
+    lastId = msg.id;
+    list.insertBefore(render(msg), list.firstChild);
+  }
+
+  // Fetch what we missed, then reconnect after `delay` ms.
+  function catchUp(delay) {
+    fetch('/messages/since?since_id=' + lastId, {credentials: 'same-origin'})
+      .then(function (resp) { return resp.json(); })
+      .then(function (data) { data.messages.forEach(show); })
+      .then(function () { setTimeout(connect, delay); },
+            function () { setTimeout(connect, 5000); });
+  }
+
+  function connect() {
+    var source = new EventSource('/stream?since_id=' + lastId);
+    source.addEventListener('message', function (e) {
+      show(JSON.parse(e.data));
+    });
+    // We fell behind and were dropped: catch up, then reconnect.
+    source.addEventListener('reset', function () {
+      source.close();
+      catchUp(0);
+    });
+    // Refused (the server is at its stream limit): poll until it has room.
+    source.addEventListener('error', function () {
+      if (source.readyState === EventSource.CLOSED) {
+        catchUp(30000);
+      }
+    });
+  }
+
+  connect();
+})();
@@ -0,0 +1,61 @@
+// Suggest usernames while an @mention is being typed in a warble.
+(function () {
+  var input = document.getElementById('text');
+  if (!input || !window.fetch) {
+    return;
+  }
+  var list = document.createElement('div');
+  list.className = 'list-group mention-suggestions';
+  input.parentNode.insertBefore(list, input.nextSibling);
+  var pending = null;
+
+  // The @word ending at the caret, or null.
+  function mentionAtCaret() {
+    var before = input.value.slice(0, input.selectionStart);
+    var match = /(^|[^\w@])@(\w{1,50})$/.exec(before);
+    return match ? {prefix: match[2], start: before.length - match[2].length} : null;
+  }
+
+  function choose(mention, username) {
+    var end = mention.start + mention.prefix.length;
+    input.value = input.value.slice(0, mention.start) + username + ' ' + input.value.slice(end);
+    var caret = mention.start + username.length + 1;
+    input.setSelectionRange(caret, caret);
+    input.focus();
+    list.innerHTML = '';
+  }
+
+  function show(mention, users) {
+    list.innerHTML = '';
+    users.forEach(function (user) {
+      var item = document.createElement('button');
+      item.type = 'button';
+      item.className = 'list-group-item list-group-item-action';
+      var img = document.createElement('img');
+      img.src = user.image_url;
+      img.alt = '';
+      img.className = 'timeline-image';
+      item.appendChild(img);
+      item.appendChild(document.createTextNode(' @' + user.username));
+      item.addEventListener('click', function () { choose(mention, user.username); });
+      list.appendChild(item);
+    });
+  }
+
+  input.addEventListener('input', function () {
+    var mention = mentionAtCaret();
+    if (pending) {
+      pending.abort();
+      pending = null;
+    }
+    if (!mention) {
+      list.innerHTML = '';
+      return;
+    }
+    pending = new AbortController();
+    fetch('/users/autocomplete?q=' + encodeURIComponent(mention.prefix),
+          {credentials: 'same-origin', signal: pending.signal})
+      .then(function (resp) { return resp.json(); })
+      .then(function (data) { show(mention, data.users); }, function () {});
+  });
+})();
@@ -0,0 +1,144 @@
+"""Hashtag and @mention extraction and indexing.
+
+Tags and mentions are parsed once, when a message is written, into the
+`message_tags` and `mentions` tables, so tag and mention timelines are
+index lookups instead of LIKE scans over `messages.text`.
+"""
+
+import re
+
+from markupsafe import Markup, escape
+
+from models import db, ArchivedMention, ArchivedTag, Message, MessageTag, Mention, User
+
+TAG_RE = re.compile(r'(?<![\w#&])#(\w{1,50})')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w{1,50})')
+
+
+def extract_tags(text):
+    """Return the distinct, lower-cased hashtags in `text`."""
+    return {tag.lower() for tag in TAG_RE.findall(text or '')}
+
+
+def extract_mentions(text):
+    """Return the distinct usernames @mentioned in `text`."""
+    return set(MENTION_RE.findall(text or ''))
+
+
+def index_rows(messages):
+    """Return (tag rows, mention rows) for `messages`.
+
+    Mentioned usernames are resolved with one query for the whole batch;
+    names that aren't users are ignored.
+    """
+    tag_rows = []
+    mentioned = {}
+    for msg in messages:
+        tag_rows.extend({'tag': tag, 'message_id': msg.id}
+                        for tag in extract_tags(msg.text))
+        for username in extract_mentions(msg.text):
+            mentioned.setdefault(username, []).append(msg)
+
+    mention_rows = []
+    if mentioned:
+        users = (db.session.query(User.username, User.id)
+                 .filter(User.username.in_(mentioned.keys())))
+        for username, user_id in users:
+            mention_rows.extend({'user_id': user_id, 'message_id': msg.id}
+                                for msg in mentioned[username])
+    return tag_rows, mention_rows
+
+
+def index_messages(messages):
+    """Add the tag and mention rows for `messages` (ids must be assigned)."""
+    tag_rows, mention_rows = index_rows(messages)
+    if tag_rows:
+        db.session.execute(MessageTag.__table__.insert(), tag_rows)
+    if mention_rows:
+        db.session.execute(Mention.__table__.insert(), mention_rows)
+
+
+def unindex_messages(message_ids):
+    """Remove the tag and mention rows of `message_ids`."""
+    MessageTag.query.filter(MessageTag.message_id.in_(message_ids)).delete(
+        synchronize_session=False)
+    Mention.query.filter(Mention.message_id.in_(message_ids)).delete(
+        synchronize_session=False)
+
+
+def tag_timeline(tag, before=None, limit=20, archive=None):
+    """Messages tagged `tag`, newest first, with ids below `before`.
+
+    With `archive` (a MessageArchive), archived messages are included.
+    """
+    query = (Message.query
+             .join(MessageTag, MessageTag.message_id == Message.id)
+             .filter(MessageTag.tag == tag.lower()))
+    if before:
+        query = query.filter(MessageTag.message_id < before)
+    hot = query.order_by(MessageTag.message_id.desc()).limit(limit).all()
+    if archive is None:
+        return hot
+    archived = (db.session.query(ArchivedTag.message_id)
+                .filter(ArchivedTag.tag == tag.lower()))
+    return _with_archived(hot, archive, archived, ArchivedTag.message_id, before, limit)
+
+
+def mention_timeline(user_id, before=None, limit=20, archive=None):
+    """Messages mentioning `user_id`, newest first, with ids below `before`.
+
+    With `archive` (a MessageArchive), archived messages are included.
+    """
+    query = (Message.query
+             .join(Mention, Mention.message_id == Message.id)
+             .filter(Mention.user_id == user_id))
+    if before:
+        query = query.filter(Mention.message_id < before)
+    hot = query.order_by(Mention.message_id.desc()).limit(limit).all()
+    if archive is None:
+        return hot
+    archived = (db.session.query(ArchivedMention.message_id)
+                .filter(ArchivedMention.user_id == user_id))
+    return _with_archived(hot, archive, archived, ArchivedMention.message_id,
+                          before, limit)
+
+
+def _with_archived(hot, archive, query, message_id, before, limit):
+    """The newest `limit` of `hot` and the archived messages `query` selects."""
+    if before:
+        query = query.filter(message_id < before)
+    ids = [msg_id for (msg_id,) in query.order_by(message_id.desc()).limit(limit)]
+    messages = hot + archive.get_many(ids)
+    return sorted(messages, key=lambda msg: msg.id, reverse=True)[:limit]
+
+
+def backfill(batch_size=1000):
+    """Re-index every existing message, `batch_size` messages at a time.
+
+    Walks `messages` by id so each batch is an index range, and commits
+    per batch. Returns the number of messages indexed.
+    """
+    last_id = 0
+    total = 0
+    while True:
+        batch = (Message.query
+                 .filter(Message.id > last_id)
+                 .order_by(Message.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            return total
+        ids = [msg.id for msg in batch]
+        unindex_messages(ids)
+        index_messages(batch)
+        db.session.commit()
+        db.session.expunge_all()
+        last_id = ids[-1]
+        total += len(ids)
+
+
+def linkify(text):
+    """Escape `text` and link its hashtags to their tag timelines."""
+    return Markup(TAG_RE.sub(
+        lambda m: f'<a href="/tags/{m.group(1).lower()}">#{m.group(1)}</a>',
+        str(escape(text))))
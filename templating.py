@@ -0,0 +1,33 @@
+"""Jinja bytecode caching and template warm-up.
+
+Compiled templates are stored in a directory shared by every worker, so a
+template is only compiled once per deploy rather than once per process.
+Jinja checks each cached entry against the template source's checksum, so
+edited templates are recompiled automatically.
+"""
+
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def configure_bytecode_cache(app, directory):
+    """Store `app`'s compiled templates in `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def app_template_names(app):
+    """Return the names of the templates under the app's templates folder."""
+    return sorted(app.jinja_loader.list_templates())
+
+
+def warm_templates(app):
+    """Load (and compile, or read from the bytecode cache) every template.
+
+    Returns the names of the loaded templates.
+    """
+    names = app_template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
@@ -1,5 +1,11 @@
+import os
 import unittest
-from app import app, db
+
+# PostgreSQL by default; set DATABASE_URL (e.g. sqlite:////tmp/warbler-test.db)
+# to run against another backend. Must happen before `app` is imported.
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import app, db, recent_messages, like_buffer, activity, page_cache, usernames, login_throttle
 
 class BaseTestCase(unittest.TestCase):
     def setUp(self):
@@ -9,14 +15,24 @@ class BaseTestCase(unittest.TestCase):
         self.app_context = self.app.app_context()
         self.app_context.push()
 
+        # the database is DATABASE_URL, read when `app` was imported above
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///warbler-test'
         app.config['WTF_CSRF_ENABLED'] = False
 
         db.create_all()
+        recent_messages.clear()
+        activity.clear()
+        page_cache.clear()
+        usernames.clear()
+        login_throttle.clear()
+        # write likes through immediately so tests can read them back
+        like_buffer.flush_interval = 0
+        # no background writer; tests call activity.flush() themselves
+        activity.flush_interval = 0
 
     def tearDown(self):
         """Teardown the database."""
+        activity.clear()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
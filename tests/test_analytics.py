@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+from models import db, User, Message, Likes, Follows, DailyActiveUser
+from analytics import SITE, SITE_METRICS, USER_METRICS, backfill, today
+from app import CURR_USER_KEY, activity, like_buffer
+from tests import BaseTestCase
+
+
+class AnalyticsTestCase(BaseTestCase):
+    """Test the daily activity rollups."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def login(self, c, user):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+            sess['_user_id'] = str(user.id)
+
+    def series(self, user_id, metrics=USER_METRICS, days=3):
+        return activity.series(user_id, metrics, days)[1]
+
+    def test_write_routes(self):
+        """Do posts, follows, unfollows and deletes update the rollups?"""
+        with self.client as c:
+            self.login(c, self.user1)
+            c.post("/messages/new", data={"text": "Hello"})
+            c.post(f"/users/follow/{self.user2.id}")
+            c.post(f"/users/follow/{self.user2.id}")
+            self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 1])
+            c.post(f"/users/stop-following/{self.user2.id}")
+            c.post(f"/users/stop-following/{self.user2.id}")
+            self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 0])
+            self.assertEqual(self.series(self.user1.id)['posts'], [0, 0, 1])
+
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(self.series(self.user1.id)['posts'], [0, 0, 0])
+
+        activity.flush()
+        site = self.series(SITE, SITE_METRICS)
+        self.assertEqual(site['active_users'], [0, 0, 1])
+        self.assertEqual(site['posts'], [0, 0, 0])
+
+    def test_likes_and_active_users(self):
+        """Are flushed likes credited to authors and each user active once a day?"""
+        msg = Message(text="Hello", user_id=self.user1.id)
+        db.session.add(msg)
+        db.session.commit()
+        like_buffer.record(self.user2.id, msg.id, True)
+        like_buffer.record(self.user2.id, msg.id, True)
+        self.assertEqual(self.series(self.user1.id)['likes_received'], [0, 0, 1])
+        like_buffer.record(self.user2.id, msg.id, False)
+        self.assertEqual(self.series(self.user1.id)['likes_received'], [0, 0, 0])
+
+        for user in (self.user1, self.user2, self.user1):
+            activity.active(user.id)
+        self.assertEqual(DailyActiveUser.query.count(), 0)
+        self.assertEqual(activity.flush(), 2)
+        activity.clear()
+        activity.active(self.user1.id)
+        self.assertEqual(activity.flush(), 0)
+        self.assertEqual(self.series(SITE, SITE_METRICS)['active_users'], [0, 0, 2])
+        self.assertEqual(DailyActiveUser.query.count(), 2)
+
+    def test_bulk_follow(self):
+        """Does a bulk follow count only the follows it added?"""
+        with self.client as c:
+            self.login(c, self.user1)
+            c.post(f"/users/follow/{self.user2.id}")
+            c.post("/users/following/bulk",
+                   json={'action': 'follow', 'user_ids': [self.user2.id, 9999]})
+            self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 1])
+            c.post("/users/following/bulk",
+                   json={'action': 'unfollow', 'user_ids': [self.user2.id]})
+            self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 0])
+
+    def test_backfill(self):
+        """Does the backfill fill in untracked days and keep recorded ones?"""
+        old = datetime.utcnow() - timedelta(days=1)
+        msgs = [Message(text="Old", user_id=self.user1.id, timestamp=old),
+                Message(text="Older", user_id=self.user1.id, timestamp=old),
+                Message(text="New", user_id=self.user2.id)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.user2.id, message_id=msgs[0].id))
+        db.session.add(Follows(user_being_followed_id=self.user1.id,
+                               user_following_id=self.user2.id))
+        # followers already tracked live
+        activity.followed([self.user2.id])
+        db.session.commit()
+
+        self.assertEqual(backfill(batch_size=1), 6)
+        # undated likes and follows stay out of the daily series
+        self.assertEqual(self.series(self.user1.id),
+                         {'posts': [0, 2, 0], 'likes_received': [0, 0, 0],
+                          'followers': [0, 0, 0]})
+        self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 1])
+        self.assertEqual(self.series(SITE, SITE_METRICS)['active_users'], [0, 1, 1])
+        # rerunning leaves the days it filled in alone
+        self.assertEqual(backfill(), 0)
+        self.assertEqual(self.series(self.user1.id)['posts'], [0, 2, 0])
+
+    def test_site_totals_batched(self):
+        """Are site totals held until a flush, and dropped on rollback?"""
+        activity.followed([self.user1.id])
+        db.session.commit()
+        activity.followed([self.user2.id])
+        db.session.rollback()
+        self.assertEqual(self.series(SITE, SITE_METRICS)['followers'], [0, 0, 0])
+        self.assertEqual(self.series(self.user1.id)['followers'], [0, 0, 1])
+        self.assertEqual(self.series(self.user2.id)['followers'], [0, 0, 0])
+        activity.flush()
+        self.assertEqual(self.series(SITE, SITE_METRICS)['followers'], [0, 0, 1])
+
+    def test_stats_endpoints(self):
+        """Do the stats endpoints return zero-filled daily arrays?"""
+        activity.followed([self.user1.id])
+        db.session.commit()
+        activity.flush()
+        resp = self.client.get(f"/users/{self.user1.id}/stats?days=2")
+        data = resp.get_json()
+        self.assertEqual(data['start'], (today() - timedelta(days=1)).isoformat())
+        self.assertEqual(data['series']['followers'], [0, 1])
+        self.assertEqual(self.client.get("/stats").get_json()['series']['followers'][-1], 1)
+        self.assertEqual(len(self.client.get("/stats").get_json()['series']['posts']), 30)
+        self.assertEqual(self.client.get("/stats?days=0").status_code, 400)
+        self.assertEqual(self.client.get("/users/9999/stats").status_code, 404)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from models import db, User, Message, Likes, ArchiveEntry, ArchivedLike
+from tags import index_messages, tag_timeline, mention_timeline
+from export import export_records
+import readmodel
+from app import app, message_archive, CURR_USER_KEY
+from tests import BaseTestCase
+
+
+class ArchiveTestCase(BaseTestCase):
+    """Test moving old messages to archive partitions."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+        stamps = [datetime(2020, 1, d) for d in (3, 4, 5)] + [datetime(2020, 2, 1),
+                                                              datetime(2020, 3, 9)]
+        self.msgs = [Message(text=f"Old #warble {i}", user_id=self.user1.id, timestamp=ts)
+                     for i, ts in enumerate(stamps)]
+        self.new = Message(text="New warble", user_id=self.user1.id)
+        db.session.add_all(self.msgs + [self.new])
+        db.session.flush()
+        index_messages(self.msgs)
+        db.session.add(Likes(user_id=self.user2.id, message_id=self.msgs[0].id))
+        db.session.commit()
+        self.ids = [m.id for m in self.msgs]
+
+        self.archive_dir = tempfile.mkdtemp()
+        self.old_dir = message_archive.directory
+        self.old_block_size = message_archive.block_size
+        message_archive.directory = self.archive_dir
+        message_archive.block_size = 2
+
+    def tearDown(self):
+        db.session.rollback()
+        message_archive.directory = self.old_dir
+        message_archive.block_size = self.old_block_size
+        shutil.rmtree(self.archive_dir)
+        super().tearDown()
+
+    def archive(self):
+        return message_archive.archive(datetime(2020, 3, 15))
+
+    def test_archive_moves_whole_months(self):
+        """Are months before the cutoff moved out of the hot tables?"""
+        self.assertEqual(self.archive(), {'2020-01': 3, '2020-02': 1})
+
+        hot = [m.id for m in Message.query.order_by(Message.id)]
+        self.assertEqual(len(hot), 2)
+        self.assertNotIn(self.ids[0], hot)
+        self.assertEqual(ArchiveEntry.query.count(), 4)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(tag_timeline('warble')[0].id, self.ids[4])
+        self.assertTrue(os.path.exists(os.path.join(self.archive_dir, 'messages-2020-01.arc')))
+
+    def test_get_archived(self):
+        """Are archived messages read back with their author and likes?"""
+        self.archive()
+        msg = message_archive.get(self.ids[0])
+        self.assertTrue(msg.archived)
+        self.assertEqual(msg.text, "Old #warble 0")
+        self.assertEqual(msg.timestamp, datetime(2020, 1, 3))
+        self.assertEqual(msg.user.username, "testuser1")
+        self.assertEqual(msg.liked_by, (self.user2.id,))
+        self.assertEqual([m.id for m in message_archive.get_many(self.ids[::-1])],
+                         self.ids[3::-1])
+        self.assertIsNone(message_archive.get(self.new.id))
+
+    def test_rearchiving_month_adds_partition(self):
+        """Does a late message in an archived month get a new partition?"""
+        self.archive()
+        late = Message(text="Late", user_id=self.user1.id, timestamp=datetime(2020, 1, 20))
+        db.session.add(late)
+        db.session.commit()
+        late_id = late.id
+
+        self.assertEqual(self.archive(), {'2020-01.2': 1})
+        self.assertEqual(message_archive.get(late_id).text, "Late")
+        self.assertEqual(message_archive.get(self.ids[1]).text, "Old #warble 1")
+
+    def test_forget(self):
+        """Does forgetting an archived message remove its text from disk?"""
+        self.archive()
+        self.assertEqual(message_archive.get(self.ids[1]).text, "Old #warble 1")
+        self.assertTrue(message_archive.forget(self.ids[1]))
+        self.assertIsNone(message_archive.get(self.ids[1]))
+        self.assertEqual([m.id for m in message_archive.get_many(self.ids)],
+                         [self.ids[0], self.ids[2], self.ids[3]])
+        self.assertEqual(message_archive.get(self.ids[0]).liked_by, (self.user2.id,))
+
+        files = sorted(os.listdir(self.archive_dir))
+        self.assertEqual(files, ['messages-2020-01.2.arc', 'messages-2020-02.arc'])
+        self.assertTrue(message_archive.forget(self.ids[3]))
+        self.assertEqual(os.listdir(self.archive_dir), ['messages-2020-01.2.arc'])
+        self.assertFalse(message_archive.forget(self.ids[3]))
+
+    def test_likes_tags_and_mentions_kept(self):
+        """Do archived messages stay on likes pages, tag and mention timelines and counts?"""
+        mention = Message(text="Hi @testuser2", user_id=self.user1.id,
+                          timestamp=datetime(2020, 1, 9))
+        db.session.add(mention)
+        db.session.flush()
+        index_messages([mention])
+        db.session.commit()
+        mention_id = mention.id
+        self.archive()
+
+        self.assertEqual(ArchivedLike.query.count(), 1)
+        self.assertEqual([m.id for m in tag_timeline('warble', archive=message_archive)],
+                         self.ids[::-1])
+        self.assertEqual([m.id for m in tag_timeline('warble', self.ids[3], 2,
+                                                     message_archive)],
+                         [self.ids[2], self.ids[1]])
+        self.assertEqual([m.id for m in mention_timeline(self.user2.id,
+                                                         archive=message_archive)],
+                         [mention_id])
+        self.assertIn(('like', {'message_id': self.ids[0]}),
+                      list(export_records(self.user2.id)))
+        self.assertEqual(readmodel.profile(self.user1.id).message_count, 7)
+        self.assertEqual(readmodel.profile(self.user2.id).likes_count, 1)
+
+        html = self.client.get(f"/users/{self.user2.id}/likes").get_data(as_text=True)
+        self.assertIn('Old <a href="/tags/warble">#warble</a> 0', html)
+
+    def test_export_includes_archived(self):
+        """Does the account export read archived messages back, in id order?"""
+        self.archive()
+        messages = [record for kind, record in export_records(self.user1.id, message_archive)
+                    if kind == 'message']
+        self.assertEqual([m['id'] for m in messages], self.ids + [self.new.id])
+        self.assertEqual(messages[0], {'id': self.ids[0], 'text': "Old #warble 0",
+                                       'timestamp': "2020-01-03T00:00:00"})
+
+    def test_older_link_for_archived_author(self):
+        """Does a fully archived author's profile link to the archive?"""
+        Message.query.filter(Message.id.notin_(self.ids)).delete()
+        db.session.commit()
+        message_archive.archive(datetime(2020, 4, 1))
+        resp = self.client.get(f"/users/{self.user1.id}")
+        self.assertIn(f'href="?before={self.ids[4] + 1}"', resp.get_data(as_text=True))
+
+    def test_views_resolve_archived(self):
+        """Do message and profile pages show archived messages?"""
+        self.archive()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user2.id
+                sess['_user_id'] = str(self.user2.id)
+
+            resp = c.get(f"/messages/{self.ids[0]}")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Old <a href="/tags/warble">#warble</a> 0', resp.get_data(as_text=True))
+            self.assertEqual(c.get("/messages/999999").status_code, 404)
+
+            resp = c.get(f"/users/{self.user1.id}?before={self.new.id}")
+            html = resp.get_data(as_text=True)
+            for i in range(5):
+                self.assertIn(f'Old <a href="/tags/warble">#warble</a> {i}</p>', html)
+            self.assertNotIn("<p>New warble</p>", html)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import gzip
+from flask.sessions import SecureCookieSessionInterface
+from models import db, User, Message, ArchiveEntry, ArchivedLike, DailyActiveUser
+from asgi import AsyncPages, async_database_url, wsgi_environ
+from app import app, activity, CURR_USER_KEY
+from tests import BaseTestCase
+
+
+class AsgiTestCase(BaseTestCase):
+    """Test the async ASGI pages."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+        self.user1.following.append(self.user2)
+        self.msg = Message(text="Async warble", user_id=self.user2.id)
+        db.session.add(self.msg)
+        db.session.commit()
+        self.pages = AsyncPages(app, async_database_url(str(db.engine.url)))
+
+    def tearDown(self):
+        asyncio.run(self.pages.engine.dispose())
+        db.session.rollback()
+        super().tearDown()
+
+    def cookie(self, user_id):
+        serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+        value = serializer.dumps({CURR_USER_KEY: user_id, '_user_id': str(user_id)})
+        return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+    def get(self, path, query=b'', cookie=None, encoding=None):
+        """Call the ASGI app; return (status, headers, body)."""
+        headers = [(b'host', b'localhost')]
+        if cookie:
+            headers.append((b'cookie', cookie.encode()))
+        if encoding:
+            headers.append((b'accept-encoding', encoding.encode()))
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                 'query_string': query, 'root_path': '', 'headers': headers,
+                 'server': ('localhost', 80), 'client': ('127.0.0.1', 5000)}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.pages(scope, receive, send))
+        start = sent[0]
+        body = b''.join(m.get('body', b'') for m in sent[1:])
+        return start['status'], dict(start['headers']), body
+
+    def test_wsgi_environ(self):
+        """Are ASGI headers mapped to WSGI environ keys?"""
+        environ = wsgi_environ({
+            'method': 'GET', 'path': '/x', 'query_string': b'a=1', 'http_version': '1.1',
+            'headers': [(b'content-type', b'text/plain'), (b'x-a', b'1'), (b'x-a', b'2')]})
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_X_A'], '1,2')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+
+    def test_feed(self):
+        """Does the async home feed show followed users' messages?"""
+        status, headers, body = self.get('/', cookie=self.cookie(self.user1.id))
+        self.assertEqual(status, 200)
+        self.assertIn(b"<p>Async warble</p>", body)
+        self.assertIn(b"@testuser1", body)
+
+    def test_feed_archived_likes_and_activity(self):
+        """Does the async feed show archived likes and count the viewer active?"""
+        db.session.add(ArchiveEntry(id=9999, user_id=self.user2.id, partition='test'))
+        db.session.add(ArchivedLike(user_id=self.user1.id, message_id=9999))
+        db.session.commit()
+        status, headers, body = self.get('/', cookie=self.cookie(self.user1.id))
+        self.assertIn(f'/users/{self.user1.id}/likes">1</a>'.encode(), body)
+        self.assertEqual(activity.flush(), 1)
+        self.assertEqual(DailyActiveUser.query.one().user_id, self.user1.id)
+
+    def test_anonymous_home(self):
+        """Is the anonymous home page served without a feed?"""
+        status, headers, body = self.get('/')
+        self.assertEqual(status, 200)
+        self.assertNotIn(b"<p>Async warble</p>", body)
+
+    def test_profile_and_message(self):
+        """Are profile and message pages rendered and gzipped on request?"""
+        cookie = self.cookie(self.user1.id)
+        status, headers, body = self.get(f'/users/{self.user2.id}', cookie=cookie,
+                                         encoding='gzip')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertIn(b"<p>Async warble</p>", gzip.decompress(body))
+
+        status, headers, body = self.get(f'/messages/{self.msg.id}', cookie=cookie)
+        self.assertEqual(status, 200)
+        self.assertNotIn(b'content-encoding', headers)
+        self.assertEqual(headers[b'vary'], b'Cookie, Accept-Encoding')
+        self.assertEqual(int(headers[b'content-length']), len(body))
+        self.assertIn(b"@testuser2", body)
+
+    def test_deleted_viewer(self):
+        """Is a session naming a deleted user served the anonymous page?"""
+        status, headers, body = self.get('/', cookie=self.cookie(9999))
+        self.assertEqual(status, 200)
+        self.assertNotIn(b"<p>Async warble</p>", body)
+
+    def test_anonymous_pages_use_page_cache(self):
+        """Are logged-out visitors handed to the cached Flask views?"""
+        path = f'/users/{self.user2.id}'
+        self.assertEqual(self.get(path)[1][b'x-cache'], b'MISS')
+        status, headers, body = self.get(path)
+        self.assertEqual(headers[b'x-cache'], b'HIT')
+        self.assertIn(b"<p>Async warble</p>", body)
+
+    def test_falls_back_to_wsgi(self):
+        """Are other routes and unknown ids handled by the Flask app?"""
+        self.assertEqual(self.get('/messages/9999')[0], 404)
+        status, headers, body = self.get('/users', query=b'q=testuser2')
+        self.assertEqual(status, 200)
+        self.assertIn(b"@testuser2", body)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,81 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from assets import AssetManifest, build
+from app import app, asset_manifest
+
+CSS = b'body { background: url("/static/images/bg.png"); }\n' * 20
+
+
+class AssetBuildTestCase(TestCase):
+    """Test the fingerprinted static asset pipeline."""
+
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+        with open(os.path.join(self.static, 'images', 'bg.png'), 'wb') as f:
+            f.write(b'\x89PNG fake image')
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'wb') as f:
+            f.write(CSS)
+        self.dist = os.path.join(self.static, 'dist')
+        self.manifest = build(self.static, self.dist)
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def test_fingerprinted_names(self):
+        """Are built files named by their content hash?"""
+        hashed = self.manifest['stylesheets/style.css']
+        self.assertRegex(hashed, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.isfile(os.path.join(self.dist, hashed)))
+
+    def test_css_urls_rewritten(self):
+        """Do stylesheet url()s point at the hashed images?"""
+        with open(os.path.join(self.dist, self.manifest['stylesheets/style.css'])) as f:
+            css = f.read()
+        self.assertIn(f"/assets/{self.manifest['images/bg.png']}", css)
+        self.assertNotIn('/static/images/bg.png', css)
+
+    def test_precompressed_only_for_text(self):
+        """Is gzip built for CSS but not for images?"""
+        css = os.path.join(self.dist, self.manifest['stylesheets/style.css'])
+        png = os.path.join(self.dist, self.manifest['images/bg.png'])
+        self.assertTrue(os.path.isfile(css + '.gz'))
+        self.assertFalse(os.path.isfile(png + '.gz'))
+        with gzip.open(css + '.gz') as f:
+            self.assertIn(b'/assets/images/bg.', f.read())
+
+    def test_manifest_urls(self):
+        """Does the template helper emit hashed URLs, with a plain fallback?"""
+        manifest = AssetManifest(self.dist)
+        self.assertEqual(manifest.url('stylesheets/style.css'),
+                         '/assets/' + self.manifest['stylesheets/style.css'])
+        self.assertEqual(manifest.url('missing.js'), '/static/missing.js')
+
+    def test_asset_route(self):
+        """Are assets served precompressed with immutable caching?"""
+        old_dir, asset_manifest.out_dir = asset_manifest.out_dir, self.dist
+        asset_manifest.reload()
+        self.addCleanup(asset_manifest.reload)
+        self.addCleanup(setattr, asset_manifest, 'out_dir', old_dir)
+
+        url = asset_manifest.url('stylesheets/style.css')
+        with app.test_client() as c:
+            resp = c.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+            resp.close()
+
+            resp = c.get('/assets/manifest.json')
+            self.assertEqual(resp.status_code, 404)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,100 @@
+from flask import g
+from models import db, User, Follows
+from app import app, CURR_USER_KEY, image_filter, usernames
+from autocomplete import UsernameIndex
+from tests import BaseTestCase
+
+
+class AutocompleteTestCase(BaseTestCase):
+    """Test @mention username autocomplete."""
+
+    def setUp(self):
+        super().setUp()
+        names = ["alice", "Alfred", "albert", "bob", "Alan"]
+        self.users = {name: User.signup(name, f"{name}@test.com", "password", None)
+                      for name in names}
+        db.session.commit()
+        self.ids = {name: user.id for name, user in self.users.items()}
+        # bob and albert follow Alan; bob follows albert
+        for follower, followed in [("bob", "Alan"), ("albert", "Alan"), ("bob", "albert")]:
+            db.session.add(Follows(user_following_id=self.ids[follower],
+                                   user_being_followed_id=self.ids[followed]))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def complete(self, index, prefix, **kwargs):
+        return [username for _, username, _ in index.complete(prefix, **kwargs)]
+
+    def test_ranking(self):
+        """Are followees first, then popular users, then names alphabetically?"""
+        index = UsernameIndex()
+        self.assertEqual(self.complete(index, "AL"),
+                         ["Alan", "albert", "Alfred", "alice"])
+        self.assertEqual(self.complete(index, "al", following=[self.ids["alice"]],
+                                       exclude=self.ids["Alan"], limit=2),
+                         ["alice", "albert"])
+        self.assertEqual(self.complete(index, "zed"), [])
+
+    def test_wide_prefixes_cached(self):
+        """Do cached results for wide prefixes follow signups and renames?"""
+        index = UsernameIndex(scan_limit=1)
+        self.assertEqual(self.complete(index, "a", limit=2), ["Alan", "albert"])
+        self.assertIn("a", index._popular)
+        index.add(self.ids["bob"], "aardvark", None)
+        self.assertEqual(self.complete(index, "a"),
+                         ["Alan", "albert", "aardvark", "Alfred", "alice"])
+        self.assertEqual(self.complete(index, "b"), [])
+        index.remove(self.ids["Alan"])
+        self.assertEqual(self.complete(index, "a", limit=1), ["albert"])
+
+    def test_reload(self):
+        """Does the index reload once `reload_interval` has passed?"""
+        index = UsernameIndex(reload_interval=0)
+        index.init_app(app)
+        self.assertEqual(self.complete(index, "bob"), ["bob"])
+        User.signup("bobby", "bobby@test.com", "password", None)
+        db.session.commit()
+        # the stale index answers while a background reload runs
+        self.assertEqual(self.complete(index, "bob"), ["bob"])
+        index._refresher.join()
+        self.assertEqual(self.complete(index, "bob"), ["bob", "bobby"])
+
+    def test_following_cached(self):
+        """Are followee ids cached until the typer follows someone?"""
+        index = UsernameIndex()
+        self.assertEqual(index.following(self.ids["bob"]),
+                         {self.ids["Alan"], self.ids["albert"]})
+        db.session.add(Follows(user_following_id=self.ids["bob"],
+                               user_being_followed_id=self.ids["alice"]))
+        db.session.commit()
+        self.assertNotIn(self.ids["alice"], index.following(self.ids["bob"]))
+        index.followed(self.ids["bob"])
+        self.assertIn(self.ids["alice"], index.following(self.ids["bob"]))
+
+    def test_endpoint_and_signup(self):
+        """Does the endpoint rank for the typer and see new signups at once?"""
+        with self.client as c:
+            self.assertEqual(c.get("/users/autocomplete?q=al").status_code, 401)
+            g.pop('_login_user', None)
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["bob"]
+                sess['_user_id'] = str(self.ids["bob"])
+            data = c.get("/users/autocomplete?q=@al&limit=2").get_json()
+            thumb = image_filter(self.users["Alan"].image_url, 'thumb')
+            self.assertEqual(data['users'], [
+                {'id': self.ids["Alan"], 'username': "Alan", 'image_url': thumb},
+                {'id': self.ids["albert"], 'username': "albert", 'image_url': thumb}])
+            self.assertEqual(c.get("/users/autocomplete?q=").get_json(), {'users': []})
+            self.assertEqual(c.get("/users/autocomplete?q=a&limit=99").status_code, 400)
+
+        self.client.post("/signup", data={"username": "alex", "email": "alex@test.com",
+                                          "password": "password"})
+        self.assertIn("alex", self.complete(usernames, "ale"))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
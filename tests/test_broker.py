@@ -0,0 +1,154 @@
+from unittest import TestCase, mock
+from broker import Broker, PollingRelay
+from models import db, User, Message
+from app import app, CURR_USER_KEY, broker, live_events, latest_message_id, live_relay
+from tests import BaseTestCase
+
+
+class BrokerTestCase(TestCase):
+    """Test the in-process pub/sub broker."""
+
+    def test_delivers_to_topic_subscribers(self):
+        """Do only subscribers of an author get that author's events?"""
+        broker = Broker()
+        follower = broker.subscribe({1, 2})
+        stranger = broker.subscribe({3})
+
+        self.assertEqual(broker.publish(1, {'id': 10}), 1)
+        self.assertEqual(follower.get(timeout=0), {'id': 10})
+        self.assertIsNone(stranger.get(timeout=0))
+
+    def test_unsubscribe(self):
+        """Does closing a subscription stop delivery?"""
+        broker = Broker()
+        with broker.subscribe({1}):
+            self.assertEqual(broker.subscriber_count(), 1)
+        self.assertEqual(broker.subscriber_count(), 0)
+        self.assertEqual(broker.publish(1, {'id': 10}), 0)
+
+    def test_slow_consumer_dropped(self):
+        """Is a subscriber with a full queue dropped?"""
+        broker = Broker(maxsize=2)
+        slow = broker.subscribe({1})
+        fast = broker.subscribe({1})
+        for i in range(3):
+            broker.publish(1, {'id': i})
+            fast.get(timeout=0)
+
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual(broker.dropped, 1)
+        self.assertEqual(broker.subscriber_count(), 1)
+
+    def test_subscriber_limit(self):
+        """Is a subscription refused once the broker holds `limit`?"""
+        broker = Broker()
+        first = broker.subscribe({1}, limit=1)
+        self.assertIsNone(broker.subscribe({2}, limit=1))
+        first.close()
+        self.assertIsNotNone(broker.subscribe({2}, limit=1))
+
+    def test_relay_publishes_new_rows(self):
+        """Does the relay publish rows newer than when it started, in order?"""
+        rows = [(1, 7, {'id': 1})]
+        broker = Broker()
+        relay = PollingRelay(broker, lambda after: [r for r in rows if r[0] > after],
+                             lambda: max(r[0] for r in rows), interval=3600)
+        self.assertEqual(relay.poll(), 0)
+        sub = broker.subscribe({7})
+        relay.start()
+        rows += [(2, 7, {'id': 2}), (3, 8, {'id': 3}), (4, 7, {'id': 4})]
+        self.assertEqual(relay.poll(), 3)
+        self.assertEqual([sub.get(timeout=0), sub.get(timeout=0)], [{'id': 2}, {'id': 4}])
+        self.assertEqual(relay.poll(), 0)
+        sub.close()
+        relay.poll()
+        self.assertIsNone(relay._last_id)
+
+
+class LiveTimelineViewsTestCase(BaseTestCase):
+    """Test the incremental timeline fetch."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        self.user3 = User.signup("testuser3", "test3@test.com", "password", None)
+        db.session.commit()
+        self.user1.following.append(self.user2)
+        db.session.commit()
+
+        self.msgs = [Message(text=f"Message {i}", user_id=author.id)
+                     for i, author in enumerate([self.user2, self.user3, self.user2])]
+        db.session.add_all(self.msgs)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_messages_since(self):
+        """Are only newer messages from followed authors returned?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+                sess['_user_id'] = str(self.user1.id)
+
+            resp = c.get(f"/messages/since?since_id={self.msgs[0].id}")
+            self.assertEqual(resp.status_code, 200)
+            ids = [m['id'] for m in resp.get_json()['messages']]
+            self.assertEqual(ids, [self.msgs[2].id])
+
+    def test_other_workers_posts_relayed(self):
+        """Are messages stored by another process relayed from the table?"""
+        broker = Broker()
+        relay = PollingRelay(broker, live_events, latest_message_id, interval=3600)
+        sub = broker.subscribe({self.user2.id})
+        relay.start()
+        msg = Message(text="Elsewhere", user_id=self.user2.id)
+        db.session.add(msg)
+        db.session.commit()
+        self.assertEqual(relay.poll(), 1)
+        event = sub.get(timeout=0)
+        self.assertEqual((event['id'], event['text'], event['user']['username']),
+                         (msg.id, "Elsewhere", "testuser2"))
+
+    def test_stream_limit(self):
+        """Is a stream over the per-worker limit refused with a 503?"""
+        limit = app.config['LIVE_MAX_STREAMS']
+        app.config['LIVE_MAX_STREAMS'] = 0
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user1.id
+                    sess['_user_id'] = str(self.user1.id)
+                resp = c.get("/stream")
+        finally:
+            app.config['LIVE_MAX_STREAMS'] = limit
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '30')
+
+    def test_stream_released(self):
+        """Is a stream's subscription released if it fails to start or the
+        client leaves before reading?"""
+        before = broker.subscriber_count()
+        heartbeat, app.config['LIVE_HEARTBEAT'] = app.config['LIVE_HEARTBEAT'], 0.01
+        self.addCleanup(app.config.__setitem__, 'LIVE_HEARTBEAT', heartbeat)
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+                sess['_user_id'] = str(self.user1.id)
+            with mock.patch.object(live_relay, 'start', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    c.get("/stream")
+            self.assertEqual(broker.subscriber_count(), before)
+
+            resp = c.get("/stream")
+            self.assertEqual(broker.subscriber_count(), before + 1)
+            resp.close()
+        self.assertEqual(broker.subscriber_count(), before)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,95 @@
+import gzip
+from unittest import TestCase
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from compression import CompressionMiddleware, accepts_gzip
+
+BODY = b"<li>warble</li>" * 200
+
+
+def make_app(body=BODY, content_type='text/html', status=200, stream=False, **headers):
+    """Return a WSGI app that serves `body`, optionally chunk by chunk."""
+    def app(environ, start_response):
+        if stream:
+            chunks = (body[i:i + 100] for i in range(0, len(body), 100))
+            resp = Response(chunks, status=status, content_type=content_type)
+        else:
+            resp = Response(body, status=status, content_type=content_type)
+        resp.headers.update(headers)
+        return resp(environ, start_response)
+    return app
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test the gzip response middleware."""
+
+    def get(self, app, encoding='gzip', **kwargs):
+        client = Client(CompressionMiddleware(app, min_size=500))
+        return client.get('/', headers={'Accept-Encoding': encoding}, **kwargs)
+
+    def test_accepts_gzip(self):
+        """Is Accept-Encoding negotiated, including q=0?"""
+        self.assertTrue(accepts_gzip("gzip, deflate, br"))
+        self.assertTrue(accepts_gzip("*"))
+        self.assertFalse(accepts_gzip("gzip;q=0, br"))
+        self.assertFalse(accepts_gzip("identity"))
+        self.assertFalse(accepts_gzip(None))
+
+    def test_compresses_html(self):
+        """Is a large HTML response gzipped?"""
+        resp = self.get(make_app())
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.data), BODY)
+
+    def test_compresses_stream(self):
+        """Is a streamed response compressed without a Content-Length?"""
+        resp = self.get(make_app(stream=True))
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.data), BODY)
+
+    def test_etag_weakened(self):
+        """Does a gzipped response carry a weak ETag, and still revalidate?"""
+        app = make_app(ETag='"abc"')
+        self.assertEqual(self.get(app).headers['ETag'], 'W/"abc"')
+        self.assertEqual(self.get(app, encoding='identity').headers['ETag'], '"abc"')
+        self.assertEqual(self.get(make_app(ETag='W/"abc"')).headers['ETag'], 'W/"abc"')
+
+        def conditional(environ, start_response):
+            resp = Response(BODY, content_type='text/html')
+            resp.set_etag('abc')
+            return resp.make_conditional(environ)(environ, start_response)
+        resp = self.get(conditional, encoding='gzip')
+        resp = Client(CompressionMiddleware(conditional)).get(
+            '/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_small_stream_uncompressed(self):
+        """Is a streamed response under the threshold left alone?"""
+        resp = self.get(make_app(body=b"short", stream=True))
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, b"short")
+
+    def test_skips(self):
+        """Are small, binary, 304 and already-encoded responses skipped?"""
+        cases = [
+            make_app(body=b"tiny"),
+            make_app(content_type='image/png'),
+            make_app(status=304),
+            make_app(**{'Content-Encoding': 'br'}),
+        ]
+        for app in cases:
+            resp = self.get(app)
+            self.assertNotEqual(resp.headers.get('Content-Encoding'), 'gzip')
+
+    def test_client_without_gzip(self):
+        """Do clients that don't accept gzip get the identity body?"""
+        resp = self.get(make_app(), encoding='identity')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, BODY)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
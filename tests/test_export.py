@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+from models import db, User, Message, Likes
+from export import export
+from app import app, CURR_USER_KEY
+from tests import BaseTestCase
+
+
+class ExportTestCase(BaseTestCase):
+    """Test the streaming account export."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+        self.user1.following.append(self.user2)
+        self.user2.following.append(self.user1)
+        self.msgs = [Message(text=f"Message {i}", user_id=self.user1.id) for i in range(3)]
+        other = Message(text="Not mine", user_id=self.user2.id)
+        db.session.add_all(self.msgs + [other])
+        db.session.commit()
+        db.session.add(Likes(user_id=self.user1.id, message_id=other.id))
+        db.session.commit()
+        self.other = other
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_ndjson(self):
+        """Does the NDJSON export contain every record and no password?"""
+        stats = {}
+        body = b''.join(export(self.user1.id, 'ndjson', stats)).decode()
+        records = [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual(stats['rows'], len(records))
+        self.assertEqual(records[0]['type'], 'profile')
+        self.assertEqual(records[0]['username'], 'testuser1')
+        self.assertNotIn('password', records[0])
+        self.assertEqual([r['id'] for r in records if r['type'] == 'message'],
+                         [m.id for m in self.msgs])
+        self.assertEqual([r['message_id'] for r in records if r['type'] == 'like'],
+                         [self.other.id])
+        self.assertEqual([r['user_id'] for r in records if r['type'] == 'following'],
+                         [self.user2.id])
+        self.assertEqual([r['user_id'] for r in records if r['type'] == 'follower'],
+                         [self.user2.id])
+
+    def test_csv(self):
+        """Does the CSV export have a header and one row per record?"""
+        body = b''.join(export(self.user1.id, 'csv')).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 1 + 3 + 1 + 1 + 1)
+        self.assertEqual(rows[1]['text'], "Message 0")
+
+    def test_export_view_requires_login(self):
+        """Is the export refused to anonymous users?"""
+        self.assertEqual(self.client.get("/users/export").status_code, 401)
+
+    def test_export_view(self):
+        """Is the current user's export streamed as an attachment?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+                sess['_user_id'] = str(self.user1.id)
+
+            resp = c.get("/users/export?format=csv")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.is_streamed)
+            self.assertIn('attachment', resp.headers['Content-Disposition'])
+            self.assertIn("Message 2", resp.get_data(as_text=True))
+            self.assertEqual(c.get("/users/export?format=xml").status_code, 400)
+
+    def test_cli(self):
+        """Does `flask export-user` report throughput, and reject unknown users?"""
+        result = app.test_cli_runner().invoke(args=['export-user', str(self.user1.id)])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('rows/sec', result.output)
+
+        result = app.test_cli_runner().invoke(args=['export-user', '9999'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('no such user', result.output)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,77 @@
+from models import db, User, Follows
+from app import CURR_USER_KEY
+from tests import BaseTestCase
+
+
+class FollowsTestCase(BaseTestCase):
+    """Test set-based follow and unfollow."""
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.signup(f"testuser{i}", f"test{i}@test.com", "password", None)
+                      for i in range(4)]
+        db.session.commit()
+        self.me, self.a, self.b, self.c = self.users
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def following_ids(self, user):
+        return {f.user_being_followed_id for f in
+                Follows.query.filter_by(user_following_id=user.id)}
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.me.id
+            sess['_user_id'] = str(self.me.id)
+
+    def test_follow_is_idempotent(self):
+        """Are existing edges, unknown ids and self-follows skipped?"""
+        self.assertEqual(Follows.follow(self.me.id, [self.a.id, self.b.id]), 2)
+        self.assertEqual(Follows.follow(self.me.id, [self.a.id, self.c.id, self.me.id, 9999]), 1)
+        db.session.commit()
+        self.assertEqual(self.following_ids(self.me), {self.a.id, self.b.id, self.c.id})
+
+    def test_unfollow(self):
+        """Does unfollowing delete only the named edges?"""
+        Follows.follow(self.me.id, [self.a.id, self.b.id])
+        self.assertEqual(Follows.unfollow(self.me.id, [self.a.id, 9999]), 1)
+        self.assertEqual(Follows.unfollow(self.me.id, [self.a.id]), 0)
+        db.session.commit()
+        self.assertEqual(self.following_ids(self.me), {self.b.id})
+
+    def test_follow_views(self):
+        """Do follow routes 404 for unknown users and tolerate repeats?"""
+        with self.client as c:
+            self.login(c)
+            self.assertEqual(c.post(f"/users/follow/{self.a.id}").status_code, 302)
+            self.assertEqual(c.post(f"/users/follow/{self.a.id}").status_code, 302)
+            self.assertEqual(c.post("/users/follow/9999").status_code, 404)
+            self.assertEqual(self.following_ids(self.me), {self.a.id})
+
+            self.assertEqual(c.post("/users/stop-following/9999").status_code, 302)
+            self.assertEqual(c.post(f"/users/stop-following/{self.a.id}").status_code, 302)
+            self.assertEqual(self.following_ids(self.me), set())
+
+    def test_bulk_follow(self):
+        """Does the bulk endpoint follow and unfollow lists of users?"""
+        ids = [self.a.id, self.b.id, self.c.id]
+        with self.client as c:
+            self.login(c)
+            resp = c.post("/users/following/bulk", json={'action': 'follow', 'user_ids': ids})
+            self.assertEqual(resp.get_json(), {'action': 'follow', 'changed': 3})
+            self.assertEqual(self.following_ids(self.me), set(ids))
+
+            resp = c.post("/users/following/bulk",
+                          json={'action': 'unfollow', 'user_ids': ids[:2]})
+            self.assertEqual(resp.get_json()['changed'], 2)
+            self.assertEqual(self.following_ids(self.me), {self.c.id})
+
+            resp = c.post("/users/following/bulk", json={'action': 'follow', 'user_ids': "1"})
+            self.assertEqual(resp.status_code, 400)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,186 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase, mock
+from PIL import Image
+import images
+from images import (ImageCache, ImageFetchError, ImageRejected, VARIANTS, fetch_url,
+                    is_public_address)
+from app import app, image_cache, image_signer
+
+
+def make_png(size=(300, 200)):
+    """Return the bytes of a solid-colour PNG."""
+    out = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Local stand-in for a third-party image host."""
+    hits = 0
+
+    def do_GET(self):
+        ImageHandler.hits += 1
+        if self.path.startswith('/redirect?to='):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect?to='):])
+            self.end_headers()
+            return
+        if self.path != '/avatar.png':
+            self.send_error(404)
+            return
+        body = make_png()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageCacheTestCase(TestCase):
+    """Test the content-addressed image proxy cache."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), ImageHandler)
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # the stand-in host is on loopback, which the proxy normally refuses
+        self.fetch = partial(fetch_url, allow_address=lambda address: address == '127.0.0.1')
+        self.cache = ImageCache(self.root, fetch=self.fetch)
+        ImageHandler.hits = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_resizes_to_variant(self):
+        """Is the cached variant cropped to the variant's size?"""
+        path, mimetype = self.cache.get(f"{self.base}/avatar.png", 'thumb')
+        self.assertEqual(mimetype, 'image/jpeg')
+        with Image.open(path) as img:
+            self.assertEqual(img.size, VARIANTS['thumb'])
+
+    def test_fetches_source_once(self):
+        """Is a cached variant served without refetching the source?"""
+        url = f"{self.base}/avatar.png"
+        first, _ = self.cache.get(url, 'card')
+        second, _ = self.cache.get(url, 'card')
+        self.assertEqual(first, second)
+        self.assertEqual(ImageHandler.hits, 1)
+
+    def test_missing_source(self):
+        """Does an unreachable image raise ImageFetchError?"""
+        with self.assertRaises(ImageFetchError):
+            self.cache.get(f"{self.base}/missing.png", 'thumb')
+
+    def test_failures_cached(self):
+        """Is a failed URL left alone until its failure expires?"""
+        url = f"{self.base}/missing.png"
+        for _ in range(3):
+            with self.assertRaises(ImageFetchError):
+                self.cache.get(url, 'thumb')
+        self.assertEqual(ImageHandler.hits, 1)
+
+        self.cache.failure_ttl = 0
+        self.cache.clear_failures()
+        with self.assertRaises(ImageFetchError):
+            self.cache.get(url, 'thumb')
+        self.assertEqual(ImageHandler.hits, 2)
+
+    def test_concurrent_fetches_shared(self):
+        """Do concurrent requests for an uncached URL share one download?"""
+        release = threading.Event()
+        fetched = []
+
+        def slow_fetch(url):
+            fetched.append(url)
+            release.wait(5)
+            return self.fetch(url)
+
+        self.cache.fetch = slow_fetch
+        url = f"{self.base}/avatar.png"
+        threads = [threading.Thread(target=self.cache.get, args=(url, 'thumb'))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        while self.cache._flights.coalesced < 3:
+            release.wait(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(fetched), 1)
+        self.assertEqual(ImageHandler.hits, 1)
+
+    def test_without_pillow(self):
+        """Without Pillow, are images passed through under their own type
+        and anything unrecognisable refused?"""
+        with mock.patch.object(images, 'Image', None):
+            path, mimetype = self.cache.get(f"{self.base}/avatar.png", 'thumb')
+            self.assertEqual(mimetype, 'image/png')
+            self.cache.fetch = lambda url: b'<html>not an image</html>'
+            with self.assertRaises(ImageFetchError):
+                self.cache.get(f"{self.base}/page.html", 'thumb')
+
+    def test_public_addresses_only(self):
+        """Are loopback, private, link-local and metadata addresses refused?"""
+        for address in ('127.0.0.1', '10.1.2.3', '192.168.0.1', '169.254.169.254',
+                        '::1', 'fe80::1', '::ffff:127.0.0.1', '0.0.0.0'):
+            self.assertFalse(is_public_address(address), address)
+        self.assertTrue(is_public_address('93.184.216.34'))
+        with self.assertRaises(ImageRejected):
+            ImageCache(self.root).get(f"{self.base}/avatar.png", 'thumb')
+        self.assertEqual(ImageHandler.hits, 0)
+
+    def test_redirects_checked(self):
+        """Is every redirect hop checked before it is fetched?"""
+        path, _ = self.cache.get(f"{self.base}/redirect?to=/avatar.png", 'thumb')
+        self.assertTrue(os.path.exists(path))
+        with self.assertRaises(ImageRejected):
+            self.cache.get(f"{self.base}/redirect?to=http://169.254.169.254/latest", 'thumb')
+
+    def test_decompression_bomb(self):
+        """Is an image with too many pixels rejected rather than decoded?"""
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaises(ImageRejected):
+                self.cache.get(f"{self.base}/avatar.png", 'thumb')
+
+    def test_proxy_route(self):
+        """Does the proxy endpoint serve the image with long-lived caching?"""
+        old_root, image_cache.root = image_cache.root, self.root
+        self.addCleanup(setattr, image_cache, 'root', old_root)
+        old_fetch, image_cache.fetch = image_cache.fetch, self.fetch
+        self.addCleanup(setattr, image_cache, 'fetch', old_fetch)
+        token = image_signer.dumps(f"{self.base}/avatar.png")
+        with app.test_client() as c:
+            resp = c.get(f"/images/thumb/{token}")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'image/jpeg')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            resp.close()
+
+            resp = c.get("/images/thumb/not-a-token")
+            self.assertEqual(resp.status_code, 404)
+
+            image_cache.fetch = fetch_url
+            token = image_signer.dumps("http://127.0.0.1:1/internal.png")
+            self.assertEqual(c.get(f"/images/thumb/{token}").status_code, 400)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,137 @@
+import threading
+import time
+from models import db, User, Message, MessageTag
+from app import CURR_USER_KEY, group_commit
+from ingest import CommitTimeout, GroupCommit, validate
+from tests import BaseTestCase
+
+
+class IngestTestCase(BaseTestCase):
+    """Test batched message ingestion and group commit."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.signup("testuser1", "test1@test.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+            sess['_user_id'] = str(self.user.id)
+
+    def test_validate(self):
+        """Are missing, blank and over-long texts reported by index?"""
+        texts, errors = validate([{'text': "ok"}, {'text': " "}, "nope",
+                                  {'text': "x" * 141}, {'text': "x" * 140}])
+        self.assertEqual(texts, ["ok", "x" * 140])
+        self.assertEqual([e['index'] for e in errors], [1, 2, 3])
+
+    def test_batch_endpoint(self):
+        """Is a valid batch inserted in order, and an invalid one not at all?"""
+        with self.client as c:
+            self.login(c)
+            resp = c.post("/api/messages", json={'messages': [{'text': "One #bulk"},
+                                                              {'text': "Two"}]})
+            self.assertEqual(resp.status_code, 201)
+            ids = resp.get_json()['ids']
+            self.assertEqual([db.session.get(Message, i).text for i in ids],
+                             ["One #bulk", "Two"])
+            self.assertEqual(MessageTag.query.one().message_id, ids[0])
+
+            resp = c.post("/api/messages", json={'messages': [{'text': "Three"},
+                                                              {'text': "x" * 141}]})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.get_json()['errors'][0]['index'], 1)
+            self.assertEqual(c.post("/api/messages", json={'messages': []}).status_code, 400)
+            self.assertEqual(Message.query.count(), 2)
+
+    def test_form_post(self):
+        """Do form posts go through group commit and reject long texts?"""
+        batches = group_commit.stats()['batches']
+        with self.client as c:
+            self.login(c)
+            resp = c.post("/messages/new", data={"text": "Hello"})
+            self.assertEqual(resp.status_code, 302)
+            resp = c.post("/messages/new", data={"text": "x" * 141})
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual([m.text for m in Message.query], ["Hello"])
+        self.assertEqual(group_commit.stats()['batches'], batches + 1)
+
+    def test_group_commit(self):
+        """Do concurrent submits share batches and get their own results?"""
+        batches = []
+
+        def write(items):
+            batches.append(items)
+            time.sleep(0.05)
+            return [item * 10 for item in items]
+
+        committer = GroupCommit(write, window=0.05)
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.update({i: committer.submit(i)}))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {i: i * 10 for i in range(8)})
+        self.assertLess(len(batches), 8)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(8)))
+        self.assertEqual(committer.stats()['items'], 8)
+
+    def test_group_commit_error(self):
+        """Does a failed batch raise in every submitter, and the next one work?"""
+        def write(items):
+            if 'bad' in items:
+                raise ValueError("bad batch")
+            return items
+
+        committer = GroupCommit(write, window=0)
+        with self.assertRaises(ValueError):
+            committer.submit('bad')
+        self.assertEqual(committer.submit('good'), 'good')
+
+    def test_group_commit_interrupted(self):
+        """Is leadership handed on when a write is interrupted, and a lone post not delayed?"""
+        def write(items):
+            if 'stop' in items:
+                raise KeyboardInterrupt
+            return items
+
+        committer = GroupCommit(write, window=10)
+        with self.assertRaises(KeyboardInterrupt):
+            committer.submit('stop')
+        started = time.monotonic()
+        self.assertEqual(committer.submit('good'), 'good')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_group_commit_timeout(self):
+        """Does a queued submitter give up, withdrawing its item, after the timeout?"""
+        written = []
+        writing, release = threading.Event(), threading.Event()
+
+        def write(items):
+            writing.set()
+            release.wait()
+            written.extend(items)
+            return items
+
+        committer = GroupCommit(write, window=0, timeout=0.05)
+        leader = threading.Thread(target=committer.submit, args=('first',))
+        leader.start()
+        writing.wait()
+        with self.assertRaises(CommitTimeout):
+            committer.submit('second')
+        release.set()
+        leader.join()
+        self.assertEqual(written, ['first'])
+        self.assertEqual(committer.submit('third'), 'third')
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
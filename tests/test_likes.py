@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from models import db, User, Message, Likes
+from likes import LikeBuffer, LikeIndexMissing, apply_batch, create_unique_index, has_unique_index
+from app import app
+from tests import BaseTestCase
+
+
+class LikeBufferTestCase(BaseTestCase):
+    """Test write-behind buffering of likes."""
+
+    def setUp(self):
+        """Create a liker, an author and two messages."""
+        super().setUp()
+
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+        self.msg1 = Message(text="Message 1", user_id=self.user2.id)
+        self.msg2 = Message(text="Message 2", user_id=self.user2.id)
+        db.session.add_all([self.msg1, self.msg2])
+        db.session.commit()
+
+        self.log_dir = tempfile.mkdtemp()
+        self.buffer = LikeBuffer(self.log_dir, flush_interval=60, fsync=False)
+        self.buffer.init_app(app)
+
+    def tearDown(self):
+        """Clean up any failed transactions."""
+        db.session.rollback()
+        self.buffer.flush()
+        shutil.rmtree(self.log_dir)
+        super().tearDown()
+
+    def stored_likes(self):
+        return {(l.user_id, l.message_id) for l in Likes.query.all()}
+
+    def test_coalesces_until_flush(self):
+        """Are writes held in memory, collapsed, then flushed together?"""
+        self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.buffer.record(self.user1.id, self.msg1.id, False)
+        self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.buffer.record(self.user1.id, self.msg2.id, True)
+        self.assertEqual(self.stored_likes(), set())
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.stored_likes(), {(self.user1.id, self.msg1.id),
+                                               (self.user1.id, self.msg2.id)})
+
+    def test_read_your_writes(self):
+        """Do unflushed writes show up in the acting user's liked ids?"""
+        self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.assertEqual(self.buffer.liked_ids(self.user1.id, [self.msg2.id]),
+                         {self.msg1.id, self.msg2.id})
+
+        self.buffer.record(self.user1.id, self.msg2.id, False)
+        self.assertEqual(self.buffer.liked_ids(self.user1.id, [self.msg2.id]),
+                         {self.msg1.id})
+
+    def test_flush_is_idempotent(self):
+        """Does liking an already-liked message leave a single row?"""
+        db.session.add(Likes(user_id=self.user1.id, message_id=self.msg1.id))
+        db.session.commit()
+
+        self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.buffer.flush()
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_concurrent_flushes(self):
+        """Do two flushes of the same pair store and report one like?"""
+        batch = {self.user1.id: {self.msg1.id: True}}
+        first = apply_batch(batch)
+        second = apply_batch(batch)
+        self.assertEqual([delta for _, _, _, delta in first + second], [1])
+        self.assertEqual(Likes.query.count(), 1)
+        unlike = {self.user1.id: {self.msg1.id: False}}
+        self.assertEqual(len(apply_batch(unlike) + apply_batch(unlike)), 1)
+
+    def test_pending_is_per_process(self):
+        """Until a flush, does another worker's buffer miss the click, and
+        does the last flush settle conflicting clicks?"""
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir)
+        other = LikeBuffer(other_dir, flush_interval=60, fsync=False)
+        other.init_app(app)
+
+        self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.assertEqual(other.liked_ids(self.user1.id, []), set())
+        other.record(self.user1.id, self.msg1.id, False)
+        other.flush()
+        self.buffer.flush()
+        self.assertEqual(self.stored_likes(), {(self.user1.id, self.msg1.id)})
+
+    def test_recover_after_crash(self):
+        """Are logged but unflushed writes replayed from a dead process?"""
+        dead_pid = 2 ** 22 + 1
+        with open(os.path.join(self.log_dir, f"likes-{dead_pid}-0.log"), 'w') as f:
+            f.write(f"{self.user1.id} {self.msg1.id} 1\n")
+            f.write(f"{self.user1.id} {self.msg2.id} 1\n")
+            f.write(f"{self.user1.id} {self.msg2.id} 0\n")
+            f.write(f"{self.user1.id} 12")  # torn, unacknowledged write
+
+        self.assertEqual(self.buffer.recover(), 2)
+        self.assertEqual(self.stored_likes(), {(self.user1.id, self.msg1.id)})
+        self.assertEqual(os.listdir(self.log_dir), [])
+
+    def drop_unique_index(self):
+        index = next(ix for ix in Likes.__table__.indexes if ix.unique)
+        index.drop(db.engine)  # tearDown's drop_all takes the table with it
+
+    def test_migrate_unique_index(self):
+        """Does the migration delete duplicate likes and add the index?"""
+        self.drop_unique_index()
+        db.session.add_all([Likes(user_id=self.user1.id, message_id=self.msg1.id),
+                            Likes(user_id=self.user1.id, message_id=self.msg1.id),
+                            Likes(user_id=self.user1.id, message_id=self.msg2.id)])
+        db.session.commit()
+        self.assertFalse(has_unique_index())
+
+        self.assertEqual(create_unique_index(), 1)
+        self.assertTrue(has_unique_index())
+        self.assertEqual(Likes.query.count(), 2)
+        self.assertEqual(create_unique_index(), 0)
+
+    def test_refuses_without_unique_index(self):
+        """Does a new buffer refuse likes it could never flush?"""
+        self.drop_unique_index()
+        with self.assertRaises(LikeIndexMissing):
+            self.buffer.record(self.user1.id, self.msg1.id, True)
+        self.assertEqual(self.buffer.pending_for(self.user1.id), {})
+        self.assertEqual(os.listdir(self.log_dir), [])
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
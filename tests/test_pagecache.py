@@ -0,0 +1,190 @@
+import tempfile
+import threading
+import time
+from flask import g, make_response
+from models import db, User, Message
+from app import app, CURR_USER_KEY, like_buffer
+from pagecache import PageCache, MemoryStore, FileStore
+from tests import BaseTestCase
+
+
+class PageCacheTestCase(BaseTestCase):
+    """Test the anonymous full-page cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.signup("testuser1", "test1@test.com", "password", None)
+        db.session.commit()
+        self.renders = 0
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def login(self, c):
+        g.pop('_login_user', None)
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+            sess['_user_id'] = str(self.user.id)
+
+    def logout(self, c):
+        g.pop('_login_user', None)
+        with c.session_transaction() as sess:
+            sess.clear()
+
+    def view(self):
+        self.renders += 1
+        time.sleep(0.05)
+        return f"render {self.renders}"
+
+    def call(self, cache, path='/page'):
+        with app.test_request_context(path):
+            g.user = None
+
+            def view():
+                cache.tag('page')
+                return self.view()
+            response = make_response(cache.cached(view)())
+            return response.headers.get('X-Cache'), response.get_data(as_text=True)
+
+    def test_stores(self):
+        """Do both stores expire keys and only `add` absent ones?"""
+        with tempfile.TemporaryDirectory() as directory:
+            for store in (MemoryStore(max_entries=2), FileStore(directory)):
+                store.set('a', 1)
+                self.assertEqual(store.get_many(['a', 'b']), [1, None])
+                self.assertFalse(store.add('a', 2))
+                self.assertTrue(store.add('b', 2, ttl=0.01))
+                time.sleep(0.02)
+                self.assertIsNone(store.get('b'))
+                self.assertTrue(store.add('b', 3))
+                store.delete('a')
+                self.assertIsNone(store.get('a'))
+        lru = MemoryStore(max_entries=2)
+        for key in 'abc':
+            lru.set(key, key)
+        self.assertEqual(lru.get_many(['a', 'b', 'c']), [None, 'b', 'c'])
+
+    def test_routes_cache_and_invalidate(self):
+        """Are anonymous pages cached until a write invalidates them?"""
+        path = f"/users/{self.user.id}"
+        with self.client as c:
+            self.assertEqual(c.get(path).headers['X-Cache'], 'MISS')
+            resp = c.get(path)
+            self.assertEqual(resp.headers['X-Cache'], 'HIT')
+            self.assertNotIn('<p>Fresh warble</p>', resp.get_data(as_text=True))
+
+            self.login(c)
+            self.assertNotIn('X-Cache', c.get(path).headers)
+            c.post("/messages/new", data={"text": "Fresh warble"})
+            msg = Message.query.one()
+
+            self.logout(c)
+            resp = c.get(path)
+            self.assertEqual(resp.headers['X-Cache'], 'MISS')
+            self.assertIn('<p>Fresh warble</p>', resp.get_data(as_text=True))
+            self.assertEqual(c.get(f"/messages/{msg.id}").headers['X-Cache'], 'MISS')
+            self.assertEqual(c.get(f"/messages/{msg.id}").headers['X-Cache'], 'HIT')
+
+            self.login(c)
+            c.post(f"/messages/{msg.id}/delete")
+            self.logout(c)
+            self.assertEqual(c.get(f"/messages/{msg.id}").status_code, 404)
+
+    def test_like_flush_invalidates(self):
+        """Is the liker's profile dropped once their buffered like is stored?"""
+        author = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+        msg = Message(text="Likeable", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        path = f"/users/{self.user.id}"
+        with self.client as c:
+            c.get(path)
+            self.assertEqual(c.get(path).headers['X-Cache'], 'HIT')
+            like_buffer.record(self.user.id, msg.id, True)  # flushed at once in tests
+            resp = c.get(path)
+            self.assertEqual(resp.headers['X-Cache'], 'MISS')
+            self.assertIn(f'/users/{self.user.id}/likes">1</a>', resp.get_data(as_text=True))
+
+    def test_flashes_bypass_cache(self):
+        """Is a page with pending flash messages rendered, not cached?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Bye!')]
+            resp = c.get("/users")
+            self.assertNotIn('X-Cache', resp.headers)
+            self.assertIn('Bye!', resp.get_data(as_text=True))
+            self.assertEqual(c.get("/users").headers['X-Cache'], 'MISS')
+
+    def test_stale_while_revalidate(self):
+        """Is a stale page served while another request regenerates it?"""
+        cache = PageCache(MemoryStore(), ttl=0.3, stale_ttl=10)
+        self.assertEqual(self.call(cache), ('MISS', 'render 1'))
+        time.sleep(0.31)
+        cache.store.add('lock:page:/page?', True)
+        self.assertEqual(self.call(cache), ('STALE', 'render 1'))
+        cache.store.delete('lock:page:/page?')
+        self.assertEqual(self.call(cache), ('MISS', 'render 2'))
+        self.assertEqual(self.call(cache), ('HIT', 'render 2'))
+
+        cache.invalidate('other')
+        self.assertEqual(self.call(cache), ('HIT', 'render 2'))
+        cache.invalidate('page')
+        self.assertEqual(self.call(cache), ('MISS', 'render 3'))
+
+    def test_stampede(self):
+        """Do concurrent misses render a page once and share it?"""
+        cache = PageCache(MemoryStore(), ttl=30)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.call(cache)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(sorted(status for status, _ in results), ['HIT'] * 7 + ['MISS'])
+        self.assertEqual(cache.stats()['waits'], 7)
+
+    def test_waiters_render_when_leader_fails(self):
+        """Do waiters stop waiting once the leader releases without caching?"""
+        cache = PageCache(MemoryStore(), lock_timeout=5)
+        cache.store.add('lock:page:/page?', True)
+        threading.Timer(0.1, cache.store.delete, ['lock:page:/page?']).start()
+        start = time.monotonic()
+        self.assertEqual(self.call(cache), (None, 'render 1'))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_query_args_whitelisted(self):
+        """Are undeclared query arguments left out of the cache key?"""
+        with self.client as c:
+            self.assertEqual(c.get("/users?utm=1").headers['X-Cache'], 'MISS')
+            self.assertEqual(c.get("/users?utm=2").headers['X-Cache'], 'HIT')
+            self.assertEqual(c.get("/users?q=test&utm=3").headers['X-Cache'], 'MISS')
+            self.assertEqual(c.get("/users?q=test").headers['X-Cache'], 'HIT')
+
+    def test_file_store_sweep_and_takeover(self):
+        """Does FileStore sweep expired files and take over expired keys once?"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = FileStore(directory, sweep_interval=3600)
+            store.set('keep', 1)
+            store.set('old', 1, ttl=0.01)
+            self.assertTrue(store.add('lock', True, ttl=0.01))
+            time.sleep(0.02)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(
+                FileStore(directory).add('lock', True, ttl=10))) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(sorted(results), [False] * 7 + [True])
+            self.assertEqual(store.sweep(), 1)
+            self.assertEqual(store.get_many(['keep', 'old', 'lock']), [1, None, True])
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
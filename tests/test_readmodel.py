@@ -0,0 +1,64 @@
+from models import db, User, Message, Likes
+import readmodel
+from tests import BaseTestCase
+
+
+class ReadModelTestCase(BaseTestCase):
+    """Test the column-only rows used by list pages."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+        self.user1.following.append(self.user2)
+        self.msgs = [Message(text=f"Message {i}", user_id=self.user2.id) for i in range(3)]
+        db.session.add_all(self.msgs)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.user1.id, message_id=self.msgs[0].id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_user_cards(self):
+        """Are cards plain rows without the password, filtered by search?"""
+        cards = readmodel.user_cards()
+        self.assertEqual({c.username for c in cards}, {"testuser1", "testuser2"})
+        self.assertNotIn('password', readmodel.UserCard._fields)
+        self.assertEqual([c.id for c in readmodel.user_cards("user2")], [self.user2.id])
+
+    def test_follow_cards(self):
+        """Do following and follower cards follow the edges?"""
+        self.assertEqual([c.id for c in readmodel.following_cards(self.user1.id)],
+                         [self.user2.id])
+        self.assertEqual([c.id for c in readmodel.follower_cards(self.user2.id)],
+                         [self.user1.id])
+        self.assertEqual(readmodel.following_ids(self.user1.id), (self.user2.id,))
+
+    def test_message_rows(self):
+        """Are rows returned in id order with one shared author card?"""
+        ids = [self.msgs[2].id, 9999, self.msgs[0].id]
+        rows = readmodel.message_rows(ids)
+        self.assertEqual([r.id for r in rows], [self.msgs[2].id, self.msgs[0].id])
+        self.assertIs(rows[0].user, rows[1].user)
+        self.assertEqual(rows[0].user.username, "testuser2")
+        self.assertFalse(rows[0].archived)
+
+    def test_profile(self):
+        """Does a profile carry its stats as counts, without loading the ids?"""
+        profile = readmodel.profile(self.user1.id)
+        self.assertEqual(profile.username, "testuser1")
+        self.assertEqual((profile.message_count, profile.following_count,
+                          profile.followers_count, profile.likes_count), (0, 1, 0, 1))
+        self.assertEqual(profile.following, ())
+        self.assertEqual(readmodel.profile(self.user2.id).message_count, 3)
+        self.assertEqual(readmodel.follower_ids(self.user2.id), (self.user1.id,))
+        self.assertIsNone(readmodel.profile(9999))
+        self.assertFalse(hasattr(profile, '__dict__'))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,126 @@
+from flask import g
+from models import db, User, Message, Likes, Follows, Recommendation, RecommendationQueue
+from app import CURR_USER_KEY
+import recommend
+from tests import BaseTestCase
+
+
+class RecommendTestCase(BaseTestCase):
+    """Test the precomputed "who to follow" suggestions."""
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.signup(f"testuser{i}", f"test{i}@test.com", "password", None)
+                      for i in range(5)]
+        db.session.commit()
+        self.ids = [user.id for user in self.users]
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def login(self, c, index):
+        g.pop('_login_user', None)
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids[index]
+            sess['_user_id'] = str(self.ids[index])
+
+    def follow(self, follower, followed):
+        db.session.add(Follows(user_following_id=self.ids[follower],
+                               user_being_followed_id=self.ids[followed]))
+
+    def stored(self, user):
+        return [(self.ids.index(r.candidate_id), r.score) for r in
+                Recommendation.query.filter_by(user_id=self.ids[user])
+                .order_by(Recommendation.rank)]
+
+    def test_scores(self):
+        """Are friends-of-friends and co-likers ranked, excluding existing follows?"""
+        # 0 follows 1 and 2; both follow 3; 1 also follows 0
+        self.follow(0, 1)
+        self.follow(0, 2)
+        self.follow(1, 3)
+        self.follow(2, 3)
+        self.follow(1, 0)
+        msg = Message(text="Hello", user_id=self.ids[2])
+        db.session.add(msg)
+        db.session.commit()
+        # 0 and 4 both like the message
+        db.session.add_all([Likes(user_id=self.ids[0], message_id=msg.id),
+                            Likes(user_id=self.ids[4], message_id=msg.id)])
+        db.session.commit()
+
+        self.assertEqual(recommend.refresh(), 5)
+        self.assertEqual(self.stored(0), [(3, 2.0), (4, recommend.COLIKE_WEIGHT)])
+        self.assertEqual(self.stored(1), [(2, 1.0)])
+        self.assertEqual(self.stored(4), [(0, recommend.COLIKE_WEIGHT)])
+        self.assertEqual(recommend.refresh(n=1), 5)
+        self.assertEqual(self.stored(0), [(3, 2.0)])
+
+    def test_refresh_changed(self):
+        """Do follows queue the follower, and rebuild only them and their followers?"""
+        self.follow(0, 1)
+        self.follow(2, 0)
+        db.session.commit()
+        recommend.refresh()
+        self.assertEqual(self.stored(2), [(1, 1.0)])
+
+        with self.client as c:
+            self.login(c, 0)
+            c.post(f"/users/follow/{self.ids[3]}")
+            c.post(f"/users/follow/{self.ids[3]}")
+        self.assertEqual([q.user_id for q in RecommendationQueue.query], [self.ids[0]])
+
+        # 4 now follows 2, but isn't queued or 0's follower, so isn't rebuilt
+        self.follow(4, 2)
+        db.session.commit()
+        # one user per batch, each loading only its own neighbourhood
+        recommend.WRITE_BATCH, write_batch = 1, recommend.WRITE_BATCH
+        try:
+            self.assertEqual(recommend.refresh_changed(), 2)
+        finally:
+            recommend.WRITE_BATCH = write_batch
+        self.assertEqual(self.stored(2), [(1, 1.0), (3, 1.0)])
+        self.assertEqual(self.stored(4), [])
+        self.assertEqual(RecommendationQueue.query.count(), 0)
+        self.assertEqual(recommend.refresh_changed(), 0)
+
+    def test_popular_messages_skipped(self):
+        """Are likes of messages with too many likers ignored?"""
+        msg = Message(text="Hello", user_id=self.ids[4])
+        db.session.add(msg)
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Likes(user_id=self.ids[i], message_id=msg.id))
+        db.session.commit()
+
+        recommend.MAX_LIKERS, max_likers = 2, recommend.MAX_LIKERS
+        try:
+            recommend.refresh()
+        finally:
+            recommend.MAX_LIKERS = max_likers
+        self.assertEqual(Recommendation.query.count(), 0)
+
+    def test_suggestions_endpoint(self):
+        """Does the endpoint return the stored suggestions, best first?"""
+        self.follow(0, 1)
+        self.follow(1, 2)
+        self.follow(1, 3)
+        self.follow(3, 2)
+        self.follow(0, 3)
+        db.session.commit()
+        recommend.refresh()
+
+        with self.client as c:
+            self.assertEqual(c.get("/users/suggestions").status_code, 401)
+            self.login(c, 0)
+            data = c.get("/users/suggestions").get_json()
+            self.assertEqual(data['suggestions'], [
+                {'id': self.ids[2], 'username': 'testuser2',
+                 'image_url': self.users[2].image_url, 'score': 2.0}])
+            self.assertEqual(c.get("/users/suggestions?limit=0").status_code, 400)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,114 @@
+import threading
+import time
+from unittest import TestCase
+from models import db, User, Message
+from singleflight import SingleFlight, FlightTimeout
+from app import single_flight
+from tests import BaseTestCase
+
+
+class SingleFlightTestCase(TestCase):
+    """Test coalescing of concurrent identical calls."""
+
+    def run_concurrently(self, flight, key, fn, n=5):
+        results, errors = [], []
+        started = threading.Barrier(n)
+
+        def call():
+            started.wait()
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_coalesces(self):
+        """Do concurrent callers with one key share a single execution?"""
+        flight = SingleFlight()
+        runs = []
+
+        def slow():
+            runs.append(1)
+            time.sleep(0.2)
+            return 'page'
+
+        results, errors = self.run_concurrently(flight, 'k', slow)
+        self.assertEqual(results, ['page'] * 5)
+        self.assertEqual(len(runs), 1)
+        stats = flight.stats()
+        self.assertEqual((stats['executions'], stats['coalesced']), (1, 4))
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_not_a_cache(self):
+        """Does a call after the flight lands run again?"""
+        flight = SingleFlight()
+        self.assertEqual(flight.do('k', lambda: 1), 1)
+        self.assertEqual(flight.do('k', lambda: 2), 2)
+        self.assertEqual(flight.stats()['coalesced'], 0)
+
+    def test_error_propagates(self):
+        """Does every waiter see the leader's exception?"""
+        flight = SingleFlight()
+
+        def broken():
+            time.sleep(0.2)
+            raise ValueError("boom")
+
+        results, errors = self.run_concurrently(flight, 'k', broken, n=3)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(flight.stats()['errors'], 1)
+
+    def test_timeout(self):
+        """Do waiters give up after the timeout while the leader finishes?"""
+        flight = SingleFlight(timeout=0.05)
+        results, errors = self.run_concurrently(
+            flight, 'k', lambda: time.sleep(0.5) or 'late', n=3)
+        self.assertEqual(results, ['late'])
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(isinstance(e, FlightTimeout) for e in errors))
+        self.assertEqual(flight.stats()['timeouts'], 2)
+
+
+class CoalescedViewsTestCase(BaseTestCase):
+    """Test the pages that load through the single-flight layer."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.signup("testuser1", "test1@test.com", "password", None)
+        db.session.commit()
+        self.msg = Message(text="Hot take", user_id=self.user.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_pages_render_from_snapshots(self):
+        """Do profile and message pages render and count coalescing calls?"""
+        before = single_flight.stats()['calls']
+        resp = self.client.get(f"/users/{self.user.id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("<p>Hot take</p>", resp.get_data(as_text=True))
+
+        resp = self.client.get(f"/messages/{self.msg.id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@testuser1", resp.get_data(as_text=True))
+        self.assertEqual(self.client.get("/messages/9999").status_code, 404)
+
+        stats = self.client.get("/metrics/single-flight").get_json()
+        self.assertEqual(stats['calls'] - before, 3)
+        self.assertEqual(stats['in_flight'], 0)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
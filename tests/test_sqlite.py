@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest import TestCase
+from sqlalchemy import create_engine, inspect, text
+from models import db, configure_sqlite, User, Message
+
+
+class SQLiteBackendTestCase(TestCase):
+    """Test the tuned SQLite backend on a scratch database."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.dir, 'warbler.db')}")
+        configure_sqlite(self.engine)
+        db.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def pragma(self, conn, name):
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_pragmas(self):
+        """Is every connection in WAL mode with the tuned settings?"""
+        with self.engine.connect() as conn:
+            self.assertEqual(self.pragma(conn, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(conn, 'synchronous'), 1)
+            self.assertEqual(self.pragma(conn, 'busy_timeout'), 5000)
+            self.assertEqual(self.pragma(conn, 'cache_size'), -64 * 1024)
+            self.assertEqual(self.pragma(conn, 'foreign_keys'), 1)
+
+    def test_indexes_match_metadata(self):
+        """Does SQLite get every index the models declare, as PostgreSQL does?"""
+        inspector = inspect(self.engine)
+        for table in db.metadata.sorted_tables:
+            declared = {ix.name for ix in table.indexes}
+            created = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            self.assertLessEqual(declared, created, table.name)
+            for ix in table.indexes:
+                self.assertEqual(ix.dialect_kwargs, {}, ix.name)
+
+    def test_cascade_and_like(self):
+        """Do deletes cascade and LIKE match case as on PostgreSQL?"""
+        with self.engine.begin() as conn:
+            conn.execute(User.__table__.insert(), {'id': 1, 'email': 'a@b.c',
+                                                   'username': 'Alice', 'password': 'x'})
+            conn.execute(Message.__table__.insert(), {'text': 'hi', 'user_id': 1,
+                                                      'timestamp': datetime(2020, 1, 1)})
+            self.assertEqual(conn.execute(text(
+                "SELECT count(*) FROM users WHERE username LIKE '%alice%'")).scalar(), 0)
+            conn.execute(text("DELETE FROM users"))
+            self.assertEqual(conn.execute(text("SELECT count(*) FROM messages")).scalar(), 0)
+
+    def test_busy_writer_waits(self):
+        """Does a second writer wait for the lock instead of failing?"""
+        locked = threading.Event()
+
+        def hold_lock():
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                locked.set()
+                time.sleep(0.3)
+                conn.exec_driver_sql("COMMIT")
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        locked.wait()
+        start = time.monotonic()
+        with self.engine.begin() as conn:
+            conn.execute(User.__table__.insert(), {'email': 'a@b.c', 'username': 'a',
+                                                   'password': 'x'})
+        holder.join()
+        self.assertGreater(time.monotonic() - start, 0.2)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
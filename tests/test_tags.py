@@ -0,0 +1,81 @@
+from models import db, User, Message, MessageTag, Mention
+from tags import (extract_tags, extract_mentions, index_messages,
+                  unindex_messages, tag_timeline, mention_timeline, backfill,
+                  linkify)
+from tests import BaseTestCase
+
+
+class TagsTestCase(BaseTestCase):
+    """Test hashtag and mention indexing."""
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def post(self, text, user=None):
+        msg = Message(text=text, user_id=(user or self.user1).id)
+        db.session.add(msg)
+        db.session.flush()
+        index_messages([msg])
+        db.session.commit()
+        return msg
+
+    def test_extract(self):
+        """Are tags lower-cased and e-mail addresses not taken as mentions?"""
+        text = "#Flask and #flask with @testuser2, not me@example.com or a#b"
+        self.assertEqual(extract_tags(text), {'flask'})
+        self.assertEqual(extract_mentions(text), {'testuser2'})
+
+    def test_tag_timeline_paging(self):
+        """Is a tag timeline newest first and paged by message id?"""
+        msgs = [self.post(f"post {i} #python") for i in range(3)]
+        self.post("no tags here")
+
+        first = tag_timeline('Python', limit=2)
+        self.assertEqual([m.id for m in first], [msgs[2].id, msgs[1].id])
+        rest = tag_timeline('python', before=first[-1].id, limit=2)
+        self.assertEqual([m.id for m in rest], [msgs[0].id])
+
+    def test_mentions(self):
+        """Are mentions of real users indexed and unknown names ignored?"""
+        msg = self.post("hi @testuser2 and @nobody", user=self.user1)
+        self.assertEqual([m.id for m in mention_timeline(self.user2.id)], [msg.id])
+        self.assertEqual(Mention.query.count(), 1)
+
+    def test_unindex(self):
+        """Does deleting a message's index rows empty its timelines?"""
+        msg = self.post("#gone @testuser2")
+        unindex_messages([msg.id])
+        db.session.commit()
+        self.assertEqual(tag_timeline('gone'), [])
+        self.assertEqual(mention_timeline(self.user2.id), [])
+
+    def test_backfill(self):
+        """Does the backfill index messages written before indexing existed?"""
+        db.session.add_all([Message(text=f"old #post {i}", user_id=self.user1.id)
+                            for i in range(5)])
+        db.session.commit()
+        self.assertEqual(MessageTag.query.count(), 0)
+
+        self.assertEqual(backfill(batch_size=2), 5)
+        self.assertEqual(MessageTag.query.count(), 5)
+        self.assertEqual(backfill(batch_size=2), 5)
+        self.assertEqual(MessageTag.query.count(), 5)
+
+    def test_linkify(self):
+        """Are hashtags linked and the rest of the text escaped?"""
+        html = linkify("<b>it's</b> #Warble")
+        self.assertIn('<a href="/tags/warble">#Warble</a>', html)
+        self.assertIn('&lt;b&gt;', html)
+        self.assertNotIn('/tags/39', html)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
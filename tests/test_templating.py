@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from app import app
+from templating import configure_bytecode_cache, warm_templates
+
+
+class TemplateWarmupTestCase(TestCase):
+    """Test the template bytecode cache and warm-up."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache = app.jinja_env.bytecode_cache
+        configure_bytecode_cache(app, self.cache_dir)
+        app.jinja_env.cache.clear()
+
+    def tearDown(self):
+        app.jinja_env.bytecode_cache = self.old_cache
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_templates(self):
+        """Are all app templates loaded and written to the bytecode cache?"""
+        names = warm_templates(app)
+        self.assertIn('base.html', names)
+        self.assertIn('users/show.html', names)
+        self.assertFalse(any(name.startswith('_debug_toolbar') for name in names))
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(names))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+from unittest import mock
+from models import db, User
+from app import login_throttle
+from throttle import LoginThrottle, FileCounters, MemoryCounters
+from tests import BaseTestCase
+
+
+class LoginThrottleTestCase(BaseTestCase):
+    """Test login throttling by account and IP."""
+
+    def setUp(self):
+        super().setUp()
+        User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_sliding_window(self):
+        """Do failures from the previous window count in proportion to overlap?"""
+        throttle = LoginThrottle(window=100, max_per_account=4, max_per_ip=100)
+        with mock.patch('throttle.time.time', return_value=1050):
+            for _ in range(4):
+                throttle.failed("bob", "1.1.1.1")
+            # this window only slides out of view at 1100 + 100 * (1 - 4/4)
+            self.assertEqual(throttle.check("BOB", "2.2.2.2"), 50)
+            self.assertEqual(throttle.check("alice", "1.1.1.1"), 0)
+        with mock.patch('throttle.time.time', return_value=1120):
+            # 4 * 0.8 = 3.2 failures in the last 100s
+            self.assertEqual(throttle.check("bob", "2.2.2.2"), 0)
+            throttle.failed("bob", "1.1.1.1")
+            # 1 + 4 * 0.8 = 4.2; below 4 once 4 * (1 - t/100) < 3, at t = 25
+            self.assertEqual(throttle.check("bob", "2.2.2.2"), 5)
+        with mock.patch('throttle.time.time', return_value=1330):
+            self.assertEqual(throttle.check("bob", "2.2.2.2"), 0)
+        self.assertEqual(throttle.stats(), {'allowed': 3, 'failures': 5,
+                                            'throttled_account': 2, 'throttled_ip': 0,
+                                            'tracked_keys': 2})
+
+    def test_file_counters(self):
+        """Do throttles sharing a directory share their counts?"""
+        directory = tempfile.mkdtemp()
+        try:
+            first = LoginThrottle(FileCounters(directory), max_per_account=100, max_per_ip=2)
+            second = LoginThrottle(FileCounters(directory), max_per_account=100, max_per_ip=2)
+            first.failed("a", "1.1.1.1")
+            second.failed("b", "1.1.1.1")
+            self.assertGreater(first.check("c", "1.1.1.1"), 0)
+            first.succeeded("a")
+            self.assertEqual(len(second.store), 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_sweep(self):
+        """Are counters with no failures left in the window swept from both stores?"""
+        directory = tempfile.mkdtemp()
+        try:
+            for store in (MemoryCounters(), FileCounters(directory)):
+                throttle = LoginThrottle(store, window=100, sweep_interval=0)
+                with mock.patch('throttle.time.time', return_value=1050):
+                    throttle.failed("old", "1.1.1.1")
+                with mock.patch('throttle.time.time', return_value=1150):
+                    throttle.failed("recent", "2.2.2.2")
+                    # the 1000-1100 window still counts as the previous one
+                    self.assertEqual(len(store), 4)
+                with mock.patch('throttle.time.time', return_value=1250):
+                    throttle.failed("new", "2.2.2.2")
+                self.assertEqual(len(store), 3)
+                self.assertEqual(store.get("account:old"), None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_login_route(self):
+        """Are throttled logins refused before authenticating, and successes reset?"""
+        limit = login_throttle.limits['account']
+        before = login_throttle.stats()
+        for _ in range(limit - 1):
+            self.client.post("/login", data={"username": "testuser", "password": "wrongpass"})
+        resp = self.client.post("/login", data={"username": "testuser", "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+        for _ in range(limit):
+            self.client.post("/login", data={"username": "testuser", "password": "wrongpass"})
+        with mock.patch.object(User, 'authenticate') as authenticate:
+            resp = self.client.post("/login",
+                                    data={"username": "testuser", "password": "password"})
+            authenticate.assert_not_called()
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp.headers['Retry-After']), 0)
+        self.assertIn(b"Too many failed logins", resp.data)
+
+        stats = self.client.get("/metrics/login-throttle").get_json()
+        self.assertEqual(stats['throttled_account'] - before['throttled_account'], 1)
+        self.assertEqual(stats['failures'] - before['failures'], 2 * limit - 1)
+
+    def test_metrics_restricted(self):
+        """Are the throttle counters hidden from clients outside METRICS_ALLOWED_IPS?"""
+        resp = self.client.get("/metrics/login-throttle",
+                               environ_base={'REMOTE_ADDR': '203.0.113.9'})
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(self.client.get("/metrics/login-throttle").status_code, 200)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
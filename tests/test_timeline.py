@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from unittest import mock
+from models import db, User, Message
+from timeline import RecentMessages
+from tests import BaseTestCase
+
+
+class RecentMessagesTestCase(BaseTestCase):
+    """Test the per-author recent-message buffers."""
+
+    def setUp(self):
+        """Create two authors with interleaved messages."""
+        super().setUp()
+
+        self.user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        self.msgs = []
+        for i in range(6):
+            author = self.user1 if i % 2 == 0 else self.user2
+            msg = Message(text=f"Message {i}", user_id=author.id,
+                          timestamp=start + timedelta(minutes=i))
+            db.session.add(msg)
+            self.msgs.append(msg)
+        db.session.commit()
+
+        self.buffers = RecentMessages(size=2)
+
+    def tearDown(self):
+        """Clean up any failed transactions."""
+        db.session.rollback()
+        super().tearDown()
+
+    def test_recent_is_bounded_and_newest_first(self):
+        """Does a buffer keep only the newest `size` messages of an author?"""
+        ids = [msg_id for _, msg_id in self.buffers.recent(self.user1.id)]
+        self.assertEqual(ids, [self.msgs[4].id, self.msgs[2].id])
+
+    def test_feed_merges_authors(self):
+        """Does the feed merge several authors' buffers by timestamp?"""
+        ids = self.buffers.feed([self.user1.id, self.user2.id], limit=3)
+        self.assertEqual(ids, [self.msgs[5].id, self.msgs[4].id, self.msgs[3].id])
+
+    def test_add_updates_loaded_buffer(self):
+        """Does a new message push the oldest entry out of a loaded buffer?"""
+        self.buffers.recent(self.user1.id)
+        msg = Message(text="Newest", user_id=self.user1.id,
+                      timestamp=datetime(2021, 1, 1))
+        db.session.add(msg)
+        db.session.commit()
+        self.buffers.add(msg)
+
+        ids = [msg_id for _, msg_id in self.buffers.recent(self.user1.id)]
+        self.assertEqual(ids, [msg.id, self.msgs[4].id])
+
+    def test_remove_from_full_buffer_reloads(self):
+        """Does deleting from a full buffer fall back to the database?"""
+        self.buffers.recent(self.user1.id)
+        self.buffers.remove(self.msgs[4])
+        db.session.delete(self.msgs[4])
+        db.session.commit()
+
+        self.assertNotIn(self.user1.id, self.buffers)
+        ids = [msg_id for _, msg_id in self.buffers.recent(self.user1.id)]
+        self.assertEqual(ids, [self.msgs[2].id, self.msgs[0].id])
+
+    def test_add_during_load_not_lost(self):
+        """Is a load that raced a new message left unbuffered, not stale?"""
+        msg = Message(text="Newest", user_id=self.user1.id, timestamp=datetime(2021, 1, 1))
+        load = self.buffers._load
+
+        def racing_load(author_ids):
+            loaded = load(author_ids)
+            db.session.add(msg)
+            db.session.commit()
+            self.buffers.add(msg)
+            return loaded
+
+        with mock.patch.object(self.buffers, '_load', racing_load):
+            self.buffers.recent(self.user1.id)
+        self.assertNotIn(self.user1.id, self.buffers)
+        ids = [msg_id for _, msg_id in self.buffers.recent(self.user1.id)]
+        self.assertEqual(ids, [msg.id, self.msgs[4].id])
+        self.assertEqual(self.buffers._loading, {})
+
+    def test_ttl_and_author_cap(self):
+        """Are buffers reloaded after `ttl` and capped at `max_authors`?"""
+        buffers = RecentMessages(size=2, ttl=0, max_authors=1)
+        buffers.recent(self.user1.id)
+        msg = Message(text="Elsewhere", user_id=self.user1.id, timestamp=datetime(2021, 1, 1))
+        db.session.add(msg)
+        db.session.commit()
+        # posted through another worker: this one never saw add()
+        self.assertEqual(buffers.recent(self.user1.id)[0][1], msg.id)
+
+        buffers.feed([self.user1.id, self.user2.id])
+        self.assertEqual(len(buffers._buffers), 1)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
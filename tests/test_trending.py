@@ -0,0 +1,99 @@
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+from models import db, User, Message, Likes
+from trending import Trending
+from app import app, trending
+from tests import BaseTestCase
+
+
+class TrendingTestCase(BaseTestCase):
+    """Test the decayed trending leaderboard."""
+
+    def setUp(self):
+        super().setUp()
+        self.trending = Trending(size=2, half_life=timedelta(hours=1),
+                                 refresh_interval=None)
+        self.now = datetime.utcnow()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
+
+    def test_newer_messages_need_fewer_likes(self):
+        """Does one like on a new message beat three on an older one?"""
+        old = self.now - timedelta(hours=3)
+        self.trending.update([(7, 1, old, 1), (7, 1, old, 1), (7, 1, old, 1),
+                              (7, 2, self.now, 1)])
+        self.assertEqual(self.trending.top(), [2, 1])
+
+    def test_bounded_top_k(self):
+        """Is the leaderboard capped at `size` and updated by unlikes?"""
+        self.trending.update([(7, 1, self.now, 1), (7, 1, self.now, 1),
+                              (7, 2, self.now, 1), (7, 2, self.now, 1),
+                              (7, 3, self.now, 1)])
+        self.assertEqual(sorted(self.trending.top()), [1, 2])
+
+        self.trending.update([(7, 2, self.now, -1), (7, 2, self.now, -1)])
+        self.assertEqual(self.trending.top(), [1, 3])
+
+    def test_old_messages_ignored(self):
+        """Are likes on messages outside the window dropped?"""
+        self.trending.update([(7, 1, self.now - timedelta(days=30), 1)])
+        self.assertEqual(self.trending.top(), [])
+
+    def test_recompute_and_refresh(self):
+        """Do recomputes match the likes table, and workers refresh from it?"""
+        user1 = User.signup("testuser1", "test1@test.com", "password", None)
+        user2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+        msg1 = Message(text="Message 1", user_id=user1.id)
+        msg2 = Message(text="Message 2", user_id=user1.id)
+        db.session.add_all([msg1, msg2])
+        db.session.commit()
+        db.session.add_all([Likes(user_id=user2.id, message_id=msg2.id)])
+        db.session.commit()
+
+        self.assertEqual(self.trending.recompute(), 1)
+        self.assertEqual(self.trending.top(), [msg2.id])
+
+        # another worker's view: loaded in the background, then every interval
+        worker = Trending(refresh_interval=0.01)
+        worker.init_app(app)
+        self.addCleanup(setattr, worker, '_pid', None)  # stops its refresher
+        self.assertEqual(self.wait_for(worker, 1), [msg2.id])
+        db.session.add(Likes(user_id=user2.id, message_id=msg1.id))
+        db.session.commit()
+        self.assertEqual(sorted(self.wait_for(worker, 2)), sorted([msg1.id, msg2.id]))
+        idle = Trending(refresh_interval=3600)
+        idle.init_app(app)
+        self.addCleanup(setattr, idle, '_pid', None)
+        self.assertEqual(len(self.wait_for(idle, 2)), 2)
+        Likes.query.delete()
+        db.session.commit()
+        time.sleep(0.05)
+        self.assertEqual(len(idle.top()), 2)
+
+    def test_trending_page(self):
+        """Does the trending page list the leaders with their authors?"""
+        user = User.signup("testuser1", "test1@test.com", "password", None)
+        db.session.commit()
+        msg = Message(text="Hot take", user_id=user.id)
+        db.session.add(msg)
+        db.session.commit()
+        with mock.patch.object(trending, 'top', return_value=[msg.id]):
+            html = self.client.get('/trending').get_data(as_text=True)
+        self.assertIn('<p>Hot take</p>', html)
+        self.assertIn('@testuser1', html)
+
+    def wait_for(self, worker, count, timeout=5):
+        """`worker.top()` once its background reload has loaded `count` messages."""
+        deadline = time.monotonic() + timeout
+        while len(worker.top()) != count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return worker.top()
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
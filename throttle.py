@@ -0,0 +1,239 @@
+"""Login throttling by account and client IP.
+
+Each key ("account:<username>", "ip:<address>") gets a sliding-window
+counter of failed logins, approximated from two fixed windows: the
+count so far in the current window, plus the previous window's count
+weighted by how much of it still overlaps the sliding window. That
+is three integers per key instead of a timestamp per attempt.
+
+`LoginThrottle.check()` runs before the login view touches the database
+or bcrypt, so an attacker over the limit costs a dict lookup per attempt.
+Counters live in a pluggable store. MemoryCounters is per process;
+FileCounters shares the limits between the worker processes on a host.
+Counters whose windows have both passed are swept from the store at most
+every `sweep_interval` seconds, so a stream of one-off usernames or
+addresses doesn't pile up.
+"""
+
+import fcntl
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCounters:
+    """In-process counters: a bounded LRU dict of (window, previous, current)."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def update(self, key, change):
+        """Atomically replace `key`'s counter with `change(counter or None)`."""
+        with self._lock:
+            self._data[key] = change(self._data.get(key))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def sweep(self, expired):
+        """Remove the counters for which `expired(counter)`; return how many."""
+        with self._lock:
+            keys = [key for key, counter in self._data.items() if expired(counter)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileCounters:
+    """Counters shared by every process on a host: one 24-byte file per key.
+
+    Updates hold an exclusive flock on the key's file while they read
+    and rewrite it. `sweep()` unlinks a file only under that lock, and an
+    update that finds its file unlinked once it holds the lock starts over.
+    """
+
+    RECORD = struct.Struct('<qqq')
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _read(self, f):
+        data = f.read(self.RECORD.size)
+        return self.RECORD.unpack(data) if len(data) == self.RECORD.size else None
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return self._read(f)
+        except FileNotFoundError:
+            return None
+
+    def update(self, key, change):
+        """Atomically replace `key`'s counter with `change(counter or None)`."""
+        while True:
+            fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o600)
+            with os.fdopen(fd, 'r+b') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if os.fstat(f.fileno()).st_nlink == 0:
+                    continue  # swept while we waited for the lock
+                counter = change(self._read(f))
+                f.seek(0)
+                f.write(self.RECORD.pack(*counter))
+                f.truncate()
+                return
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, expired):
+        """Remove the counters for which `expired(counter)`; return how many."""
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    counter = self._read(f)
+                    if counter is None or expired(counter):
+                        os.remove(path)
+                        removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def __len__(self):
+        return len(os.listdir(self.directory))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+
+class LoginThrottle:
+    """Limits failed logins per account and per client IP."""
+
+    def __init__(self, store=None, window=300, max_per_account=5, max_per_ip=20,
+                 sweep_interval=60):
+        self.store = store if store is not None else MemoryCounters()
+        self.window = window
+        self.limits = {'account': max_per_account, 'ip': max_per_ip}
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.failures = 0
+        self.throttled = {'account': 0, 'ip': 0}
+
+    def stats(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'failures': self.failures,
+                    'throttled_account': self.throttled['account'],
+                    'throttled_ip': self.throttled['ip'],
+                    'tracked_keys': len(self.store)}
+
+    def clear(self):
+        self.store.clear()
+
+    def _keys(self, username, ip):
+        return {'account': f'account:{(username or "").lower()}', 'ip': f'ip:{ip}'}
+
+    def _counts(self, counter, now):
+        """(previous window's, current window's) failures as of `now`."""
+        if counter is None:
+            return 0, 0
+        current = int(now // self.window)
+        window, previous, count = counter
+        if window == current:
+            return previous, count
+        if window == current - 1:
+            return count, 0
+        return 0, 0
+
+    def _retry_after(self, counter, limit, now):
+        """Seconds until the sliding count for `counter` drops below `limit`, or 0."""
+        previous, count = self._counts(counter, now)
+        elapsed = now % self.window
+        if count >= limit:
+            # only below once this window slides far enough out of view
+            wait = self.window - elapsed + self.window * (1 - limit / count)
+        elif previous and count + previous * (1 - elapsed / self.window) >= limit:
+            wait = self.window * (1 - (limit - count) / previous) - elapsed
+        else:
+            return 0
+        return max(1, math.ceil(wait))
+
+    def check(self, username, ip):
+        """Return seconds to wait if `username` or `ip` is over its limit, else 0."""
+        now = time.time()
+        for kind, key in self._keys(username, ip).items():
+            wait = self._retry_after(self.store.get(key), self.limits[kind], now)
+            if wait:
+                with self._lock:
+                    self.throttled[kind] += 1
+                return wait
+        with self._lock:
+            self.allowed += 1
+        return 0
+
+    def failed(self, username, ip):
+        """Count a failed login against `username` and `ip`."""
+        current = int(time.time() // self.window)
+
+        def bump(counter):
+            if counter is None or counter[0] < current - 1:
+                return (current, 0, 1)
+            window, previous, count = counter
+            if window == current - 1:
+                return (current, count, 1)
+            return (current, previous, count + 1)
+
+        for key in self._keys(username, ip).values():
+            self.store.update(key, bump)
+        with self._lock:
+            self.failures += 1
+        self._maybe_sweep()
+
+    def succeeded(self, username):
+        """Forget the account's failures after a successful login."""
+        self.store.delete(self._keys(username, None)['account'])
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if time.monotonic() - self._swept_at < self.sweep_interval:
+                return
+            self._swept_at = time.monotonic()
+        self.sweep()
+
+    def sweep(self):
+        """Drop counters with no failures left in the sliding window."""
+        current = int(time.time() // self.window)
+        return self.store.sweep(lambda counter: counter[0] < current - 1)
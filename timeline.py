@@ -0,0 +1,182 @@
+"""In-memory recent-message buffers for profile pages and home feeds."""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+from sqlalchemy import func
+
+from models import db, Message
+
+
+class RecentMessages:
+    """Per-author ring buffers of the newest (timestamp, message id) pairs.
+
+    Each buffer holds an author's `size` most recent messages, newest first.
+    An author with no buffer is a cache miss and is loaded from the database
+    on demand. At most `max_authors` buffers are kept, least recently read
+    first out.
+
+    Buffers live in this process only; each worker keeps its own and only
+    sees the writes it handles itself. Messages posted or deleted through
+    other workers show up once a buffer is `ttl` seconds old and reloaded.
+    """
+
+    def __init__(self, size=100, ttl=30, max_authors=100000):
+        self.size = size
+        self.ttl = ttl
+        self.max_authors = max_authors
+        self._buffers = OrderedDict()   # {author_id: deque}, least recent first
+        self._expires = {}              # {author_id: monotonic reload time}
+        self._loading = {}              # {author_id: [loads in flight, written since]}
+        self._lock = threading.Lock()
+
+    def __contains__(self, author_id):
+        return author_id in self._buffers
+
+    def clear(self):
+        """Drop every buffer."""
+        with self._lock:
+            self._buffers.clear()
+            self._expires.clear()
+
+    def forget(self, author_id):
+        """Drop one author's buffer, so it is reloaded on next use."""
+        with self._lock:
+            self._drop(author_id)
+
+    def _drop(self, author_id):
+        self._buffers.pop(author_id, None)
+        self._expires.pop(author_id, None)
+
+    def _written(self, author_id):
+        """The buffer an add/remove for `author_id` should change, or None.
+
+        Notes the write for any load of the author in flight, whose rows
+        may predate it.
+        """
+        if author_id in self._loading:
+            self._loading[author_id][1] = True
+        return self._buffers.get(author_id)
+
+    def add(self, msg):
+        """Record a newly posted message, if its author is buffered."""
+        entry = (msg.timestamp, msg.id)
+        with self._lock:
+            buf = self._written(msg.user_id)
+            if buf is None:
+                return
+            if not buf or entry >= buf[0]:
+                buf.appendleft(entry)
+                if len(buf) > self.size:
+                    buf.pop()
+            else:
+                # Out-of-order timestamp; rebuild in sorted position.
+                entries = sorted(list(buf) + [entry], reverse=True)
+                self._buffers[msg.user_id] = deque(entries[:self.size])
+
+    def remove(self, msg):
+        """Remove a deleted message from its author's buffer.
+
+        A full buffer that loses an entry no longer knows the author's next
+        oldest message, so it is dropped and reloaded on the next read.
+        """
+        with self._lock:
+            buf = self._written(msg.user_id)
+            if buf is None:
+                return
+            if len(buf) >= self.size:
+                self._drop(msg.user_id)
+                return
+            try:
+                buf.remove((msg.timestamp, msg.id))
+            except ValueError:
+                self._drop(msg.user_id)
+
+    def recent(self, author_id, limit=None):
+        """Return up to `limit` (timestamp, id) pairs for one author."""
+        return self.recent_for([author_id]).get(author_id, [])[:limit]
+
+    def recent_for(self, author_ids):
+        """Return {author_id: [(timestamp, id), ...]} for `author_ids`.
+
+        Buffered authors are answered from memory; the rest (and expired
+        buffers) are fetched with a single windowed query and then
+        buffered, unless a message of theirs was added or removed while
+        the query ran.
+        """
+        author_ids = set(author_ids)
+        now = time.monotonic()
+        with self._lock:
+            found = {}
+            for author_id in author_ids:
+                if author_id in self._buffers and self._expires[author_id] > now:
+                    self._buffers.move_to_end(author_id)
+                    found[author_id] = list(self._buffers[author_id])
+            missing = author_ids - found.keys()
+            for author_id in missing:
+                self._loading.setdefault(author_id, [0, False])[0] += 1
+        if not missing:
+            return found
+
+        loaded = {}
+        try:
+            loaded = self._load(missing)
+        finally:
+            with self._lock:
+                expires = time.monotonic() + self.ttl
+                for author_id in missing:
+                    state = self._loading[author_id]
+                    state[0] -= 1
+                    if author_id in loaded and not state[1]:
+                        self._buffers[author_id] = deque(loaded[author_id])
+                        self._buffers.move_to_end(author_id)
+                        self._expires[author_id] = expires
+                    if not state[0]:
+                        del self._loading[author_id]
+                while len(self._buffers) > self.max_authors:
+                    evicted, _ = self._buffers.popitem(last=False)
+                    del self._expires[evicted]
+        found.update(loaded)
+        return found
+
+    def feed(self, author_ids, limit=100):
+        """Return the ids of the `limit` newest messages across `author_ids`.
+
+        The per-author buffers are already sorted newest first, so the feed
+        is a k-way heap merge that stops after `limit` entries.
+        """
+        buffers = self.recent_for(author_ids).values()
+        merged = heapq.merge(*buffers, reverse=True)
+        return [msg_id for _, msg_id in islice(merged, limit)]
+
+    def _load(self, author_ids):
+        """Fetch the newest `size` messages for each of `author_ids`."""
+        rank = (func.row_number()
+                .over(partition_by=Message.user_id,
+                      order_by=(Message.timestamp.desc(), Message.id.desc()))
+                .label('rank'))
+        ranked = (db.session.query(Message.user_id, Message.timestamp,
+                                   Message.id, rank)
+                  .filter(Message.user_id.in_(author_ids))
+                  .subquery())
+        rows = (db.session.query(ranked.c.user_id, ranked.c.timestamp,
+                                 ranked.c.id)
+                .filter(ranked.c.rank <= self.size)
+                .order_by(ranked.c.user_id, ranked.c.timestamp.desc(),
+                          ranked.c.id.desc()))
+
+        loaded = {author_id: [] for author_id in author_ids}
+        for user_id, timestamp, msg_id in rows:
+            loaded[user_id].append((timestamp, msg_id))
+        return loaded
+
+
+def messages_by_ids(ids):
+    """Load Message rows for `ids`, returned in the same order as `ids`."""
+    if not ids:
+        return []
+    by_id = {m.id: m for m in Message.query.filter(Message.id.in_(ids))}
+    return [by_id[i] for i in ids if i in by_id]
@@ -0,0 +1,156 @@
+"""Trending warbles: like counts decayed by message age, top-K in memory.
+
+A message's score is `likes * 2 ** (age_of_message / half_life)` measured
+from a fixed epoch, so newer messages need fewer likes to rank. Working in
+log space (log(likes) + timestamp * ln 2 / half_life) keeps the numbers
+small, and since every score grows at the same rate over time the ranking
+never has to be re-decayed; only the liked message's score changes.
+
+The `likes` table is the source of truth. Each worker applies the like
+changes it flushes itself at once, and a background thread reloads every
+count from the table every `refresh_interval` seconds, which brings in
+likes flushed by other workers (and a `flask recompute-trending` run).
+Reads never wait for a reload; until a worker's first one lands it only
+knows the likes it flushed itself.
+"""
+
+import heapq
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+from models import db, Likes, Message
+
+
+def _epoch(ts):
+    return ts.replace(tzinfo=timezone.utc).timestamp()
+
+
+class Trending:
+    """Incrementally maintained leaderboard of the top `size` messages.
+
+    Like counts are kept only for messages newer than `window`; older ones
+    have decayed too far to trend. With `refresh_interval=None`, or
+    without `init_app()`, the counts are never reloaded from the database.
+    """
+
+    def __init__(self, size=50, half_life=timedelta(hours=12),
+                 window=timedelta(days=3), refresh_interval=60):
+        self.size = size
+        self.rate = math.log(2) / half_life.total_seconds()
+        self.window = window.total_seconds()
+        self.refresh_interval = refresh_interval
+
+        self._counts = {}           # {message_id: [likes, timestamp]}
+        self._top = {}              # {message_id: score}, at most `size`
+        self._stale = False         # a top entry lost likes; rebuild on read
+        self._refreshed_at = None   # monotonic time of the last recompute
+        self._lock = threading.Lock()
+        self._pid = None            # process whose refresher is running
+        self.app = None
+
+    def init_app(self, app):
+        """Reload counts from `app`'s database in a background thread."""
+        self.app = app
+
+    def score(self, likes, timestamp):
+        """Log-space decayed score of `likes` on a message sent at `timestamp`."""
+        return math.log(likes) + timestamp * self.rate
+
+    def update(self, changes):
+        """Apply [(user_id, message_id, message_datetime, +1/-1), ...] like changes."""
+        cutoff = time.time() - self.window
+        with self._lock:
+            for _, message_id, sent, delta in changes:
+                timestamp = _epoch(sent)
+                if timestamp < cutoff:
+                    continue
+                entry = self._counts.setdefault(message_id, [0, timestamp])
+                entry[0] += delta
+                if entry[0] <= 0:
+                    del self._counts[message_id]
+                    if self._top.pop(message_id, None) is not None:
+                        self._stale = True
+                elif delta < 0 and message_id in self._top:
+                    self._stale = True
+                else:
+                    self._offer(message_id, self.score(*entry))
+
+    def discard(self, message_id):
+        """Forget a deleted message."""
+        with self._lock:
+            self._counts.pop(message_id, None)
+            if self._top.pop(message_id, None) is not None:
+                self._stale = True
+
+    def top(self, n=None):
+        """Return the ids of the `n` highest-scoring messages, best first.
+
+        The first read in a process starts its background refresher.
+        """
+        self._ensure_process()
+        with self._lock:
+            if self._stale:
+                self._rebuild()
+            ranked = sorted(self._top.items(), key=lambda item: item[1], reverse=True)
+        return [message_id for message_id, _ in ranked[:n]]
+
+    def recompute(self):
+        """Rebuild all counts from the `likes` table (batch job)."""
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        rows = (db.session.query(Message.id, Message.timestamp, func.count(Likes.id))
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Message.timestamp >= since)
+                .group_by(Message.id, Message.timestamp))
+        counts = {message_id: [likes, _epoch(sent)] for message_id, sent, likes in rows}
+        with self._lock:
+            self._counts = counts
+            self._rebuild()
+            self._refreshed_at = time.monotonic()
+        return len(counts)
+
+    def _ensure_process(self):
+        """Start the refresher for this process; again after a fork."""
+        if self.refresh_interval is None or self.app is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name='trending-refresh').start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                with self.app.app_context():
+                    self.recompute()
+            except Exception:
+                self.app.logger.exception("Reloading trending counts failed")
+            time.sleep(self.refresh_interval)
+
+    def _offer(self, message_id, score):
+        """Put a message into the top-K if it scores high enough."""
+        if message_id in self._top or len(self._top) < self.size:
+            self._top[message_id] = score
+            return
+        lowest = min(self._top, key=self._top.get)
+        if score > self._top[lowest]:
+            del self._top[lowest]
+            self._top[message_id] = score
+
+    def _rebuild(self):
+        self._prune()
+        best = heapq.nlargest(self.size, self._counts.items(),
+                              key=lambda item: self.score(*item[1]))
+        self._top = {message_id: self.score(*entry) for message_id, entry in best}
+        self._stale = False
+
+    def _prune(self):
+        cutoff = time.time() - self.window
+        self._counts = {message_id: entry for message_id, entry in self._counts.items()
+                        if entry[1] >= cutoff}